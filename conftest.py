@@ -0,0 +1,49 @@
+""" Fixtures shared by the tests next to test_environment.py
+
+    The tests run on a small seeded dataset written by the benchmark
+    generator and loaded with the ingest functions.
+"""
+import os
+import sys
+import pytest
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+# the pipeline modules import their siblings by bare name
+for package in ['data', 'features', 'models', 'benchmarks']:
+    sys.path.insert(0, os.path.join(SRC_DIR, package))
+
+
+@pytest.fixture(scope='session')
+def raw_data_dir(tmp_path_factory):
+    """ Directory holding a month of generated raw data under data/raw """
+    import generate_data
+
+    root = tmp_path_factory.mktemp('raw_data')
+    generate_data.generate_raw_data(str(root), flight_rows=3000, months=1)
+    return root
+
+
+@pytest.fixture(scope='session')
+def ingested_database(raw_data_dir):
+    """ Connection string of the generated data, loaded and indexed """
+    import build_delay_summary as summary
+    import load_airport_data as airports
+    import load_flight_data as flights
+    import load_weather_data as weather
+    import manage_indexes as indexes
+    import match_weather_stations as stations
+
+    path_to_db = 'sqlite:///' + str(raw_data_dir / 'airlines.db')
+    working_dir = os.getcwd()
+    # the loaders find raw files relative to the working directory
+    os.chdir(raw_data_dir)
+    try:
+        airports.load_airport_data(path_to_db)
+        weather.load_weather_data(path_to_db)
+        flights.load_flight_data(path_to_db)
+    finally:
+        os.chdir(working_dir)
+    summary.update_delay_summary(path_to_db)
+    stations.build_station_mapping(path_to_db, k=1)
+    indexes.create_indexes(path_to_db)
+    return path_to_db
@@ -0,0 +1,117 @@
+""" Compare the pipelined ingest with the sequential loop
+
+    Generated raw data is loaded into a fresh database in both modes, the
+    report holds the median seconds of each loader and the backpressure
+    metrics of the pipelined runs.
+"""
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir)
+# the data modules import their siblings by bare name
+sys.path.insert(0, os.path.join(SRC_DIR, 'data'))
+import generate_data  # noqa: E402
+import load_airport_data as airports  # noqa: E402
+import load_flight_data as flights  # noqa: E402
+import load_weather_data as weather  # noqa: E402
+from run_benchmarks import get_commit, get_config  # noqa: E402
+
+PROJECT_DIR = os.path.join(SRC_DIR, os.pardir)
+
+PATH_TO_DB = 'sqlite:///data/processed/airlines.db'
+
+LOADERS = {
+    'airports': airports.load_airport_data,
+    'weather': weather.load_weather_data,
+    'flights': flights.load_flight_data
+}
+
+
+def load_once(pipelined):
+    """ Load every raw file into an empty database
+
+        Returns the seconds and LoadStats of each loader.
+    """
+    database = PATH_TO_DB[len('sqlite:///'):]
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+
+    results = {}
+    for name, load in LOADERS.items():
+        started = time.perf_counter()
+        stats = load(PATH_TO_DB, pipelined=pipelined)
+        results[name] = (time.perf_counter() - started, stats)
+    return results
+
+
+def benchmark_ingest_pipeline(root, repeat):
+    """ Time both modes on the raw data under root, alternating runs """
+    runs = {'sequential': [], 'pipelined': []}
+    working_dir = os.getcwd()
+    os.makedirs(os.path.join(root, 'data', 'processed'), exist_ok=True)
+    os.chdir(root)
+    try:
+        for _ in range(repeat):
+            for mode in runs:
+                runs[mode].append(load_once(mode == 'pipelined'))
+    finally:
+        os.chdir(working_dir)
+
+    report = {}
+    for name in LOADERS:
+        sequential = statistics.median(r[name][0] for r in runs['sequential'])
+        pipelined = statistics.median(r[name][0] for r in runs['pipelined'])
+        stats = runs['pipelined'][-1][name][1]
+        report[name] = {
+            'rows': stats.rows,
+            'sequential_seconds': sequential,
+            'pipelined_seconds': pipelined,
+            'speedup': sequential / pipelined,
+            'pipeline': stats.pipeline
+        }
+    return report
+
+
+def main():
+    """ Run the comparison and write the report """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.WARNING, format=log_fmt)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.INFO)
+
+    config = get_config()
+    repeat = int(os.environ.get('BENCHMARK_REPEAT', 3))
+    root = os.environ.get('BENCHMARK_DIR') or tempfile.mkdtemp()
+    try:
+        generate_data.generate_raw_data(
+            root, config['flight_rows'], config['months'], config['year'],
+            config['seed'], config['dirty_rate'])
+        loaders = benchmark_ingest_pipeline(os.path.abspath(root), repeat)
+    finally:
+        if not os.environ.get('BENCHMARK_DIR'):
+            shutil.rmtree(root)
+
+    for name, result in loaders.items():
+        logger.info(f'{name}: {result["sequential_seconds"]:.2f}s '
+                    f'sequential, {result["pipelined_seconds"]:.2f}s '
+                    f'pipelined, {result["speedup"]:.2f}x')
+    report = {'commit': get_commit(), 'config': config, 'repeat': repeat,
+              'cpus': os.cpu_count(), 'loaders': loaders}
+    output = os.environ.get('BENCHMARK_OUTPUT', os.path.join(
+        PROJECT_DIR, 'reports', 'benchmarks', 'ingest_pipeline.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Wrote {output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+""" Time command line startup, from process launch until exit
+
+    Each command runs in a fresh interpreter, the report holds the median
+    and fastest wall time of every command and the slowest imports of the
+    CLI help.
+"""
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir)
+
+PROJECT_DIR = os.path.normpath(os.path.join(SRC_DIR, os.pardir))
+
+CLI = os.path.join(SRC_DIR, 'cli.py')
+
+# wall time of interpreter startup, the heavy imports and the cli commands
+COMMANDS = {
+    'python': ['-c', 'pass'],
+    'import pandas, sqlalchemy': ['-c', 'import pandas, sqlalchemy'],
+    'cli --help': [CLI, '--help'],
+    'cli query --help': [CLI, 'query', '--help'],
+    'make_dataset import': [
+        '-c', 'import sys; sys.path.insert(0, "src/data"); '
+              'import make_dataset'],
+    'make_prepared_features import': [
+        '-c', 'import sys; sys.path.insert(0, "src/features"); '
+              'import make_prepared_features'],
+}
+
+
+def time_command(args, repeat):
+    """ Return the wall seconds of repeated runs of a python command """
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=PROJECT_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def get_slowest_imports(args, count=10):
+    """ Return the modules with the largest cumulative import time
+
+        Parsed from python -X importtime, in microseconds.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            cwd=PROJECT_DIR, check=True, text=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # only top level imports, nested ones are part of their parent
+        if not module.startswith('  '):
+            imports.append((module.strip(), int(cumulative)))
+    return dict(sorted(imports, key=lambda i: -i[1])[:count])
+
+
+def benchmark_startup(repeat):
+    """ Return the startup time of every command, in milliseconds """
+    report = {}
+    for name, args in COMMANDS.items():
+        seconds = time_command(args, repeat)
+        report[name] = {
+            'median_ms': statistics.median(seconds) * 1000,
+            'min_ms': min(seconds) * 1000
+        }
+    return report
+
+
+def main():
+    """ Time every command and write the report """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    logger = logging.getLogger(__name__)
+
+    repeat = int(os.environ.get('BENCHMARK_REPEAT', 10))
+    report = {
+        'python': sys.version.split()[0],
+        'repeat': repeat,
+        'commands': benchmark_startup(repeat),
+        'cli_help_imports_us': get_slowest_imports(COMMANDS['cli --help'])
+    }
+    for name, times in report['commands'].items():
+        logger.info(f'{name}: {times["median_ms"]:.0f} ms median, '
+                    f'{times["min_ms"]:.0f} ms fastest')
+
+    output = os.environ.get('BENCHMARK_OUTPUT', os.path.join(
+        PROJECT_DIR, 'reports', 'benchmarks', 'startup.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Wrote {output}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
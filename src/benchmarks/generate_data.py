@@ -0,0 +1,345 @@
+""" Generate seeded synthetic raw files in the layout of data/raw
+
+    Flights follow the BTS On_Time_On_Time CSVs, weather the NOAA LCD
+    CSVs and airports the BTS MASTER_CORD file. Values are plausible rather
+    than real, and a share of them is dirtied the way the raw files are.
+"""
+from collections import namedtuple
+import calendar
+import datetime as datetime
+import os
+import sys
+import click
+import numpy as np
+import pandas as pd
+
+Airport = namedtuple('Airport', ['code', 'airport_id', 'wban', 'latitude',
+                                 'longitude', 'city', 'state'])
+
+AIRPORTS = [
+    Airport('ATL', 10397, 13874, 33.6367, -84.4281, 'Atlanta', 'GA'),
+    Airport('BOS', 10721, 14739, 42.3656, -71.0096, 'Boston', 'MA'),
+    Airport('DEN', 11292, 3017, 39.8617, -104.6731, 'Denver', 'CO'),
+    Airport('DFW', 11298, 3927, 32.8968, -97.0380, 'Dallas/Fort Worth', 'TX'),
+    Airport('JFK', 12478, 94789, 40.6398, -73.7789, 'New York', 'NY'),
+    Airport('LAX', 12892, 23174, 33.9425, -118.4081, 'Los Angeles', 'CA'),
+    Airport('MDT', 13230, 14751, 40.1935, -76.7634, 'Harrisburg', 'PA'),
+    Airport('ORD', 13930, 94846, 41.9786, -87.9048, 'Chicago', 'IL'),
+    Airport('SEA', 14747, 24233, 47.4490, -122.3093, 'Seattle', 'WA'),
+    Airport('SFO', 14771, 23234, 37.6190, -122.3749, 'San Francisco', 'CA')
+]
+
+CARRIERS = {'AA': 19805, 'AS': 19930, 'B6': 20409, 'DL': 19790,
+            'NK': 20416, 'UA': 19977, 'WN': 19393}
+
+CANCELLATION_CODES = ['A', 'B', 'C', 'D']
+
+
+def get_flight_file(root, year, month):
+    return os.path.join(root, 'data', 'raw', 'flights',
+                        f'On_Time_On_Time_Performance_{year}_{month}.csv')
+
+
+def get_weather_file(root, airport, year):
+    return os.path.join(root, 'data', 'raw', 'weather',
+                        f'{airport.code}_{year}.csv')
+
+
+def get_airport_file(root):
+    return os.path.join(root, 'data', 'raw', 'airports',
+                        'T_MASTER_CORD_All_All.csv')
+
+
+def get_distances(origins, dests):
+    """ Return great circle distances in miles between airport indices """
+    latitude = np.radians([a.latitude for a in AIRPORTS])
+    longitude = np.radians([a.longitude for a in AIRPORTS])
+    a = np.sin((latitude[dests] - latitude[origins]) / 2) ** 2 \
+        + np.cos(latitude[origins]) * np.cos(latitude[dests]) \
+        * np.sin((longitude[dests] - longitude[origins]) / 2) ** 2
+    return np.round(2 * 3958.8 * np.arcsin(np.sqrt(a)))
+
+
+def to_clock(minutes):
+    """ Return minutes after midnight as hhmm numbers, 24:00 as 2400 """
+    minutes = minutes % 1440
+    clock = (minutes // 60) * 100 + minutes % 60
+    return np.where(clock == 0, 2400, clock)
+
+
+def to_time_blocks(clock):
+    """ Return the hour block of hhmm numbers, e.g. 0600-0659 """
+    hours = (np.asarray(clock, dtype=np.int64) // 100) % 24
+    return np.array([f'{h:02d}00-{h:02d}59' for h in range(24)])[hours]
+
+
+def dirty(values, rng, rate, replacement=np.nan):
+    """ Return values with a share of them replaced """
+    values = values.astype(object)
+    values[rng.random(len(values)) < rate] = replacement
+    return values
+
+
+def generate_flights(file_name, rows, year=2017, month=1, seed=0,
+                     dirty_rate=0.02):
+    """ Write a month of flights as an On_Time_On_Time CSV
+
+        Around one in five departures is delayed 15 minutes or more and a
+        few are cancelled or diverted, leaving times and delays blank.
+        dirty_rate sets the share of missing tail numbers, scheduled times
+        of 2400 and unparseable extra columns.
+    """
+    rng = np.random.default_rng(seed)
+    days = rng.integers(1, calendar.monthrange(year, month)[1] + 1, rows)
+    dates = pd.to_datetime(pd.DataFrame(
+        {'year': year, 'month': month, 'day': days}))
+    origins = rng.integers(0, len(AIRPORTS), rows)
+    dests = (origins + rng.integers(1, len(AIRPORTS), rows)) % len(AIRPORTS)
+    carriers = rng.choice(list(CARRIERS), rows)
+    distance = get_distances(origins, dests)
+    elapsed = np.round(distance / 8 + 30 + rng.normal(0, 5, rows))
+
+    scheduled = rng.integers(5 * 60, 24 * 60, rows)
+    delay = np.round(rng.gamma(0.6, 25, rows) - 8)
+    arrival_delay = np.round(delay + rng.normal(0, 10, rows))
+    cancelled = rng.random(rows) < 0.015
+    diverted = ~cancelled & (rng.random(rows) < 0.003)
+    departed = ~cancelled
+    arrived = ~cancelled & ~diverted
+
+    departure_time = np.where(departed, to_clock(scheduled + delay), np.nan)
+    arrival_scheduled = to_clock(scheduled + elapsed)
+    arrival_time = np.where(arrived, to_clock(scheduled + elapsed
+                                              + arrival_delay), np.nan)
+    tail_numbers = np.array([f'N{n}{s}' for n, s in zip(
+        rng.integers(100, 999, rows), rng.choice(list('ABCDEFJKLMNRUW'),
+                                                 rows))])
+
+    flights = pd.DataFrame({
+        'Year': year,
+        'Quarter': (month - 1) // 3 + 1,
+        'Month': month,
+        'DayofMonth': days,
+        'DayOfWeek': dates.dt.dayofweek + 1,
+        'FlightDate': dates.dt.strftime('%Y-%m-%d'),
+        'UniqueCarrier': carriers,
+        'AirlineID': [CARRIERS[c] for c in carriers],
+        'Carrier': carriers,
+        'TailNum': dirty(tail_numbers, rng, dirty_rate),
+        'FlightNum': rng.integers(1, 7000, rows),
+        'OriginAirportID': [AIRPORTS[i].airport_id for i in origins],
+        'OriginAirportSeqID': [AIRPORTS[i].airport_id * 100 + 3
+                               for i in origins],
+        'Origin': [AIRPORTS[i].code for i in origins],
+        'OriginCityName': [f'{AIRPORTS[i].city}, {AIRPORTS[i].state}'
+                           for i in origins],
+        'DestAirportID': [AIRPORTS[i].airport_id for i in dests],
+        'DestAirportSeqID': [AIRPORTS[i].airport_id * 100 + 3
+                             for i in dests],
+        'Dest': [AIRPORTS[i].code for i in dests],
+        'DestCityName': [f'{AIRPORTS[i].city}, {AIRPORTS[i].state}'
+                         for i in dests],
+        'CRSDepTime': dirty(to_clock(scheduled), rng, dirty_rate, 2400),
+        'DepTime': departure_time,
+        'DepDelay': np.where(departed, delay, np.nan),
+        'DepDel15': np.where(departed, delay >= 15, np.nan),
+        'DepTimeBlk': to_time_blocks(to_clock(scheduled)),
+        'CRSArrTime': arrival_scheduled,
+        'ArrTime': arrival_time,
+        'ArrDelay': np.where(arrived, arrival_delay, np.nan),
+        'ArrDel15': np.where(arrived, arrival_delay >= 15, np.nan),
+        'ArrTimeBlk': to_time_blocks(arrival_scheduled),
+        'Cancelled': cancelled.astype(float),
+        'CancellationCode': np.where(
+            cancelled, rng.choice(CANCELLATION_CODES, rows), None),
+        'Diverted': diverted.astype(float),
+        'CRSElapsedTime': elapsed,
+        'ActualElapsedTime': np.where(arrived, elapsed + arrival_delay
+                                      - delay, np.nan),
+        'Flights': 1.0,
+        'Distance': distance,
+        'DistanceGroup': np.minimum(distance // 250 + 1, 11),
+        'CarrierDelay': dirty(np.where(arrival_delay >= 15, 0.0, np.nan),
+                              rng, dirty_rate, 'NA'),
+        # the raw files end every line with a comma
+        '': None
+    })
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    flights.to_csv(file_name, index=False, float_format='%.2f')
+    return len(flights)
+
+
+def generate_weather(file_name, airport, start, end, seed=0,
+                     dirty_rate=0.02):
+    """ Write observations at one station as an LCD CSV
+
+        Routine reports come at 51 minutes past each hour, with special
+        reports in between. dirty_rate sets the share of values that are
+        blank, flagged as suspect with an 's' suffix or marked '*', on top
+        of the trace precipitation and variable visibility found in LCD.
+    """
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range(start, end, freq='H', inclusive='left')
+    specials = hours[rng.integers(0, len(hours), len(hours) // 5)] \
+        + pd.to_timedelta(rng.integers(0, 50, len(hours) // 5), unit='m')
+    times = (hours + pd.Timedelta(minutes=51)).append(specials) \
+        .sort_values()
+    rows = len(times)
+    report_types = np.where(times.minute == 51, 'FM-15', 'FM-16')
+
+    day_of_year = times.dayofyear.to_numpy()
+    hour_of_day = times.hour.to_numpy()
+    temperature = np.round(
+        55 - 20 * np.cos(2 * np.pi * (day_of_year - 15) / 365)
+        + 8 * np.sin(2 * np.pi * (hour_of_day - 9) / 24)
+        - (airport.latitude - 35) + rng.normal(0, 3, rows))
+    dew_point = np.round(temperature - rng.gamma(2, 4, rows))
+    humidity = np.clip(np.round(100 - 3 * (temperature - dew_point)), 5, 100)
+    wind_speed = np.round(rng.gamma(2, 4, rows))
+    gusts = np.where(wind_speed > 15, wind_speed + rng.integers(5, 15, rows),
+                     np.nan)
+    raining = rng.random(rows) < 0.1
+    precipitation = np.where(raining, np.round(rng.gamma(1, 0.05, rows), 2),
+                             0.0).astype(object)
+    precipitation[raining & (rng.random(rows) < 0.3)] = 'T'
+    visibility = np.where(raining, rng.integers(1, 10, rows), 10) \
+        .astype(object)
+    visibility[rng.random(rows) < 0.01] = '10V'
+    pressure = np.round(29.6 + rng.normal(0, 0.2, rows)
+                        - airport.latitude / 1000, 2)
+
+    def measurement(values):
+        values = dirty(values, rng, dirty_rate / 3)
+        values = dirty(values, rng, dirty_rate / 3, '*')
+        suspect = (rng.random(rows) < dirty_rate / 3) & pd.notna(values) \
+            & (values != '*')
+        values[suspect] = [f'{v}s' for v in values[suspect]]
+        return values
+
+    weather = pd.DataFrame({
+        'STATION': f'WBAN:{airport.wban:05d}',
+        'STATION_NAME': f'{airport.city.upper()} INTERNATIONAL AIRPORT '
+                        f'{airport.state} US',
+        'ELEVATION': 100.0,
+        'LATITUDE': round(airport.latitude + 0.01, 4),
+        'LONGITUDE': round(airport.longitude - 0.01, 4),
+        'DATE': times.strftime('%Y-%m-%d %H:%M'),
+        'REPORTTPYE': report_types,
+        'HOURLYSKYCONDITIONS': np.where(raining, 'OVC:08 10', 'CLR:00'),
+        'HOURLYVISIBILITY': measurement(visibility),
+        'HOURLYPRSENTWEATHERTYPE': np.where(raining, 'RA:02 |RA |', None),
+        'HOURLYDRYBULBTEMPF': measurement(temperature),
+        'HOURLYDRYBULBTEMPC': np.round((temperature - 32) / 1.8, 1),
+        'HOURLYWETBULBTEMPF': measurement(np.round((temperature + dew_point)
+                                                   / 2)),
+        'HOURLYDewPointTempF': measurement(dew_point),
+        'HOURLYRelativeHumidity': measurement(humidity),
+        'HOURLYWindSpeed': measurement(wind_speed),
+        'HOURLYWindDirection': measurement(
+            np.where(wind_speed == 0, '000',
+                     rng.integers(1, 37, rows) * 10).astype(object)),
+        'HOURLYWindGustSpeed': gusts,
+        'HOURLYStationPressure': measurement(pressure),
+        'HOURLYPrecip': measurement(precipitation)
+    })
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    weather.to_csv(file_name, index=False)
+    return len(weather)
+
+
+def generate_airports(file_name, airports=AIRPORTS):
+    """ Write a MASTER_CORD file, with a closed earlier record for each
+        airport and its current record
+    """
+    records = []
+    for airport in airports:
+        for latest in [0, 1]:
+            records.append({
+                'AIRPORT_SEQ_ID': airport.airport_id * 100 + 2 + latest,
+                'AIRPORT_ID': airport.airport_id,
+                'AIRPORT': airport.code,
+                'DISPLAY_AIRPORT_NAME': f'{airport.city} International',
+                'DISPLAY_AIRPORT_CITY_NAME_FULL':
+                    f'{airport.city}, {airport.state}',
+                'AIRPORT_WAC_SEQ_ID2': 1,
+                'AIRPORT_WAC': 1,
+                'AIRPORT_COUNTRY_NAME': 'United States',
+                'AIRPORT_COUNTRY_CODE_ISO': 'US',
+                'AIRPORT_STATE_NAME': airport.state,
+                'AIRPORT_STATE_CODE': airport.state,
+                'AIRPORT_STATE_FIPS': 1,
+                'CITY_MARKET_SEQ_ID': 3000000 + airport.airport_id,
+                'CITY_MARKET_ID': 30000 + airport.airport_id % 1000,
+                'DISPLAY_CITY_MARKET_NAME_FULL':
+                    f'{airport.city}, {airport.state}',
+                'CITY_MARKET_WAC_SEQ_ID2': 1,
+                'CITY_MARKET_WAC': 1,
+                'LAT_DEGREES': int(abs(airport.latitude)),
+                'LAT_HEMISPHERE': 'N',
+                'LAT_MINUTES': int(abs(airport.latitude) * 60 % 60),
+                'LAT_SECONDS': int(abs(airport.latitude) * 3600 % 60),
+                'LATITUDE': airport.latitude - 0.1 * (1 - latest),
+                'LON_DEGREES': int(abs(airport.longitude)),
+                'LON_HEMISPHERE': 'W',
+                'LON_MINUTES': int(abs(airport.longitude) * 60 % 60),
+                'LON_SECONDS': int(abs(airport.longitude) * 3600 % 60),
+                'LONGITUDE': airport.longitude,
+                'UTC_LOCAL_TIME_VARIATION': '-0500',
+                'AIRPORT_START_DATE': '1990-01-01' if latest == 0
+                else '2005-07-01',
+                'AIRPORT_THRU_DATE': '2005-06-30' if latest == 0 else None,
+                'AIRPORT_IS_CLOSED': 0,
+                'AIRPORT_IS_LATEST': latest,
+                '': None
+            })
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    pd.DataFrame(records).to_csv(file_name, index=False)
+    return len(records)
+
+
+def generate_raw_data(root, flight_rows=100000, months=1, year=2017, seed=0,
+                      dirty_rate=0.02):
+    """ Write airports, flights split over months and the weather at every
+        airport over those months under root/data/raw
+
+        Returns the number of rows written per dataset.
+    """
+    rows = {'airports': generate_airports(get_airport_file(root))}
+    rows['flights'] = sum(
+        generate_flights(get_flight_file(root, year, month),
+                         flight_rows // months, year, month,
+                         seed + month, dirty_rate)
+        for month in range(1, months + 1))
+
+    start = datetime.date(year, 1, 1)
+    end = datetime.date(year + months // 12, months % 12 + 1, 1)
+    rows['weather'] = sum(
+        generate_weather(get_weather_file(root, airport, year), airport,
+                         start, end, seed + i, dirty_rate)
+        for i, airport in enumerate(AIRPORTS))
+    return rows
+
+
+@click.command()
+@click.argument('root', default='.',
+                type=click.Path(file_okay=False, writable=True))
+@click.option('--flight-rows', default=100000, show_default=True,
+              envvar='BENCHMARK_FLIGHT_ROWS', help='Flights over all months.')
+@click.option('--months', default=1, show_default=True,
+              envvar='BENCHMARK_MONTHS', help='Months of flights and weather.')
+@click.option('--year', default=2017, show_default=True)
+@click.option('--seed', default=0, show_default=True, envvar='BENCHMARK_SEED')
+@click.option('--dirty-rate', default=0.02, show_default=True,
+              envvar='BENCHMARK_DIRTY_RATE',
+              help='Share of values dirtied like the raw files.')
+def main(root, flight_rows, months, year, seed, dirty_rate):
+    """ Generate raw data under ROOT/data/raw, by default the working
+        directory
+    """
+    rows = generate_raw_data(os.path.abspath(root), flight_rows, months,
+                             year, seed, dirty_rate)
+    click.echo(rows)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,354 @@
+""" Time each ingest and feature stage on generated raw data
+
+    Reports rows per second and peak memory of every stage as JSON, so
+    runs can be compared across commits.
+"""
+from datetime import date, timedelta
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+from sqlalchemy import create_engine
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir)
+# the data and feature modules import their siblings by bare name
+sys.path.insert(0, os.path.join(SRC_DIR, 'data'))
+sys.path.insert(0, os.path.join(SRC_DIR, 'features'))
+import generate_data  # noqa: E402
+from data_helpers import get_rss, run_with_peak_rss  # noqa: E402
+import database_writer as writer  # noqa: E402
+import load_airport_data as airports  # noqa: E402
+import load_flight_data as flights  # noqa: E402
+import load_weather_data as weather  # noqa: E402
+import build_delay_summary as summary  # noqa: E402
+import manage_indexes as indexes  # noqa: E402
+import match_weather_stations as stations  # noqa: E402
+import query_flights  # noqa: E402
+import build_features  # noqa: E402
+import feature_helpers as helpers  # noqa: E402
+import build_flight_features as flight_builder  # noqa: E402
+import build_weather_features as weather_builder  # noqa: E402
+
+PROJECT_DIR = os.path.join(SRC_DIR, os.pardir)
+
+PATH_TO_DB = 'sqlite:///data/processed/airlines.db'
+
+
+def get_config():
+    """ Return the benchmark settings, from BENCHMARK_* variables """
+    return {
+        'flight_rows': int(os.environ.get('BENCHMARK_FLIGHT_ROWS', 100000)),
+        'months': int(os.environ.get('BENCHMARK_MONTHS', 1)),
+        'dirty_rate': float(os.environ.get('BENCHMARK_DIRTY_RATE', 0.02)),
+        'seed': int(os.environ.get('BENCHMARK_SEED', 0)),
+        # rows timed on the row by row paths the vectorized ones replaced
+        'row_wise_rows': int(os.environ.get('BENCHMARK_ROW_WISE_ROWS',
+                                            10000)),
+        'year': 2017
+    }
+
+
+def get_commit():
+    """ Return the checked out commit, or None outside of a git checkout """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(stages, name, func, count=len):
+    """ Run one stage and append its timing record to stages
+
+        count returns the rows handled from the stage result, or is None
+        for stages without a row count.
+    """
+    logger = logging.getLogger(__name__)
+    rss = get_rss()
+    started, cpu_started = time.perf_counter(), time.process_time()
+    result, peak_rss = run_with_peak_rss(func)
+    seconds = time.perf_counter() - started
+
+    rows = count(result) if count is not None else None
+    stages.append({
+        'stage': name,
+        'rows': rows,
+        'seconds': seconds,
+        'cpu_seconds': time.process_time() - cpu_started,
+        'rows_per_second': rows / seconds if rows is not None else None,
+        'peak_rss_mb': peak_rss / 1024 ** 2,
+        'rss_growth_mb': (peak_rss - rss) / 1024 ** 2
+        if rss is not None else None
+    })
+    logger.info(f'{name}: {seconds:.3f}s, {rows} rows, '
+                f'peak {peak_rss / 1024 ** 2:.0f} MB')
+    return result
+
+
+def count_rows(frames):
+    """ Return the rows of a list of dataframes or series """
+    return sum(len(f) for f in frames)
+
+
+def benchmark_parsing(stages, root, config):
+    """ Parse and transform raw files in memory, without a database
+
+        Returns the transformed flights.
+    """
+    flight_files = [generate_data.get_flight_file(root, config['year'], m)
+                    for m in range(1, config['months'] + 1)]
+    weather_files = [generate_data.get_weather_file(root, a, config['year'])
+                     for a in generate_data.AIRPORTS]
+
+    data = run_stage(stages, 'parse.flights', lambda: pd.concat(
+        [flights.read_flight_data_from_csv(f) for f in flight_files]))
+    transformed = run_stage(stages, 'transform.flights',
+                            lambda: flights.handle_flight_features(data))
+    benchmark_time_parsing(stages, data, config)
+
+    raw = run_stage(stages, 'parse.weather', lambda: [
+        weather.read_weather_data_from_csv(f) for f in weather_files],
+        count=count_rows)
+
+    def transform_weather():
+        hourly = []
+        for frame in raw:
+            frame = weather.convert_weather_types(frame)
+            frame, _ = weather.fill_missing_weather(frame)
+            frame = weather.add_fuzzy_location(frame)
+            hourly.append(weather.build_hourly_weather(frame))
+        return hourly
+    run_stage(stages, 'transform.weather', transform_weather,
+              count=lambda _: sum(len(f) for f in raw))
+    return transformed
+
+
+def benchmark_time_parsing(stages, data, config):
+    """ Convert the HHMM time columns of parsed flights with infer_time
+        applied per row, on a sample, and with infer_times per column
+    """
+    columns = [data[f.raw_name] for f in flights.identify_flight_features()
+               if f.dtype == 'time']
+    sample = [c.iloc[:config['row_wise_rows']] for c in columns]
+    run_stage(stages, 'transform.infer_time',
+              lambda: [c.apply(flights.infer_time) for c in sample],
+              count=count_rows)
+    run_stage(stages, 'transform.infer_times',
+              lambda: [flights.infer_times(c) for c in columns],
+              count=count_rows)
+
+
+def benchmark_writes(stages, root, data, chunksize=10000):
+    """ Write transformed flights chunk by chunk into empty databases with
+        DataFrame.to_sql, as the loaders did, and with the executemany
+        bulk writer that replaced it
+    """
+    chunks = [data.iloc[i:i + chunksize]
+              for i in range(0, len(data), chunksize)]
+    paths = {}
+    for name in ['to_sql', 'executemany']:
+        database = os.path.join(root, 'data', 'interim', f'{name}.db')
+        os.makedirs(os.path.dirname(database), exist_ok=True)
+        if os.path.exists(database):
+            os.remove(database)
+        paths[name] = 'sqlite:///' + database
+
+    def write_to_sql():
+        engine = create_engine(paths['to_sql'])
+        with engine.connect() as connection:
+            for chunk in chunks:
+                chunk.to_sql('flights', connection, if_exists='append')
+        engine.dispose()
+
+    run_stage(stages, 'write.to_sql', write_to_sql,
+              count=lambda _: len(data))
+    run_stage(stages, 'write.executemany',
+              lambda: writer.write_dataframes(
+                  paths['executemany'], 'flights',
+                  flights.get_flight_columns(), chunks),
+              count=lambda _: len(data))
+
+
+def benchmark_ingest(stages, rows):
+    """ Load the raw files into sqlite as make_dataset does """
+    run_stage(stages, 'write.airports',
+              lambda: airports.load_airport_data(PATH_TO_DB),
+              count=lambda _: rows['airports'])
+    run_stage(stages, 'write.weather',
+              lambda: weather.load_weather_data(PATH_TO_DB),
+              count=lambda _: rows['weather'])
+    run_stage(stages, 'write.flights',
+              lambda: flights.load_flight_data(PATH_TO_DB),
+              count=lambda _: rows['flights'])
+    run_stage(stages, 'write.delay_summary',
+              lambda: summary.update_delay_summary(PATH_TO_DB),
+              count=lambda _: rows['flights'])
+    run_stage(stages, 'write.station_mapping',
+              lambda: stations.build_station_mapping(PATH_TO_DB))
+    run_stage(stages, 'write.indexes',
+              lambda: indexes.create_indexes(PATH_TO_DB), count=None)
+
+
+def benchmark_datetimes(stages, minutes, config, hour_shift=3):
+    """ Parse, round and shift departure timestamps held as text, per row
+        with extract_datetime and round_to_hour on a sample, as the
+        feature builders did, and per column with a fixed format
+    """
+    text = helpers.to_datetimes(minutes).dt.strftime('%Y-%m-%d %H:%M:%S')
+    sample = text.iloc[:config['row_wise_rows']]
+    shift = timedelta(hours=hour_shift)
+
+    run_stage(stages, 'features.datetimes_row_wise',
+              lambda: sample.apply(helpers.extract_datetime)
+              .apply(helpers.round_to_hour).apply(lambda ts: ts + shift))
+    run_stage(stages, 'features.datetimes_vectorized',
+              lambda: pd.to_datetime(text, format='%Y-%m-%d %H:%M:%S')
+              .dt.floor('H') + shift)
+
+
+def get_merge_retention(start_date, end_date, hour_shift=3):
+    """ Return the departures kept by the exact and as-of merges, in total
+        and per airport
+    """
+    weather = weather_builder.get_weather_features(
+        build_features.get_weather_start(start_date, hour_shift), end_date,
+        'all', PATH_TO_DB)
+    departures = flight_builder.build_features_for_departing_flights(
+        start_date, end_date, 'all', PATH_TO_DB)
+    retention = build_features.compare_merge_retention(weather, departures,
+                                                       hour_shift)
+    total = int(retention['departures'].sum())
+    merges = {}
+    for merge in ['exact', 'asof']:
+        kept = int(retention[f'{merge}_departures'].sum())
+        merges[merge] = {'rows': int(retention[f'{merge}_rows'].sum()),
+                         'departures': kept,
+                         'retention': kept / total if total else None}
+    return {'departures': total, 'merges': merges,
+            'airports': retention.to_dict('index')}
+
+
+def benchmark_features(stages, config):
+    """ Query and merge features for every airport over the loaded months
+
+        Returns the departures kept by each merge.
+    """
+    logger = logging.getLogger(__name__)
+    start_date = date(config['year'], 1, 1)
+    end_date = date(config['year'] + config['months'] // 12,
+                    config['months'] % 12 + 1, 1)
+
+    departures = run_stage(
+        stages, 'query.departing_flights',
+        lambda: flight_builder.get_departing_flights(
+            start_date, end_date, 'all', PATH_TO_DB))
+    benchmark_datetimes(stages, departures['departure_time_scheduled'],
+                        config)
+    run_stage(stages, 'query.weather',
+              lambda: weather_builder.get_weather_data(
+                  start_date, end_date, 'all', PATH_TO_DB))
+    run_stage(stages, 'query.delay_summary',
+              lambda: query_flights.delay_summary(
+                  ['airport'], start_date, end_date, PATH_TO_DB))
+    for merge in ['exact', 'asof']:
+        run_stage(stages, f'merge.{merge}',
+                  lambda: build_features.get_features_for_delay_classification(
+                      start_date, end_date, 'all', PATH_TO_DB,
+                      use_cache=False, merge=merge))
+
+    retention = get_merge_retention(start_date, end_date)
+    for merge, kept in retention['merges'].items():
+        logger.info(f'merge.{merge}: kept {kept["departures"]} of '
+                    f'{retention["departures"]} departures')
+    return retention
+
+
+def run_benchmarks(root, config):
+    """ Generate raw data under root, then time every stage against it
+
+        Loaders read data/raw relative to the working directory, so the
+        stages run from root.
+    """
+    stages = []
+    rows = run_stage(
+        stages, 'generate', lambda: generate_data.generate_raw_data(
+            root, config['flight_rows'], config['months'], config['year'],
+            config['seed'], config['dirty_rate']), count=None)
+
+    working_dir = os.getcwd()
+    os.makedirs(os.path.join(root, 'data', 'processed'), exist_ok=True)
+    os.chdir(root)
+    try:
+        transformed = benchmark_parsing(stages, root, config)
+        benchmark_writes(stages, root, transformed)
+        benchmark_ingest(stages, rows)
+        retention = benchmark_features(stages, config)
+    finally:
+        os.chdir(working_dir)
+
+    return {
+        'commit': get_commit(),
+        'created_at': pd.Timestamp.now().isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'config': config,
+        'max_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'stages': stages,
+        'merge_retention': retention
+    }
+
+
+def compare_reports(baseline, report):
+    """ Return the change in rows per second of each stage in both reports,
+        as a ratio of the report to the baseline
+    """
+    before = {s['stage']: s['rows_per_second'] for s in baseline['stages']}
+    return {s['stage']: s['rows_per_second'] / before[s['stage']]
+            for s in report['stages']
+            if s['rows_per_second'] and before.get(s['stage'])}
+
+
+def main():
+    """ Run the benchmarks, write the report and compare it to a baseline
+    """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    logger = logging.getLogger(__name__)
+
+    config = get_config()
+    # keep the generated data in BENCHMARK_DIR, else a temporary directory
+    root = os.environ.get('BENCHMARK_DIR') or tempfile.mkdtemp()
+    try:
+        report = run_benchmarks(os.path.abspath(root), config)
+    finally:
+        if not os.environ.get('BENCHMARK_DIR'):
+            shutil.rmtree(root)
+
+    output = os.environ.get('BENCHMARK_OUTPUT', os.path.join(
+        PROJECT_DIR, 'reports', 'benchmarks',
+        f'{report["commit"] or "benchmark"}.json'))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f'Wrote {output}')
+
+    if os.environ.get('BENCHMARK_BASELINE'):
+        with open(os.environ['BENCHMARK_BASELINE']) as f:
+            baseline = json.load(f)
+        for stage, ratio in compare_reports(baseline, report).items():
+            logger.info(f'{stage}: {ratio:.2f}x baseline rows per second')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
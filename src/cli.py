@@ -0,0 +1,229 @@
+""" Command line interface for ingest, features, queries and prediction
+
+    Run with python src/cli.py from any directory, or python -m src.cli
+    from the project directory. Only click is imported on startup, the
+    pipeline modules and with them pandas and SQLAlchemy are imported by
+    the command that needs them.
+"""
+from datetime import timedelta
+import importlib
+import logging
+import os
+import sys
+import click
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROJECT_DIR = os.path.normpath(os.path.join(SRC_DIR, os.pardir))
+
+DATE = click.DateTime(formats=['%Y-%m-%d'])
+
+
+def import_module(package, name):
+    """ Import a pipeline module by name
+
+        The data, features and models modules import their siblings by bare
+        name, so the package directory is put on the path first.
+    """
+    path = os.path.join(SRC_DIR, package)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(name)
+
+
+def get_database_path(root, path_to_db=None):
+    """ Return a sqlite connection string, by default the project database
+
+        The location is known up front, so the database is never searched
+        for on disk.
+    """
+    if path_to_db is None:
+        path_to_db = os.path.join(root, 'data', 'processed', 'airlines.db')
+    if '://' in path_to_db:
+        return path_to_db
+    return 'sqlite:///' + os.path.abspath(path_to_db)
+
+
+def get_existing_database(path_to_db):
+    """ Return the connection string of a database that was ingested """
+    path_to_db = get_database_path(PROJECT_DIR, path_to_db)
+    database = path_to_db.split(':///', 1)[-1]
+    if path_to_db.startswith('sqlite') and not os.path.exists(database):
+        raise click.ClickException(
+            f'No database at {database}, run ingest first')
+    return path_to_db
+
+
+def get_airport_code(airports):
+    """ Return 'all' or a list of comma separated airport codes """
+    return airports if airports == 'all' else airports.split(',')
+
+
+def echo_frame(frame, output):
+    """ Print a dataframe, or write it as csv to output """
+    if output is None:
+        click.echo(frame.to_string(index=False))
+    else:
+        frame.to_csv(output, index=False)
+        click.echo(f'Wrote {len(frame)} rows to {output}', err=True)
+
+
+@click.group()
+@click.option('--db', 'path_to_db', default=None,
+              help='sqlite file or connection string, by default '
+                   'data/processed/airlines.db of the project')
+@click.option('-v', '--verbose', is_flag=True, help='Log progress.')
+@click.pass_context
+def cli(ctx, path_to_db, verbose):
+    """ Airport delays data pipeline """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO if verbose else logging.WARNING,
+                        format=log_fmt)
+    ctx.obj = path_to_db
+
+
+@cli.command()
+@click.option('--root', default=PROJECT_DIR, show_default=True,
+              type=click.Path(exists=True, file_okay=False),
+              help='Directory holding data/raw and data/processed.')
+@click.option('--workers', default=1, show_default=True,
+              envvar='INGEST_WORKERS', help='Processes parsing flight files.')
+@click.option('--mode', default='incremental', show_default=True,
+              envvar='INGEST_MODE',
+              type=click.Choice(['incremental', 'full']),
+              help='Load only new or changed raw files, or all of them.')
+@click.option('--columnar/--no-columnar', default=False,
+              envvar='COLUMNAR_STORE',
+              help='Mirror the database into the parquet store.')
+@click.option('--pipelined/--sequential', default=False,
+              envvar='INGEST_PIPELINE',
+              help='Overlap parsing, transforming and writing each file.')
+@click.pass_obj
+def ingest(path_to_db, root, workers, mode, columnar, pipelined):
+    """ Load raw data into the database """
+    root = os.path.abspath(root)
+    path_to_db = get_database_path(root, path_to_db)
+    make_dataset = import_module('data', 'make_dataset')
+
+    # the loaders find raw files relative to the working directory
+    os.makedirs(os.path.join(root, 'data', 'processed'), exist_ok=True)
+    working_dir = os.getcwd()
+    os.chdir(root)
+    try:
+        make_dataset.make_dataset(path_to_db, workers, mode != 'full',
+                                  columnar, pipelined)
+    finally:
+        os.chdir(working_dir)
+
+
+@cli.command()
+@click.option('--airports', default='MDT,ATL,LAX', show_default=True,
+              envvar='FEATURE_AIRPORTS',
+              help="Comma separated airport codes, or 'all'.")
+@click.option('--start', 'start_date', default='2017-01-01', type=DATE,
+              show_default=True, help='First departure date.')
+@click.option('--end', 'end_date', default='2017-12-31', type=DATE,
+              show_default=True, help='Departure date to stop before.')
+@click.option('--workers', default=1, show_default=True,
+              envvar='FEATURE_WORKERS', help='Processes building features.')
+@click.option('--merge', default='exact', show_default=True,
+              envvar='FEATURE_MERGE', type=click.Choice(['exact', 'asof']),
+              help='Matching of departures to weather observations.')
+@click.pass_obj
+def features(path_to_db, airports, start_date, end_date, workers, merge):
+    """ Build, store and export the prepared feature set """
+    path_to_db = get_existing_database(path_to_db)
+    make_prepared_features = import_module('features',
+                                           'make_prepared_features')
+    make_prepared_features.make_prepared_features(
+        path_to_db, get_airport_code(airports), start_date.date(),
+        end_date.date(), workers, merge)
+
+
+@cli.command()
+@click.option('--group-by', default='airport', show_default=True,
+              help='Comma separated groups: airport, carrier, date, year, '
+                   'month, day_of_week or hour.')
+@click.option('--airport', default='all', show_default=True,
+              help='Only count departures from this airport.')
+@click.option('--start', 'start_date', default='1970-01-01', type=DATE,
+              help='First flight date.')
+@click.option('--end', 'end_date', default='2100-01-01', type=DATE,
+              help='Flight date to stop before.')
+@click.option('-o', '--output', default=None, type=click.Path(),
+              help='Write csv to this file instead of printing.')
+@click.pass_obj
+def query(path_to_db, group_by, airport, start_date, end_date, output):
+    """ Summarize departures and delays """
+    path_to_db = get_existing_database(path_to_db)
+    query_flights = import_module('data', 'query_flights')
+
+    group_by = group_by.split(',')
+    unknown = [g for g in group_by if g not in query_flights.SUMMARY_GROUPS]
+    if unknown:
+        raise click.BadParameter(f'unknown groups {", ".join(unknown)}',
+                                 param_hint='--group-by')
+    summary = query_flights.delay_summary(
+        group_by, start_date.date(), end_date.date(), path_to_db, airport)
+    echo_frame(summary, output)
+
+
+@cli.command()
+@click.option('--day', default=None, type=DATE,
+              help='Score every departure of this day.')
+@click.option('--airport', default='all', show_default=True,
+              help="Comma separated origin airport codes, or 'all'.")
+@click.option('--origin', default=None,
+              help='Score a single departure from this airport.')
+@click.option('--departure-time', default=None,
+              type=click.DateTime(formats=['%Y-%m-%d %H:%M',
+                                           '%Y-%m-%dT%H:%M']),
+              help='Scheduled departure of the single flight.')
+@click.option('--elapsed', default=120, show_default=True,
+              help='Scheduled minutes in the air of the single flight.')
+@click.option('--model', 'model_path', default=None, type=click.Path(),
+              help='Serialized model, by default models/'
+                   'delay_classifier.joblib.')
+@click.option('-o', '--output', default=None, type=click.Path(),
+              help='Write csv to this file instead of printing.')
+@click.pass_obj
+def predict(path_to_db, day, airport, origin, departure_time, elapsed,
+            model_path, output):
+    """ Score departures with the trained delay classifier
+
+        Pass --day for a day of departures, or --origin and
+        --departure-time for a single flight.
+    """
+    if (day is None) == (origin is None):
+        raise click.UsageError('Pass either --day or --origin')
+    if origin is not None and departure_time is None:
+        raise click.UsageError('--origin needs --departure-time')
+
+    path_to_db = get_existing_database(path_to_db)
+    predict_model = import_module('models', 'predict_model')
+    bundle = predict_model.load_model(
+        model_path or predict_model.DEFAULT_MODEL_PATH)
+
+    if day is not None:
+        scores = predict_model.predict_departures(
+            day.date(), path_to_db, bundle, get_airport_code(airport))
+        echo_frame(scores, output)
+        return
+
+    day = departure_time.date()
+    lookup = predict_model.build_weather_lookup(
+        day, day + timedelta(days=1), path_to_db, bundle['hour_shift'],
+        [origin])
+    try:
+        predicted, probability = predict_model.predict_flight(
+            bundle, lookup, origin, departure_time, elapsed)
+    except KeyError:
+        raise click.ClickException(
+            f'No weather at {origin} for {departure_time}')
+    click.echo(f'predicted_delay: {predicted}')
+    if probability is not None:
+        click.echo(f'delay_probability: {probability:.3f}')
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1,167 @@
+"""
+In-memory registry of the latest record of every airport
+"""
+from collections import namedtuple
+from functools import lru_cache
+import logging
+import sys
+import time
+import numpy as np
+import pandas as pd
+from data_helpers import get_engine
+
+# one airport, as returned by the lookups
+Airport = namedtuple('Airport', ['airport_seq_id', 'airport_id', 'code',
+                                 'name', 'latitude', 'longitude',
+                                 'city_market_id'])
+
+# columns of the latest airport records as arrays, and dictionaries from
+# code, sequence id and airport id to a position in them
+AirportRegistry = namedtuple('AirportRegistry', [
+    'airport_seq_id', 'airport_id', 'code', 'name', 'latitude', 'longitude',
+    'city_market_id', 'by_code', 'by_seq_id', 'by_airport_id'])
+
+
+def read_latest_airports(path_to_database):
+    """ Return the latest record of every airport
+
+        Open airports are ordered after closed ones, so they take a code
+        that was reused.
+    """
+    engine = get_engine(path_to_database)
+    with engine.connect() as conn:
+        airports = pd.read_sql(
+            """
+            SELECT
+                a.airport_seq_id,
+                a.airport_id,
+                c.code,
+                a.display_airport_name AS name,
+                a.latitude,
+                a.longitude,
+                a.city_market_id
+            FROM
+                airports AS a
+            JOIN
+                airport_codes AS c
+            ON
+                c.code_id = a.airport
+            WHERE
+                a.airport_is_latest == 1
+            ORDER BY
+                a.airport_is_closed DESC,
+                a.airport_start_date
+            """,
+            conn)
+    return airports.drop_duplicates('airport_id', keep='last')
+
+
+def read_airport_sequence_ids(path_to_database):
+    """ Return every sequence id in the airport history with its airport """
+    engine = get_engine(path_to_database)
+    with engine.connect() as conn:
+        return pd.read_sql(
+            'SELECT DISTINCT airport_seq_id, airport_id FROM airports', conn)
+
+
+def build_airport_registry(airports, sequence_ids):
+    """ Build a registry from the latest airport records
+
+        Sequence ids of earlier records resolve to the latest record of
+        their airport.
+    """
+    by_airport_id = {a: i for i, a in
+                     enumerate(airports['airport_id'].tolist())}
+    by_seq_id = {s: by_airport_id[a] for s, a in zip(
+        sequence_ids['airport_seq_id'].tolist(),
+        sequence_ids['airport_id'].tolist()) if a in by_airport_id}
+    return AirportRegistry(
+        airport_seq_id=airports['airport_seq_id'].to_numpy(np.int32),
+        airport_id=airports['airport_id'].to_numpy(np.int32),
+        code=airports['code'].to_numpy(str),
+        name=airports['name'].to_numpy(object),
+        latitude=airports['latitude'].to_numpy(np.float32),
+        longitude=airports['longitude'].to_numpy(np.float32),
+        city_market_id=airports['city_market_id'].to_numpy(np.int32),
+        by_code={c: i for i, c in enumerate(airports['code'].tolist())},
+        by_seq_id=by_seq_id,
+        by_airport_id=by_airport_id)
+
+
+@lru_cache(maxsize=None)
+def get_airport_registry(path_to_database):
+    """ Return the airport registry, read once per process
+
+        Loading airport data clears it, see clear_airport_registry.
+    """
+    return build_airport_registry(read_latest_airports(path_to_database),
+                                  read_airport_sequence_ids(path_to_database))
+
+
+def clear_airport_registry():
+    """ Forget registries read before the airports table changed """
+    get_airport_registry.cache_clear()
+
+
+def get_airport(registry, position):
+    """ Return the airport at a position of the registry """
+    return Airport(
+        int(registry.airport_seq_id[position]),
+        int(registry.airport_id[position]),
+        str(registry.code[position]),
+        registry.name[position],
+        float(registry.latitude[position]),
+        float(registry.longitude[position]),
+        int(registry.city_market_id[position]))
+
+
+def airport_by_code(registry, code):
+    """ Return the airport with a code, raise KeyError if unknown """
+    return get_airport(registry, registry.by_code[code])
+
+
+def airport_by_seq_id(registry, airport_seq_id):
+    """ Return the latest record of the airport with a sequence id, raise
+        KeyError if unknown
+    """
+    return get_airport(registry, registry.by_seq_id[airport_seq_id])
+
+
+def airport_by_id(registry, airport_id):
+    """ Return the airport with an airport id, raise KeyError if unknown """
+    return get_airport(registry, registry.by_airport_id[airport_id])
+
+
+def to_frame(registry):
+    """ Return the registry columns as a dataframe, one row per airport """
+    return pd.DataFrame({name: getattr(registry, name)
+                         for name in Airport._fields})
+
+
+def get_registry_bytes(registry):
+    """ Return the memory held by the registry columns and lookups """
+    arrays = sum(getattr(registry, name).nbytes for name in Airport._fields
+                 if name != 'name')
+    names = sum(sys.getsizeof(n) for n in registry.name)
+    lookups = sum(sys.getsizeof(getattr(registry, name))
+                  for name in ['by_code', 'by_seq_id', 'by_airport_id'])
+    return arrays + names + lookups
+
+
+def main():
+    """ Build the registry of the processed database, print its size """
+    logger = logging.getLogger(__name__)
+    path_to_database = 'sqlite:///data/processed/airlines.db'
+
+    started = time.perf_counter()
+    registry = get_airport_registry(path_to_database)
+    elapsed = time.perf_counter() - started
+    logger.info(f'Read {len(registry.code)} airports in {elapsed:.3f}s, '
+                f'{get_registry_bytes(registry) / 1024:.0f} KB')
+    print(to_frame(registry).head())
+
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    sys.exit(main())
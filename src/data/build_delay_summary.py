@@ -0,0 +1,160 @@
+"""
+Maintains pre-aggregated delay summaries of the flights table
+"""
+import logging
+import sys
+import time
+import database_writer as writer
+import ingest_manifest as manifest
+from data_helpers import count_bytes_read, get_bytes_read, record_input
+
+
+def get_delay_summary_columns():
+    """ Return the columns of the flight_delay_summary table
+
+        One row per origin, carrier, flight date, scheduled departure hour
+        and ingested file. Origin and carrier are ids into the lookup
+        tables, the flight date is in epoch minutes as in flights.
+    """
+    return [
+        ('origin', writer.SQL_TYPES['airport_code']),
+        ('carrier', writer.SQL_TYPES['carrier_code']),
+        ('flight_date', 'INTEGER'),
+        ('departure_hour', 'INTEGER'),
+        ('departure_count', 'INTEGER'),
+        ('delayed_count', 'INTEGER'),
+        ('cancelled_count', 'INTEGER'),
+        ('departure_delay_sum', 'INTEGER'),
+        ('source_file_id', 'INTEGER')
+    ]
+
+
+def create_delay_summary(connection):
+    """ Create the summary table and the record of files it summarizes """
+    column_sql = ', '.join(f'"{name}" {sql_type}'
+                           for name, sql_type in get_delay_summary_columns())
+    connection.execute(
+        f'CREATE TABLE IF NOT EXISTS flight_delay_summary ({column_sql})')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS ix_flight_delay_summary_source_file_id '
+        'ON flight_delay_summary (source_file_id)')
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS flight_delay_summary_files (
+            file_id INTEGER PRIMARY KEY,
+            ingested_at TEXT
+        )
+        """)
+
+
+def find_stale_files(connection):
+    """ Return ids of flight files to summarize again and of files whose
+        summaries should only be removed
+
+        A file is stale when it was ingested after it was last summarized.
+    """
+    ingested = dict(connection.execute(
+        """
+        SELECT file_id, ingested_at
+        FROM ingest_manifest
+        WHERE table_name = 'flights' AND content_hash IS NOT NULL
+        """).fetchall())
+    summarized = dict(connection.execute(
+        'SELECT file_id, ingested_at FROM flight_delay_summary_files'
+    ).fetchall())
+    stale = [file_id for file_id, ingested_at in ingested.items()
+             if summarized.get(file_id) != ingested_at]
+    removed = [file_id for file_id in summarized if file_id not in ingested]
+    return stale, removed
+
+
+def summarize_file(connection, file_id):
+    """ Aggregate the flights loaded from one file into the summary
+
+        Returns the summary rows written.
+    """
+    return connection.execute(
+        """
+        INSERT INTO flight_delay_summary
+        SELECT
+            f.origin,
+            f.carrier,
+            f.flight_date,
+            (f.departure_time_scheduled - f.flight_date) / 60,
+            COUNT(*),
+            SUM(f.departure_was_delayed_15),
+            SUM(f.cancelled),
+            SUM(f.departure_delay),
+            f.source_file_id
+        FROM
+            flights AS f
+        WHERE
+            f.source_file_id = ?
+        GROUP BY
+            f.origin,
+            f.carrier,
+            f.flight_date,
+            (f.departure_time_scheduled - f.flight_date) / 60
+        """, (file_id,)).rowcount
+
+
+def record_summarized_file(connection, file_id, rows, started):
+    """ Record the flights of a summarized file as an input of the stage,
+        with the bytes read since started
+    """
+    path, = connection.execute(
+        'SELECT path FROM ingest_manifest WHERE file_id = ?',
+        (file_id,)).fetchone()
+    departures, = connection.execute(
+        'SELECT SUM(departure_count) FROM flight_delay_summary '
+        'WHERE source_file_id = ?', (file_id,)).fetchone()
+    record_input(path, departures or 0, rows, count_bytes_read(started))
+
+
+def update_delay_summary(path_to_database):
+    """ Bring the summary up to date with the ingested flight files
+
+        Only files ingested since they were last summarized are aggregated
+        again, so loading a new month only summarizes that month.
+    """
+    logger = logging.getLogger(__name__)
+    started = time.perf_counter()
+    with writer.ingest_connection(path_to_database) as connection:
+        create_delay_summary(connection)
+        manifest.create_manifest(connection)
+        stale, removed = find_stale_files(connection)
+        with writer.transaction(connection):
+            for file_id in stale + removed:
+                connection.execute(
+                    'DELETE FROM flight_delay_summary '
+                    'WHERE source_file_id = ?', (file_id,))
+                connection.execute(
+                    'DELETE FROM flight_delay_summary_files '
+                    'WHERE file_id = ?', (file_id,))
+            for file_id in stale:
+                started = get_bytes_read()
+                rows = summarize_file(connection, file_id)
+                record_summarized_file(connection, file_id, rows, started)
+            connection.execute(
+                """
+                INSERT INTO flight_delay_summary_files (file_id, ingested_at)
+                SELECT file_id, ingested_at
+                FROM ingest_manifest
+                WHERE table_name = 'flights' AND content_hash IS NOT NULL
+                AND file_id NOT IN (
+                    SELECT file_id FROM flight_delay_summary_files)
+                """)
+    logger.info(f'Summarized {len(stale)} flight files in '
+                f'{time.perf_counter() - started:.2f}s')
+    return len(stale)
+
+
+def main():
+    """ Update the summary of the processed database """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    update_delay_summary('sqlite:///data/processed/airlines.db')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
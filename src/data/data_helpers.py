@@ -1,15 +1,13 @@
 """ Shared helpers for data scripts
 """
 import os
-
-
-def find(name, path):
-    """ Walks selected path to find a given file"""
-    for root, dirs, files in os.walk(path):
-        if name in files:
-            return os.path.join(root, name)
-
-
-def get_database_connection_string():
-    """Returns the sqlite connection string"""
-    return "sqlite:///" + find('airlines.db', '.')
+import sys
+
+# engines, memory sampling and run reports are shared with the features
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'shared'))
+from pipeline_helpers import (  # noqa: E402,F401
+    find, get_database_connection_string, get_engine, get_database_file,
+    get_columnar_store_path, to_epoch_minutes, get_rss, run_with_peak_rss,
+    run_stage, get_run_report_dir, write_run_report, get_frame_bytes,
+    get_bytes_read, count_bytes_read, record_input, collect_inputs)
@@ -0,0 +1,235 @@
+"""
+Bulk write path for loading dataframes into the sqlite database
+"""
+from contextlib import contextmanager
+import datetime as datetime
+import sqlite3
+import numpy as np
+import pandas as pd
+from data_helpers import get_database_file
+import ingest_manifest as manifest
+
+
+# Feature dtypes stored as integers, numpy types narrow the column once read
+INTEGER_DTYPES = [int, np.int8, np.int16, np.int32]
+
+# Feature dtypes dictionary encoded as ids into a lookup table of codes
+CODE_TABLES = {
+    'airport_code': 'airport_codes',
+    'carrier_code': 'carrier_codes',
+    'tail_code': 'tail_codes'
+}
+
+# sqlite column types for each Feature dtype, timestamps are stored as
+# integer minutes since 1970-01-01
+SQL_TYPES = {
+    int: 'INTEGER',
+    np.int8: 'INTEGER',
+    np.int16: 'INTEGER',
+    np.int32: 'INTEGER',
+    float: 'REAL',
+    bool: 'INTEGER',
+    str: 'TEXT',
+    datetime.date: 'INTEGER',
+    datetime.datetime: 'INTEGER',
+    'time': 'INTEGER',
+    'airport_code': 'INTEGER REFERENCES airport_codes (code_id)',
+    'carrier_code': 'INTEGER REFERENCES carrier_codes (code_id)',
+    'tail_code': 'INTEGER REFERENCES tail_codes (code_id)'
+}
+
+# settings applied for the duration of an ingest, restored afterwards
+INGEST_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'OFF',
+    'cache_size': -262144
+}
+
+
+def get_table_columns(features, extra_columns=None):
+    """ Return (name, sql type) pairs for a table built from Features
+
+        The leading 'index' column matches the index label written by
+        DataFrame.to_sql, extra columns are derived during transformation.
+        The trailing 'source_file_id' refers to the ingest manifest entry
+        of the file each row was loaded from.
+    """
+    columns = [('index', 'INTEGER')]
+    columns += [(f.storage_name, SQL_TYPES[f.dtype]) for f in features]
+    columns += list(extra_columns or [])
+    columns += [('source_file_id', 'INTEGER')]
+    return columns
+
+
+def get_code_table(sql_type):
+    """Return the lookup table of a dictionary encoded column, or None"""
+    for dtype, code_table in CODE_TABLES.items():
+        if sql_type == SQL_TYPES[dtype]:
+            return code_table
+    return None
+
+
+def create_code_table(connection, code_table):
+    """Create a lookup table of codes, if missing"""
+    connection.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS "{code_table}" (
+            code_id INTEGER PRIMARY KEY,
+            code TEXT NOT NULL UNIQUE
+        )
+        """)
+
+
+def encode_codes(connection, code_table, column):
+    """ Return the ids of a column of codes, adding new codes to the table
+
+        Missing codes stay missing.
+    """
+    codes = column.dropna().unique()
+    connection.executemany(
+        f'INSERT OR IGNORE INTO "{code_table}" (code) VALUES (?)',
+        ((code,) for code in codes))
+    code_ids = dict(connection.execute(
+        f'SELECT code, code_id FROM "{code_table}"').fetchall())
+    return column.map(code_ids).astype('Int64')
+
+
+def create_table(connection, table, columns):
+    """ Create the table and its index column once, if missing
+
+        Columns missing from a table created by an earlier version are
+        added in place, as are the lookup tables of encoded columns. Rows
+        are indexed by the file they were loaded from, so a changed file's
+        rows are found without a table scan.
+    """
+    for _, sql_type in columns:
+        code_table = get_code_table(sql_type)
+        if code_table is not None:
+            create_code_table(connection, code_table)
+    column_sql = ', '.join(f'"{name}" {sql_type}'
+                           for name, sql_type in columns)
+    connection.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({column_sql})')
+    existing = {row[1] for row in
+                connection.execute(f'PRAGMA table_info("{table}")')}
+    for name, sql_type in columns:
+        if name not in existing:
+            connection.execute(f'ALTER TABLE "{table}" '
+                               f'ADD COLUMN "{name}" {sql_type}')
+    connection.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table}_index" '
+                       f'ON "{table}" ("index")')
+    connection.execute(f'CREATE INDEX IF NOT EXISTS '
+                       f'"ix_{table}_source_file_id" '
+                       f'ON "{table}" ("source_file_id")')
+
+
+def to_epoch_minutes(column):
+    """ Return datetimes as whole minutes since 1970-01-01 """
+    minutes = column.to_numpy(dtype='datetime64[m]').astype(np.int64)
+    return pd.Series(minutes, index=column.index, dtype='Int64') \
+        .mask(column.isna())
+
+
+def prepare_rows(data, columns):
+    """ Convert a dataframe into tuples of python values for executemany """
+    data = data.reset_index()
+    prepared = []
+    for name, _ in columns:
+        column = data[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            column = to_epoch_minutes(column)
+        elif pd.api.types.is_bool_dtype(column):
+            column = column.astype(int)
+        column = column.astype(object).where(column.notna(), None)
+        prepared.append(column)
+    return zip(*prepared)
+
+
+def insert_dataframe(connection, table, data, columns, file_id=None):
+    """ Insert all rows of a dataframe with a single executemany
+
+        Columns of codes are replaced by their ids in the lookup table.
+    """
+    data = data.assign(source_file_id=file_id)
+    for name, sql_type in columns:
+        code_table = get_code_table(sql_type)
+        if code_table is not None:
+            data[name] = encode_codes(connection, code_table, data[name])
+    names = ', '.join(f'"{name}"' for name, _ in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    connection.executemany(
+        f'INSERT INTO "{table}" ({names}) VALUES ({placeholders})',
+        prepare_rows(data, columns))
+    return len(data)
+
+
+@contextmanager
+def ingest_connection(path_to_database):
+    """ Open a sqlite connection tuned for bulk ingest
+
+        Transactions are managed explicitly by the caller. The previous
+        PRAGMA values are restored before the connection is closed.
+    """
+    connection = sqlite3.connect(get_database_file(path_to_database),
+                                 isolation_level=None)
+    previous = {pragma: connection.execute(f'PRAGMA {pragma}').fetchone()[0]
+                for pragma in INGEST_PRAGMAS}
+    try:
+        for pragma, value in INGEST_PRAGMAS.items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        yield connection
+    finally:
+        for pragma, value in previous.items():
+            connection.execute(f'PRAGMA {pragma} = {value}')
+        connection.close()
+
+
+@contextmanager
+def transaction(connection):
+    """ Wrap a block of inserts in one explicit transaction """
+    connection.execute('BEGIN')
+    try:
+        yield connection
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+def write_dataframes(path_to_database, table, columns, frames,
+                     record=None):
+    """ Write an iterable of dataframes to a table in one transaction
+
+        When a manifest FileRecord is given, rows previously loaded from the
+        same file are replaced and the manifest is updated in the same
+        transaction.
+    """
+    rows = write_table_frames(path_to_database, {table: columns},
+                              ((table, data) for data in frames), record)
+    return rows[table]
+
+
+def write_table_frames(path_to_database, tables, frames, record=None):
+    """ Write an iterable of (table, dataframe) pairs in one transaction
+
+        tables maps each table name to its columns. Returns the number of
+        rows written per table. Manifest handling is as write_dataframes,
+        for every table.
+    """
+    rows = {table: 0 for table in tables}
+    with ingest_connection(path_to_database) as connection:
+        for table, columns in tables.items():
+            create_table(connection, table, columns)
+        with transaction(connection):
+            file_ids = {table: None for table in tables}
+            if record is not None:
+                file_ids = {table: manifest.start_file(connection, table,
+                                                       record)
+                            for table in tables}
+            for table, data in frames:
+                rows[table] += insert_dataframe(connection, table, data,
+                                                tables[table],
+                                                file_ids[table])
+            if record is not None:
+                for file_id in file_ids.values():
+                    manifest.finish_file(connection, file_id, record)
+    return rows
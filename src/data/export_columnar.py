@@ -0,0 +1,186 @@
+"""
+Exports the sqlite tables into a partitioned parquet store
+"""
+import datetime as datetime
+import logging
+import os
+import sys
+import numpy as np
+import pandas as pd
+from data_helpers import (get_columnar_store_path, get_engine,
+                          get_frame_bytes, record_input, to_epoch_minutes)
+import database_writer as writer
+import load_airport_data as airports
+import load_flight_data as flights
+import load_weather_data as weather
+
+
+def import_pyarrow():
+    """ Import pyarrow, which is only required for the columnar store """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('The columnar store requires pyarrow, '
+                          'install it with `pip install pyarrow`')
+    return pyarrow
+
+
+def read_code_tables(conn):
+    """Return the codes of each lookup table, indexed by id"""
+    codes = {}
+    for code_table in writer.CODE_TABLES.values():
+        codes[code_table] = pd.read_sql(
+            f'SELECT code_id, code FROM "{code_table}"', conn,
+            index_col='code_id')['code']
+    return codes
+
+
+def decode_columns(data, features, codes):
+    """ Convert stored columns back to codes, datetimes and the narrow
+        integer type of each Feature
+    """
+    for f in features:
+        if f.storage_name not in data:
+            continue
+        if f.dtype in writer.CODE_TABLES:
+            data[f.storage_name] = \
+                data[f.storage_name].map(codes[writer.CODE_TABLES[f.dtype]])
+        elif f.dtype in [datetime.date, datetime.datetime, 'time']:
+            data[f.storage_name] = pd.to_datetime(data[f.storage_name],
+                                                  unit='m')
+        elif f.dtype in [np.int8, np.int16, np.int32]:
+            data[f.storage_name] = data[f.storage_name].astype(f.dtype)
+    return data
+
+
+def write_partitions(data, root, partition_cols):
+    """ Write a dataframe into a hive partitioned parquet dataset
+
+        Partitions present in the dataframe are replaced, others are kept.
+    """
+    pyarrow = import_pyarrow()
+    table = pyarrow.Table.from_pandas(data, preserve_index=False)
+    pyarrow.parquet.write_to_dataset(
+        table, root, partition_cols=partition_cols,
+        existing_data_behavior='delete_matching')
+
+
+def export_flights(path_to_db, root, logger):
+    """ Export flights partitioned by year, month and origin """
+    engine = get_engine(path_to_db)
+    features = flights.identify_flight_features()
+    rows, size = 0, 0
+    with engine.connect() as conn:
+        codes = read_code_tables(conn)
+        months = pd.read_sql(
+            'SELECT DISTINCT year, month FROM flights ORDER BY year, month',
+            conn)
+        for year, month in months.itertuples(index=False):
+            logger.info(f'Exporting flights for {year}-{month:02d}')
+            start = datetime.date(year, month, 1)
+            end = (start + datetime.timedelta(days=32)).replace(day=1)
+            data = pd.read_sql(
+                """
+                SELECT * FROM flights
+                WHERE flight_date >= :start_date AND flight_date < :end_date
+                """,
+                conn, params={'start_date': to_epoch_minutes(start),
+                              'end_date': to_epoch_minutes(end)})
+            rows, size = rows + len(data), size + get_frame_bytes(data)
+            data = decode_columns(data, features, codes)
+            write_partitions(data, os.path.join(root, 'flights'),
+                             ['year', 'month', 'origin'])
+    record_input('flights', rows, rows, size)
+
+
+def export_weather(path_to_db, root, logger):
+    """ Export weather partitioned by station and year """
+    engine = get_engine(path_to_db)
+    features = weather.identify_weather_features()
+    rows, size = 0, 0
+    with engine.connect() as conn:
+        stations = pd.read_sql('SELECT DISTINCT station FROM weather', conn)
+        for station in stations['station']:
+            logger.info(f'Exporting weather for {station}')
+            data = pd.read_sql(
+                'SELECT * FROM weather WHERE station = :station',
+                conn, params={'station': station})
+            rows, size = rows + len(data), size + get_frame_bytes(data)
+            data = decode_columns(data, features, {})
+            data['year'] = data['date'].dt.year
+            write_partitions(data, os.path.join(root, 'weather'),
+                             ['station', 'year'])
+    record_input('weather', rows, rows, size)
+
+
+def export_hourly_weather(path_to_db, root, logger):
+    """ Export hourly weather partitioned by station and year """
+    engine = get_engine(path_to_db)
+    rows, size = 0, 0
+    with engine.connect() as conn:
+        stations = pd.read_sql('SELECT DISTINCT station FROM hourly_weather',
+                               conn)
+        for station in stations['station']:
+            logger.info(f'Exporting hourly weather for {station}')
+            data = pd.read_sql(
+                'SELECT * FROM hourly_weather WHERE station = :station',
+                conn, params={'station': station})
+            rows, size = rows + len(data), size + get_frame_bytes(data)
+            data['measurement_hour'] = \
+                pd.to_datetime(data['measurement_hour'], unit='m')
+            data['year'] = data['measurement_hour'].dt.year
+            write_partitions(data, os.path.join(root, 'hourly_weather'),
+                             ['station', 'year'])
+    record_input('hourly_weather', rows, rows, size)
+
+
+def write_table(data, path):
+    """ Write a dataframe into a single parquet file """
+    pyarrow = import_pyarrow()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pyarrow.Table.from_pandas(data, preserve_index=False)
+    pyarrow.parquet.write_table(table, path)
+
+
+def export_airports(path_to_db, root, logger):
+    """ Export airports and their weather stations into parquet files """
+    engine = get_engine(path_to_db)
+    logger.info('Exporting airports')
+    with engine.connect() as conn:
+        codes = read_code_tables(conn)
+        data = pd.read_sql('SELECT * FROM airports', conn)
+        stations = pd.read_sql('SELECT * FROM airport_weather_stations',
+                               conn)
+    record_input('airports', len(data), len(data), get_frame_bytes(data))
+    record_input('airport_weather_stations', len(stations), len(stations),
+                 get_frame_bytes(stations))
+    data = decode_columns(data, airports.get_airport_features(), codes)
+    write_table(data, os.path.join(root, 'airports.parquet'))
+    write_table(stations,
+                os.path.join(root, 'airport_weather_stations.parquet'))
+
+
+def export_columnar_store(path_to_db):
+    """ Export airports, weather and flights next to the sqlite database
+
+        Each table is recorded as an input of the stage, with the rows and
+        bytes fetched from sqlite.
+    """
+    logger = logging.getLogger(__name__)
+    root = get_columnar_store_path(path_to_db)
+    export_airports(path_to_db, root, logger)
+    export_weather(path_to_db, root, logger)
+    export_hourly_weather(path_to_db, root, logger)
+    export_flights(path_to_db, root, logger)
+
+
+def main():
+    """ Export the processed database into the columnar store """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    export_columnar_store('sqlite:///data/processed/airlines.db')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
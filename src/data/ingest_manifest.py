@@ -0,0 +1,144 @@
+"""
+Tracks which raw files have been ingested into the sqlite database
+"""
+from collections import namedtuple
+import datetime as datetime
+import hashlib
+import os
+import sqlite3
+from data_helpers import get_database_file
+
+
+FileRecord = namedtuple('FileRecord', ['path', 'size', 'mtime',
+                                       'content_hash'])
+# files, rows and raw bytes loaded by one call of a loader, and the stage
+# metrics of pipelined loads
+LoadStats = namedtuple('LoadStats', ['files', 'rows', 'bytes', 'pipeline'],
+                       defaults=[None])
+
+
+def create_manifest(connection):
+    """ Create the manifest table, one row per ingested file and table """
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_manifest (
+            file_id INTEGER PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            content_hash TEXT,
+            ingested_at TEXT,
+            UNIQUE (table_name, path)
+        )
+        """)
+
+
+def hash_file(file_name, block_size=2 ** 20):
+    """Return the sha1 hex digest of a file's contents"""
+    digest = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_file(file_name, content_hash=None):
+    """Return a FileRecord for a raw file, hashing it if needed"""
+    stat = os.stat(file_name)
+    if content_hash is None:
+        content_hash = hash_file(file_name)
+    return FileRecord(os.path.normpath(file_name), stat.st_size,
+                      stat.st_mtime, content_hash)
+
+
+def get_manifest_entries(path_to_database, table):
+    """Return recorded FileRecords for a table, keyed by path"""
+    database = get_database_file(path_to_database)
+    if not os.path.exists(database):
+        return {}
+    connection = sqlite3.connect(database)
+    try:
+        create_manifest(connection)
+        rows = connection.execute(
+            """
+            SELECT path, size, mtime, content_hash
+            FROM ingest_manifest
+            WHERE table_name = ? AND content_hash IS NOT NULL
+            """, (table,)).fetchall()
+    finally:
+        connection.close()
+    return {row[0]: FileRecord(*row) for row in rows}
+
+
+def find_changed_files(path_to_database, table, files):
+    """ Return FileRecords for files that are new or changed since ingest
+
+        Files with the same size and modification time as recorded are
+        assumed unchanged; otherwise the contents are hashed and compared.
+    """
+    entries = get_manifest_entries(path_to_database, table)
+    changed = []
+    for file_name in files:
+        entry = entries.get(os.path.normpath(file_name))
+        stat = os.stat(file_name)
+        if entry is not None and entry.size == stat.st_size \
+                and entry.mtime == stat.st_mtime:
+            continue
+        record = describe_file(file_name)
+        if entry is not None and entry.content_hash == record.content_hash:
+            continue
+        changed.append(record)
+    return changed
+
+
+def select_files(path_to_database, table, files, incremental=False):
+    """ Return FileRecords for the raw files to load into a table
+
+        A full load selects every file, an incremental load only the files
+        that are new or changed since they were last ingested.
+    """
+    if incremental:
+        return find_changed_files(path_to_database, table, files)
+    return [describe_file(f) for f in files]
+
+
+def get_load_stats(records, rows, pipeline=None):
+    """ Return the LoadStats of rows loaded from FileRecords, with the
+        metrics of pipelined loads
+    """
+    return LoadStats(len(records), rows, sum(r.size for r in records),
+                     pipeline)
+
+
+def start_file(connection, table, record):
+    """ Return the file id for a record and delete rows it loaded before
+
+        Must run inside the transaction that inserts the file's new rows,
+        so a changed file is replaced atomically.
+    """
+    create_manifest(connection)
+    connection.execute(
+        """
+        INSERT OR IGNORE INTO ingest_manifest (table_name, path)
+        VALUES (?, ?)
+        """, (table, record.path))
+    file_id, = connection.execute(
+        """
+        SELECT file_id FROM ingest_manifest
+        WHERE table_name = ? AND path = ?
+        """, (table, record.path)).fetchone()
+    connection.execute(f'DELETE FROM "{table}" WHERE source_file_id = ?',
+                       (file_id,))
+    return file_id
+
+
+def finish_file(connection, file_id, record):
+    """Record a file's size, modification time and hash once loaded"""
+    connection.execute(
+        """
+        UPDATE ingest_manifest
+        SET size = ?, mtime = ?, content_hash = ?, ingested_at = ?
+        WHERE file_id = ?
+        """, (record.size, record.mtime, record.content_hash,
+              datetime.datetime.now().isoformat(), file_id))
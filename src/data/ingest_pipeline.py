@@ -0,0 +1,162 @@
+"""
+Overlaps reading, transforming and writing the chunks of a raw file
+"""
+import queue
+import threading
+import time
+
+# marks the end of a stage's output on its queue
+_DONE = object()
+
+# seconds between checks whether another stage failed
+POLL_SECONDS = 0.1
+
+
+class PipelineStopped(Exception):
+    """ Raised in a stage when another stage of its pipeline failed """
+
+
+def get_stage_metrics():
+    """ Return the empty metrics of one pipeline stage
+
+        waiting_seconds is the time spent on an empty input queue, so the
+        stage before it is slower, blocked_seconds the time spent on a full
+        output queue, so the stage after it is slower.
+    """
+    return {'items': 0, 'seconds': 0.0, 'waiting_seconds': 0.0,
+            'blocked_seconds': 0.0, 'max_queued': 0}
+
+
+def put(chunks, item, stop, metrics):
+    """ Put an item on a bounded queue, waiting while it is full """
+    started = time.perf_counter()
+    while True:
+        if stop.is_set():
+            raise PipelineStopped()
+        try:
+            chunks.put(item, timeout=POLL_SECONDS)
+            break
+        except queue.Full:
+            pass
+    metrics['blocked_seconds'] += time.perf_counter() - started
+    metrics['max_queued'] = max(metrics['max_queued'], chunks.qsize())
+
+
+def iterate_queue(chunks, stop, metrics):
+    """ Yield items from a queue until the stage before it is done """
+    while True:
+        started = time.perf_counter()
+        while True:
+            if stop.is_set():
+                raise PipelineStopped()
+            try:
+                item = chunks.get(timeout=POLL_SECONDS)
+                break
+            except queue.Empty:
+                pass
+        metrics['waiting_seconds'] += time.perf_counter() - started
+        if item is _DONE:
+            return
+        metrics['items'] += 1
+        yield item
+
+
+def run_stage(stage, func, metrics, stop, errors):
+    """ Run one stage, recording its time and stopping the others if it
+        fails
+    """
+    started = time.perf_counter()
+    try:
+        func()
+    except PipelineStopped:
+        pass
+    except BaseException as error:
+        errors.append(error)
+        stop.set()
+    metrics[stage]['seconds'] = time.perf_counter() - started
+
+
+def read_chunks(chunks, raw, stop, metrics):
+    """ Put each chunk read on the raw queue """
+    for chunk in chunks:
+        metrics['items'] += 1
+        put(raw, chunk, stop, metrics)
+    put(raw, _DONE, stop, metrics)
+
+
+def transform_chunks(transform, raw, transformed, stop, metrics):
+    """ Put each item transformed from the raw queue on the next queue """
+    for item in transform(iterate_queue(raw, stop, metrics)):
+        put(transformed, item, stop, metrics)
+    put(transformed, _DONE, stop, metrics)
+
+
+def run_pipeline(chunks, transform, write, max_queued_chunks=4):
+    """ Read, transform and write chunks in three overlapping stages
+
+        A reader thread iterates chunks, e.g. a pandas csv reader, this
+        thread passes them through the transform generator and a writer
+        thread hands the transformed items to write, which must consume
+        them all. Each queue holds at most max_queued_chunks items. If any
+        stage fails the others stop, write sees the error before its
+        iterable ends, and the error is raised here.
+
+        Returns the result of write and the metrics of each stage.
+    """
+    raw = queue.Queue(max_queued_chunks)
+    transformed = queue.Queue(max_queued_chunks)
+    stop = threading.Event()
+    metrics = {stage: get_stage_metrics()
+               for stage in ['read', 'transform', 'write']}
+    errors, results = [], []
+
+    def read():
+        read_chunks(chunks, raw, stop, metrics['read'])
+
+    def write_chunks():
+        results.append(write(iterate_queue(transformed, stop,
+                                           metrics['write'])))
+
+    threads = [threading.Thread(target=run_stage,
+                                args=(stage, func, metrics, stop, errors),
+                                daemon=True)
+               for stage, func in [('read', read), ('write', write_chunks)]]
+    for thread in threads:
+        thread.start()
+    run_stage('transform', lambda: transform_chunks(
+        transform, raw, transformed, stop, metrics['transform']),
+        metrics, stop, errors)
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return results[0], metrics
+
+
+def count_rows(chunks, counts):
+    """ Yield chunks unchanged, adding their rows to counts['rows'] """
+    for chunk in chunks:
+        counts['rows'] += len(chunk)
+        yield chunk
+
+
+def add_metrics(totals, metrics):
+    """ Return the metrics of two pipeline runs combined, either may be
+        None
+    """
+    if totals is None or metrics is None:
+        return metrics if totals is None else totals
+    return {stage: {name: max(value, metrics[stage][name])
+                    if name == 'max_queued'
+                    else value + metrics[stage][name]
+                    for name, value in stage_totals.items()}
+            for stage, stage_totals in totals.items()}
+
+
+def format_metrics(metrics):
+    """ Return a one line summary of pipeline metrics for the log """
+    return ', '.join(
+        f'{stage} {m["seconds"]:.2f}s (waiting {m["waiting_seconds"]:.2f}s, '
+        f'blocked {m["blocked_seconds"]:.2f}s)'
+        for stage, m in metrics.items())
@@ -2,25 +2,33 @@
 Loads the airport CSV into sqlite database
 """
 import sys
+import datetime as datetime
+import numpy as np
 import pandas as pd
 import glob
-from sqlalchemy import create_engine
 import logging
+import os
 import random
 from collections import namedtuple
+import airport_registry as registry
+import database_writer as writer
+import ingest_manifest as manifest
+import ingest_pipeline as pipeline
+from data_helpers import record_input
 
 
 def get_airport_features():
     """ Return a dictionary of columns and target data types.
 
         Asserting str type is chosen for many types that contain numeric data,
-        primarily because no numeric operation is expected to be taken.
+        primarily because no numeric operation is expected to be taken. Ids
+        used in joins are stored as integers.
     """
     Feature = namedtuple('Feature', ['raw_name', 'storage_name', 'dtype'])
     return [
-        Feature('AIRPORT_SEQ_ID', 'airport_seq_id', str),
-        Feature('AIRPORT_ID', 'airport_id', str),
-        Feature('AIRPORT', 'airport', str),
+        Feature('AIRPORT_SEQ_ID', 'airport_seq_id', np.int32),
+        Feature('AIRPORT_ID', 'airport_id', np.int32),
+        Feature('AIRPORT', 'airport', 'airport_code'),
         Feature('DISPLAY_AIRPORT_NAME', 'display_airport_name', str),
         Feature('DISPLAY_AIRPORT_CITY_NAME_FULL',
                 'display_airport_city_name_full', str),
@@ -51,8 +59,8 @@ def get_airport_features():
         Feature('LONGITUDE', 'longitude', float),
         # Time features
         Feature('UTC_LOCAL_TIME_VARIATION', 'utc_local_time_variation', str),
-        Feature('AIRPORT_START_DATE', 'airport_start_date', str),
-        Feature('AIRPORT_THRU_DATE', 'airport_thru_date', str),
+        Feature('AIRPORT_START_DATE', 'airport_start_date', datetime.date),
+        Feature('AIRPORT_THRU_DATE', 'airport_thru_date', datetime.date),
         Feature('AIRPORT_IS_CLOSED', 'airport_is_closed', bool),
         Feature('AIRPORT_IS_LATEST', 'airport_is_latest', bool)
     ]
@@ -84,9 +92,13 @@ def transform_ariport_data(data):
     data.columns = [x.lower() for x in data.columns]
 
     features = get_airport_features()
+    # align the few lower cased names that differ from their storage name
+    data = data.rename(columns={f.raw_name.lower(): f.storage_name
+                                for f in features})
     for f in features:
-        if f.dtype == int:
-            data[f.storage_name] = data[f.storage_name].fillna(0).astype(int)
+        if f.dtype in writer.INTEGER_DTYPES:
+            data[f.storage_name] = \
+                data[f.storage_name].fillna(0).astype(f.dtype)
         if f.dtype == float:
             data[f.storage_name] = data[f.storage_name].fillna(0).astype(float)
 
@@ -104,23 +116,57 @@ def transform_ariport_data(data):
     return data
 
 
-def load_csv_into_database(file_name, path_to_database, logger):
-    db_engine = create_engine(path_to_database)
-    chunksize = 10000
-    i, j = 0, 1
-    logger.info(f"Uploading File: {file_name}")
-    with db_engine.connect() as connection:
-        reader = read_airport_data_from_csv(file_name, chunksize=chunksize,
-                                            as_iterator=True)
-        for chunk in reader:
-            chunk = transform_ariport_data(chunk)
-            chunk.index += j
-            i += 1
-            chunk.to_sql('airports', connection,
-                         chunksize=chunksize, if_exists='append')
-            j = chunk.index[-1] + 1
+def get_airport_columns():
+    """Return the columns of the airports table"""
+    return writer.get_table_columns(get_airport_features(), [
+        ('int_latitude', 'INTEGER'),
+        ('int_longitude', 'INTEGER')
+    ])
+
+
+def transform_airport_chunks(chunks):
+    """Yield transformed chunks of raw airport data, indexed as stored"""
+    j = 1
+    for chunk in chunks:
+        chunk = transform_ariport_data(chunk)
+        chunk.index += j
+        j = chunk.index[-1] + 1
+        yield chunk
+
+
+def generate_airport_chunks(file_name, chunksize=10000):
+    """Yield transformed chunks of an airport file, indexed as stored"""
+    yield from transform_airport_chunks(
+        read_airport_data_from_csv(file_name, chunksize=chunksize,
+                                   as_iterator=True))
 
+
+def load_csv_into_database(file_name, path_to_database, logger,
+                           record=None, pipelined=False):
+    """ Load an airport file, returning the rows written and the pipeline
+        metrics of pipelined loads, or None
+
+        The rows read and written are recorded as an input of the stage.
+    """
+    logger.info(f"Uploading File: {file_name}")
+    columns = get_airport_columns()
+    counts = {'rows': 0}
+    raw = pipeline.count_rows(
+        read_airport_data_from_csv(file_name, as_iterator=True), counts)
+    if pipelined:
+        rows, metrics = pipeline.run_pipeline(
+            raw, transform_airport_chunks,
+            lambda chunks: writer.write_dataframes(
+                path_to_database, 'airports', columns, chunks,
+                record=record))
+    else:
+        rows = writer.write_dataframes(path_to_database, 'airports', columns,
+                                       transform_airport_chunks(raw),
+                                       record=record)
+        metrics = None
+    record_input(file_name, counts['rows'], rows, os.path.getsize(file_name))
     logger.info(f"Upload Complete: {file_name}")
+    return rows, metrics
 
 
 def get_airport_files():
@@ -128,11 +174,20 @@ def get_airport_files():
     return glob.glob("data/raw/airports/*MASTER_CORD_All_All.csv")
 
 
-def load_airport_data(path_to_database):
+def load_airport_data(path_to_database, incremental=False, pipelined=False):
     logger = logging.getLogger(__name__)
     files = get_airport_files()
-    for f in files:
-        load_csv_into_database(f, path_to_database, logger)
+    records = manifest.select_files(path_to_database, 'airports', files,
+                                    incremental)
+    rows, metrics = 0, None
+    for record in records:
+        file_rows, file_metrics = load_csv_into_database(
+            record.path, path_to_database, logger, record, pipelined)
+        rows += file_rows
+        metrics = pipeline.add_metrics(metrics, file_metrics)
+    if records:
+        registry.clear_airport_registry()
+    return manifest.get_load_stats(records, rows, metrics)
 
 
 def main():
@@ -3,60 +3,98 @@ Loads the flights data into sqlite database
 """
 import sys
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import queue
+import numpy as np
 import pandas as pd
 import glob
 import random
 import datetime as datetime
-from sqlalchemy import create_engine
 import logging
+import os
 import time
+import database_writer as writer
+import ingest_manifest as manifest
+import ingest_pipeline as pipeline
+from data_helpers import record_input
 
 
 def identify_flight_features():
-    """ Return a dictionary of features for use from csv. """
+    """ Return a dictionary of features for use from csv.
+
+        Codes are dictionary encoded and times stored as epoch minutes, see
+        database_writer.SQL_TYPES.
+    """
     Feature = namedtuple('Feature', ['raw_name', 'storage_name', 'dtype'])
     return [
-        Feature('Year', 'year', int),
-        Feature('Month', 'month', int),
-        Feature('DayofMonth', 'day_of_month', int),
-        Feature('DayOfWeek', 'day_of_week', int),
+        Feature('Year', 'year', np.int16),
+        Feature('Month', 'month', np.int8),
+        Feature('DayofMonth', 'day_of_month', np.int8),
+        Feature('DayOfWeek', 'day_of_week', np.int8),
         Feature('FlightDate', 'flight_date', datetime.date),
-        Feature('UniqueCarrier', 'carrier', str),
-        Feature('AirlineID', 'airline_id', str),
-        Feature('TailNum', 'tail_number', str),
-        Feature('Origin', 'origin', str),
-        Feature('OriginAirportID', 'origin_airport_id', str),
-        Feature('OriginAirportSeqID', 'origin_airport_sequence_id', str),
-        Feature('Dest', 'dest', str),
-        Feature('DestAirportID', 'dest_airport_id', str),
+        Feature('UniqueCarrier', 'carrier', 'carrier_code'),
+        Feature('AirlineID', 'airline_id', np.int32),
+        Feature('TailNum', 'tail_number', 'tail_code'),
+        Feature('Origin', 'origin', 'airport_code'),
+        Feature('OriginAirportID', 'origin_airport_id', np.int32),
+        Feature('OriginAirportSeqID', 'origin_airport_sequence_id', np.int32),
+        Feature('Dest', 'dest', 'airport_code'),
+        Feature('DestAirportID', 'dest_airport_id', np.int32),
         Feature('CRSDepTime', 'departure_time_scheduled', 'time'),
         Feature('DepTimeBlk', 'departure_time_block', str),
         Feature('DepTime', 'departure_time_actual', 'time'),
-        Feature('DepDelay', 'departure_delay', int),
+        Feature('DepDelay', 'departure_delay', np.int16),
         Feature('DepDel15', 'departure_was_delayed_15', bool),
         Feature('CRSArrTime', 'arrival_time_scheduled', 'time'),
         Feature('ArrTimeBlk', 'arrival_time_block', str),
         Feature('ArrTime', 'arrival_time_actual', 'time'),
-        Feature('ArrDelay', 'departure_delay', int),
+        Feature('ArrDelay', 'arrival_delay', np.int16),
         Feature('ArrDel15', 'arrival_was_delayed_15', bool),
         Feature('Cancelled', 'cancelled', bool),
         Feature('CancellationCode', 'cancelled_code', str),
         Feature('Diverted', 'diverted', bool),
-        Feature('CRSElapsedTime', 'elapsed_time_scheduled', int),
-        Feature('ActualElapsedTime', 'elapsed_time_acutal', int),
-        Feature('Distance', 'distance', int),
-        Feature('Flights', 'flights', int)
+        Feature('CRSElapsedTime', 'elapsed_time_scheduled', np.int16),
+        Feature('ActualElapsedTime', 'elapsed_time_acutal', np.int16),
+        Feature('Distance', 'distance', np.int16),
+        Feature('Flights', 'flights', np.int8)
     ]
 
 
-def read_flight_data_from_csv(file_name, as_iterator=False, chunksize=None):
-    """ Read the contents of a provided csv into a dataframe or iterator """
+def get_flight_parse_dtypes():
+    """ Return the dtype used to parse each selected raw column.
+
+        Numeric, boolean and time columns are read as float, since cancelled
+        and diverted flights leave delays and times blank.
+    """
+    parse_dtypes = {}
+    for f in identify_flight_features():
+        if f.dtype in writer.INTEGER_DTYPES + [float, bool, 'time']:
+            parse_dtypes[f.raw_name] = float
+        else:
+            parse_dtypes[f.raw_name] = str
+    return parse_dtypes
+
+
+def read_flight_data_from_csv(file_name, as_iterator=False, chunksize=10000):
+    """ Read the contents of a provided csv into a dataframe or iterator
+
+        Only the selected features are parsed, so the remaining raw columns
+        never reach memory.
+    """
+    features = identify_flight_features()
+    raw_features = [f.raw_name for f in features]
+    parse_dtypes = get_flight_parse_dtypes()
+
     if as_iterator:
         return pd.read_csv(file_name, encoding='latin-1', header=0,
-                           delimiter=',', low_memory=False, iterator=True)
+                           delimiter=',', low_memory=False,
+                           usecols=raw_features, dtype=parse_dtypes,
+                           iterator=True, chunksize=chunksize)
 
     return pd.read_csv(file_name, encoding='latin-1', low_memory=False,
-                       header=0, delimiter=',', iterator=False)
+                       header=0, delimiter=',', usecols=raw_features,
+                       dtype=parse_dtypes, iterator=False)
 
 
 def infer_time(time_num):
@@ -85,6 +123,62 @@ def infer_time(time_num):
     return time_delta
 
 
+def infer_times(time_nums):
+    """ Vectorized equivalent of infer_time for a whole column of values.
+
+        Mirrors how time.strptime('%H%M') splits the digits of each value, so
+        results are identical to ``time_nums.apply(infer_time)``: 2400 maps to
+        23:59, 0 to 00:01, missing values to 00:00 and single digits to
+        minutes. Three digit values are split as HH:M when the leading pair
+        is a valid hour (e.g. 130 -> 13:00), otherwise as H:MM.
+    """
+    time_nums = pd.Series(time_nums)
+    values = pd.to_numeric(time_nums, errors='coerce').to_numpy(dtype=float)
+    missing = ~np.isfinite(values)
+    nums = np.where(missing, 0, np.trunc(values)).astype(np.int64)
+    nums = np.where(nums == 2400, 2359, nums)
+    nums = np.where(nums == 0, 1, nums)
+
+    hours = np.zeros_like(nums)
+    minutes = np.zeros_like(nums)
+    valid = missing.copy()
+
+    # single digits fall through to strptime('%M')
+    one = ~missing & (nums >= 0) & (nums < 10)
+    minutes[one] = nums[one]
+    valid |= one
+
+    # two digits are always read as H then M
+    two = ~missing & (nums >= 10) & (nums < 100)
+    hours[two] = nums[two] // 10
+    minutes[two] = nums[two] % 10
+    valid |= two
+
+    # three digits read as HH:M if possible, else H:MM
+    three = ~missing & (nums >= 100) & (nums < 1000)
+    leading_hour = three & (nums // 10 <= 23)
+    hours[leading_hour] = nums[leading_hour] // 10
+    minutes[leading_hour] = nums[leading_hour] % 10
+    trailing_minute = three & ~leading_hour & (nums % 100 < 60)
+    hours[trailing_minute] = nums[trailing_minute] // 100
+    minutes[trailing_minute] = nums[trailing_minute] % 100
+    valid |= leading_hour | trailing_minute
+
+    four = ~missing & (nums >= 1000) & (nums < 10000)
+    four &= (nums // 100 <= 23) & (nums % 100 < 60)
+    hours[four] = nums[four] // 100
+    minutes[four] = nums[four] % 100
+    valid |= four
+
+    if not valid.all():
+        bad_value = time_nums[~valid].iloc[0]
+        raise ValueError(f"time data {bad_value!r} does not match format "
+                         f"'%H%M'")
+
+    return pd.Series(pd.to_timedelta(hours * 60 + minutes, unit='m'),
+                     index=time_nums.index)
+
+
 def handle_flight_features(data):
     """Transform raw data frame for storage or inspection"""
     features = identify_flight_features()
@@ -97,9 +191,9 @@ def handle_flight_features(data):
         data.rename(columns={f.raw_name: f.storage_name}, inplace=True)
 
     for f in features:
-        if f.dtype is int:
-            data.loc[:, f.storage_name] = \
-                data[f.storage_name].fillna(0).astype(int)
+        if f.dtype in writer.INTEGER_DTYPES:
+            data[f.storage_name] = \
+                data[f.storage_name].fillna(0).astype(f.dtype)
         if f.dtype is float:
             data.loc[:, f.storage_name] = \
                 data[f.storage_name].fillna(0).astype(float)
@@ -114,7 +208,7 @@ def handle_flight_features(data):
     # Only handle time after flight_date is successfully converted
     for f in features:
         if f.dtype is 'time':
-            time_deltas = data[f.storage_name].apply(infer_time)
+            time_deltas = infer_times(data[f.storage_name])
 
             data.loc[:, f.storage_name] = \
                 data.loc[:, 'flight_date'] + time_deltas
@@ -122,33 +216,243 @@ def handle_flight_features(data):
     return data
 
 
-def load_csv_into_database(file_name, path_to_database):
-    """Load a specified flight data file into local database, chunkwise"""
-    db_engine = create_engine(path_to_database)
-    chunksize = 10000
-    i, j = 0, 1
-    with db_engine.connect() as connection:
-        reader = read_flight_data_from_csv(file_name, as_iterator=True,
-                                           chunksize=chunksize)
-        for chunk in reader:
-            chunk = handle_flight_features(chunk)
-            chunk.index += j
-            i += 1
-            chunk.to_sql('flights', connection,
-                         chunksize=chunksize, if_exists='append')
-            j = chunk.index[-1] + 1
-
-
-def load_flight_data(path_to_database):
+def transform_flight_chunks(chunks):
+    """Yield transformed chunks of raw flight data, indexed as stored"""
+    j = 1
+    for chunk in chunks:
+        chunk = handle_flight_features(chunk)
+        chunk.index += j
+        j = chunk.index[-1] + 1
+        yield chunk
+
+
+def generate_flight_chunks(file_name, chunksize=10000):
+    """Yield transformed chunks of a flight file, indexed as stored"""
+    yield from transform_flight_chunks(
+        read_flight_data_from_csv(file_name, as_iterator=True,
+                                  chunksize=chunksize))
+
+
+def get_flight_columns():
+    """Return the columns of the flights table"""
+    return writer.get_table_columns(identify_flight_features())
+
+
+def load_csv_into_database(file_name, path_to_database, record=None,
+                           pipelined=False):
+    """ Load a specified flight data file into local database, chunkwise
+
+        Pipelined loads parse, transform and write chunks concurrently.
+        Returns the rows written and the pipeline metrics, or None. The
+        rows read and written are recorded as an input of the stage.
+    """
+    columns = get_flight_columns()
+    counts = {'rows': 0}
+    raw = pipeline.count_rows(
+        read_flight_data_from_csv(file_name, as_iterator=True), counts)
+    if not pipelined:
+        rows = writer.write_dataframes(path_to_database, 'flights', columns,
+                                       transform_flight_chunks(raw),
+                                       record=record)
+        metrics = None
+    else:
+        rows, metrics = pipeline.run_pipeline(
+            raw, transform_flight_chunks,
+            lambda chunks: writer.write_dataframes(
+                path_to_database, 'flights', columns, chunks,
+                record=record))
+    record_input(file_name, counts['rows'], rows,
+                 os.path.getsize(file_name))
+    return rows, metrics
+
+
+def _init_parse_worker(chunk_queue, writer_turn, stop):
+    """ Share the bounded chunk queue, the writer lock and the stop event
+        with a pool worker
+    """
+    global _chunk_queue, _writer_turn, _stop_parsing
+    # chunks left unread after the writer failed must not block the exit
+    chunk_queue.cancel_join_thread()
+    _chunk_queue = chunk_queue
+    _writer_turn = writer_turn
+    _stop_parsing = stop
+
+
+def _take_writer_turn(block):
+    """ Acquire the writer for the file of this worker
+
+        Returns whether it was acquired, raises PipelineStopped once the
+        writer failed.
+    """
+    while not _stop_parsing.is_set():
+        if not block:
+            return _writer_turn.acquire(block=False)
+        if _writer_turn.acquire(timeout=pipeline.POLL_SECONDS):
+            return True
+    raise pipeline.PipelineStopped()
+
+
+def _put_item(item):
+    """ Put an item on the chunk queue, raise PipelineStopped once the
+        writer failed
+    """
+    while not _stop_parsing.is_set():
+        try:
+            _chunk_queue.put(item, timeout=pipeline.POLL_SECONDS)
+            return
+        except queue.Full:
+            pass
+    raise pipeline.PipelineStopped()
+
+
+def _put_chunks(file_name, chunks):
+    """ Put parsed chunks of a file on the chunk queue, in order """
+    for chunk in chunks:
+        _put_item(('chunk', file_name, chunk))
+
+
+def _parse_file_into_queue(file_name, max_buffered_chunks):
+    """ Parse and transform a flight file, handing chunks to the writer
+
+        The chunks of a file are handed over while this worker holds the
+        writer, which the writer releases once the file is done or failed,
+        so no other file's chunks come in between. Until then up to
+        max_buffered_chunks chunks are parsed ahead and held here.
+    """
+    buffered, has_turn = [], False
+    try:
+        for chunk in generate_flight_chunks(file_name):
+            buffered.append(chunk)
+            has_turn = has_turn or _take_writer_turn(
+                len(buffered) >= max_buffered_chunks)
+            if has_turn:
+                _put_chunks(file_name, buffered)
+                buffered = []
+        # a worker that only gets the writer now still holds parsed chunks
+        has_turn = has_turn or _take_writer_turn(True)
+        _put_chunks(file_name, buffered)
+        _put_item(('done', file_name, None))
+    except pipeline.PipelineStopped:
+        return
+    except Exception:
+        # always signal the writer so it never waits on a failed file
+        has_turn = has_turn or _take_writer_turn(True)
+        _put_item(('failed', file_name, None))
+        raise
+
+
+def _write_next_file(connection, chunk_queue, writer_turn, columns,
+                     records):
+    """ Insert the queued chunks of the next file in its own transaction
+
+        The old rows of the file are deleted, its new rows inserted and the
+        manifest entry recorded in one transaction, committed when the
+        worker reports the file done and rolled back when it reports a
+        failure, which leaves the rows loaded before untouched. Returns the
+        status and name of the file, the rows received and the rows kept.
+    """
+    status, file_name, chunk = chunk_queue.get()
+    rows = 0
+    connection.execute('BEGIN')
+    try:
+        file_id = manifest.start_file(connection, 'flights',
+                                      records[file_name])
+        while status == 'chunk':
+            rows += writer.insert_dataframe(connection, 'flights', chunk,
+                                            columns, file_id)
+            status, _, chunk = chunk_queue.get()
+        # the next file's worker can queue chunks while this one commits
+        writer_turn.release()
+        if status == 'done':
+            manifest.finish_file(connection, file_id, records[file_name])
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT' if status == 'done' else 'ROLLBACK')
+    return status, file_name, rows, rows if status == 'done' else 0
+
+
+def load_files_in_parallel(records, path_to_database, workers,
+                           max_queued_chunks=8):
+    """ Parse files across a process pool while this process writes.
+
+        Workers push transformed chunks onto a bounded queue one file at a
+        time, so at most ``max_queued_chunks`` chunks wait on the queue and
+        as many again are parsed ahead across the workers, for the single
+        writer that owns the database connection. Each file is written in
+        its own transaction and row indexes are assigned per file exactly
+        as in the sequential loader. If the writer fails the workers stop.
+        Returns the rows written, each file is recorded as an input of the
+        stage.
+    """
+    logger = logging.getLogger(__name__)
+    chunk_queue = multiprocessing.Queue(maxsize=max_queued_chunks)
+    writer_turn = multiprocessing.Lock()
+    stop = multiprocessing.Event()
+    columns = get_flight_columns()
+    records = {r.path: r for r in records}
+    max_buffered_chunks = max(1, max_queued_chunks // workers)
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_parse_worker,
+                             initargs=(chunk_queue, writer_turn, stop)) \
+            as pool, \
+            writer.ingest_connection(path_to_database) as connection:
+        futures = [pool.submit(_parse_file_into_queue, f,
+                               max_buffered_chunks) for f in records]
+        try:
+            writer.create_table(connection, 'flights', columns)
+            rows = 0
+            for _ in range(len(records)):
+                status, file_name, rows_in, file_rows = _write_next_file(
+                    connection, chunk_queue, writer_turn, columns, records)
+                record_input(file_name, rows_in, file_rows,
+                             records[file_name].size)
+                rows += file_rows
+                if status == 'failed':
+                    logger.error(f'Failed...{file_name}')
+                else:
+                    logger.info(f'Complete...{file_name}')
+        except BaseException:
+            # workers blocked on the full queue would keep the pool open
+            stop.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+        # re-raise any error encountered by a worker
+        for future in futures:
+            future.result()
+    return rows
+
+
+def load_flight_data(path_to_database, workers=1, max_queued_chunks=8,
+                     incremental=False, pipelined=False):
     logger = logging.getLogger(__name__)
     # Reverse sort to load most recent years first
     files = sorted(glob.glob("data/raw/flights/On_Time_On_Time*.csv"),
                    reverse=True)
+    records = manifest.select_files(path_to_database, 'flights', files,
+                                    incremental)
+    logger.info(f'{len(records)} of {len(files)} flight files to load')
+
+    if workers > 1:
+        logger.info(f'Loading {len(records)} files with {workers} workers')
+        rows = load_files_in_parallel(records, path_to_database, workers,
+                                      max_queued_chunks)
+        return manifest.get_load_stats(records, rows)
 
-    for f in files:
-        logger.info(f'Loading {f} into database')
-        load_csv_into_database(f, path_to_database)
+    rows, metrics = 0, None
+    for record in records:
+        logger.info(f'Loading {record.path} into database')
+        file_rows, file_metrics = load_csv_into_database(
+            record.path, path_to_database, record, pipelined)
+        rows += file_rows
+        metrics = pipeline.add_metrics(metrics, file_metrics)
+        if file_metrics is not None:
+            logger.info(pipeline.format_metrics(file_metrics))
         logger.info('Complete...loading next file')
+    return manifest.get_load_stats(records, rows, metrics)
 
 
 def main():
@@ -5,9 +5,20 @@ from collections import namedtuple
 import datetime as datetime
 import glob
 import logging
+import os
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
 import sys
+import database_writer as writer
+import ingest_manifest as manifest
+import ingest_pipeline as pipeline
+from data_helpers import record_input
+
+# state carried between chunks by fill_missing_weather
+FillState = namedtuple('FillState', ['last_record', 'precipitation',
+                                     'missing_precipitation'])
+# state carried between chunks by add_hourly_weather
+HourlyState = namedtuple('HourlyState', ['held', 'previous', 'rows'])
 
 
 def identify_weather_features():
@@ -33,11 +44,19 @@ def identify_weather_features():
     ]
 
 
-def parse_weather_data(file_name):
-    """Convert a given weather csv into a dataframe for storage"""
+def read_weather_data_from_csv(file_name, as_iterator=False, chunksize=10000):
+    """ Read the contents of a provided csv into a dataframe or iterator """
+    raw_feature_names = [f.raw_name for f in identify_weather_features()]
+    if as_iterator:
+        return pd.read_csv(file_name, usecols=raw_feature_names,
+                           low_memory=False, iterator=True,
+                           chunksize=chunksize)
+    return pd.read_csv(file_name, usecols=raw_feature_names, low_memory=False)
+
+
+def convert_weather_types(data):
+    """Rename raw weather columns and convert them to their data types"""
     features = identify_weather_features()
-    raw_feature_names = [f.raw_name for f in features]
-    data = pd.read_csv(file_name, usecols=raw_feature_names, low_memory=False)
 
     # Rename all features to storage name with snake_case
     for f in features:
@@ -61,44 +80,294 @@ def parse_weather_data(file_name):
         # handle string types
         else:
             data[f.storage_name] = data[f.storage_name].astype(f.dtype)
+    return data
+
 
+def fill_missing_weather(data, state=None):
+    """ Fill missing observations, returning the data and a FillState
+
+        Passing the state returned for the previous chunk of a file
+        continues the fill across the chunk boundary, so filling a file
+        chunk by chunk gives the same result as filling it whole.
+    """
     # for missing wind gusts, assume zero
     data['hourly_wind_gust_speed'] = \
         data['hourly_wind_gust_speed'].fillna(0)
-    # for missing precipitation, forward fill at most two records
-    data['hourly_precipitation'] = \
-        data['hourly_precipitation'].fillna(method='ffill', limit=2)
+
+    # for missing precipitation, forward fill at most two records, counting
+    # the records missing at the end of the previous chunk
+    precipitation = data['hourly_precipitation']
+    carried = []
+    if state is not None and not pd.isna(state.precipitation):
+        carried = [state.precipitation] + \
+            [np.nan] * min(state.missing_precipitation, 2)
+    filled = pd.concat([pd.Series(carried, dtype=float), precipitation],
+                       ignore_index=True).fillna(method='ffill', limit=2)
+
+    valid = np.flatnonzero(precipitation.notna().to_numpy())
+    if len(valid):
+        last_precipitation = precipitation.iloc[valid[-1]]
+        missing_precipitation = len(precipitation) - valid[-1] - 1
+    elif state is not None:
+        last_precipitation = state.precipitation
+        missing_precipitation = state.missing_precipitation + len(data)
+    else:
+        last_precipitation = np.nan
+        missing_precipitation = len(data)
+
     data['hourly_precipitation'] = \
-        data['hourly_precipitation'].fillna(0)
-    # forward fill remainder of missing data
-    data = data.fillna(method='ffill')
+        filled.iloc[len(carried):].fillna(0).to_numpy()
+
+    # forward fill remainder of missing data, from the previous chunk's
+    # last record if there is one
+    if state is not None:
+        data = pd.concat([state.last_record, data]) \
+            .fillna(method='ffill').iloc[1:]
+    else:
+        data = data.fillna(method='ffill')
 
+    return data, FillState(data.iloc[[-1]], last_precipitation,
+                           missing_precipitation)
+
+
+def add_fuzzy_location(data):
+    """Add the coordinates used to fuzzy match stations on location"""
     # fuzzy match on lat and long
     data['int_latitude'] = data['latitude'] * 10
     data['int_latitude'] = data['int_latitude'].astype(int)
     data['int_longitude'] = data['longitude'] * 10
     data['int_longitude'] = data['int_longitude'].astype(int)
-
     return data
 
 
-def load_csv_into_database(file_name, path_to_database):
-    db_engine = create_engine(path_to_database)
+def parse_weather_data(file_name):
+    """Convert a given weather csv into a dataframe for storage"""
+    data = convert_weather_types(read_weather_data_from_csv(file_name))
+    data, _ = fill_missing_weather(data)
+    return add_fuzzy_location(data)
+
+
+def generate_weather_chunks(file_name, chunksize=10000):
+    """ Yield parsed chunks of a weather file, indexed as stored
+
+        Memory is bounded by the chunk size, the output matches
+        parse_weather_data for the whole file.
+    """
+    yield from transform_weather_chunks(
+        read_weather_data_from_csv(file_name, as_iterator=True,
+                                   chunksize=chunksize))
+
+
+def transform_weather_chunks(chunks):
+    """ Yield parsed chunks of raw weather data, missing values filled
+        across chunk boundaries
+    """
+    state = None
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        chunk, state = fill_missing_weather(convert_weather_types(chunk),
+                                            state)
+        yield add_fuzzy_location(chunk)
+
+
+def get_hourly_aggregations():
+    """ Return how the observations within an hour combine, per column
+
+        Readings describing conditions at observation time keep the latest
+        value in the hour, visibility keeps the lowest reading, and
+        precipitation and wind gusts keep the highest.
+    """
+    return {
+        'station_name': 'last',
+        'elevation': 'last',
+        'latitude': 'last',
+        'longitude': 'last',
+        'hourly_visibility': 'min',
+        'hourly_dry_bulb_temp_f': 'last',
+        'hourly_wet_bulb_temp_f': 'last',
+        'hourly_dew_point_temp_f': 'last',
+        'hourly_relative_humidity': 'last',
+        'hourly_precipitation': 'max',
+        'hourly_wind_speed': 'last',
+        'hourly_wind_direction': 'last',
+        'hourly_wind_gust_speed': 'max',
+        'hourly_station_pressure': 'last',
+        'int_latitude': 'last',
+        'int_longitude': 'last'
+    }
+
+
+def build_hourly_weather(data, previous=None):
+    """ Return one row per station and hour from parsed weather data
+
+        Observations are grouped by the hour they fall in and combined per
+        get_hourly_aggregations. Hours without observations between a
+        station's first and last are filled with the previous hour, except
+        precipitation which is taken as zero.
+
+        previous holds the last hour already built for some stations, gaps
+        up to their first hour in data are filled from it.
+    """
+    columns = [name for name, _ in get_hourly_weather_columns()
+               if name not in ['index', 'source_file_id']]
+    if data.empty:
+        return pd.DataFrame(columns=columns)
+
+    data = data.sort_values(['station', 'date'], kind='mergesort')
+    data['measurement_hour'] = data['date'].dt.floor('H')
+    hourly = data.groupby(['station', 'measurement_hour']) \
+        .agg(get_hourly_aggregations())
+    if previous is None:
+        previous = pd.DataFrame(columns=['station'])
+    previous = previous.set_index('station')
+
+    frames = []
+    for station, group in hourly.groupby(level='station'):
+        group = group.droplevel('station')
+        seeded = station in previous.index
+        if seeded:
+            seed = previous.loc[[station]].set_index('measurement_hour')
+            group = pd.concat([seed[group.columns], group])
+        hours = pd.date_range(group.index.min(), group.index.max(), freq='H',
+                              name='measurement_hour')
+        group = group.reindex(hours)
+        group['hourly_precipitation'] = \
+            group['hourly_precipitation'].fillna(0)
+        group = group.fillna(method='ffill').reset_index()
+        group.insert(0, 'station', station)
+        frames.append(group.iloc[1:] if seeded else group)
+    return pd.concat(frames, ignore_index=True)[columns]
+
+
+def add_hourly_weather(chunk, state=None):
+    """ Return the hours of a parsed chunk that are complete, and the
+        HourlyState to pass with the next chunk of the same file
+
+        Observations in each station's latest hour are held back, as the
+        next chunk may add to that hour. Dates must ascend within each
+        station, as they do in LCD files.
+    """
+    if state is None:
+        state = HourlyState(None, None, 0)
+    if state.held is not None:
+        chunk = pd.concat([state.held, chunk])
+
+    hours = chunk['date'].dt.floor('H')
+    latest = hours.groupby(chunk['station']).transform('max')
+    hourly = build_hourly_weather(chunk[hours < latest], state.previous)
+    return finish_chunk(hourly, state._replace(held=chunk[hours == latest]))
+
+
+def finish_hourly_weather(state):
+    """ Return the hours still held back once a file's chunks are added """
+    if state is None or state.held is None:
+        return build_hourly_weather(pd.DataFrame())
+    hourly = build_hourly_weather(state.held, state.previous)
+    return finish_chunk(hourly, state._replace(held=None))[0]
+
+
+def finish_chunk(hourly, state):
+    """Index built hours as stored and remember each station's last hour"""
+    hourly.index += state.rows
+    previous = hourly.groupby('station').tail(1)
+    if state.previous is not None:
+        kept = state.previous[~state.previous['station']
+                              .isin(previous['station'])]
+        previous = pd.concat([kept, previous])
+    return hourly, state._replace(previous=previous,
+                                  rows=state.rows + len(hourly))
+
+
+def get_weather_columns():
+    """Return the columns of the weather table"""
+    return writer.get_table_columns(identify_weather_features(), [
+        ('int_latitude', 'INTEGER'),
+        ('int_longitude', 'INTEGER')
+    ])
+
+
+def get_hourly_weather_columns():
+    """Return the columns of the hourly_weather table"""
+    features = [f for f in identify_weather_features()
+                if f.storage_name != 'date']
+    return writer.get_table_columns(features, [
+        ('measurement_hour', writer.SQL_TYPES[datetime.datetime]),
+        ('int_latitude', 'INTEGER'),
+        ('int_longitude', 'INTEGER')
+    ])
+
+
+def generate_weather_tables(file_name, chunksize=10000):
+    """ Yield (table, dataframe) pairs for the weather and hourly_weather
+        tables from one pass over a weather file
+    """
+    yield from transform_weather_tables(
+        read_weather_data_from_csv(file_name, as_iterator=True,
+                                   chunksize=chunksize))
+
+
+def transform_weather_tables(chunks):
+    """ Yield (table, dataframe) pairs for the weather and hourly_weather
+        tables from chunks of raw weather data
+    """
+    state = None
+    for chunk in transform_weather_chunks(chunks):
+        yield 'weather', chunk
+        hourly, state = add_hourly_weather(chunk, state)
+        yield 'hourly_weather', hourly
+    yield 'hourly_weather', finish_hourly_weather(state)
+
+
+def load_csv_into_database(file_name, path_to_database, record=None,
+                           pipelined=False):
+    """ Load a weather file into the weather and hourly_weather tables
 
-    with db_engine.connect() as connection:
-        data = parse_weather_data(file_name)
-        data.to_sql('weather', connection, if_exists='append')
+        Pipelined loads parse, transform and write chunks concurrently.
+        Returns the weather rows written and the pipeline metrics, or None.
+        The rows read and the weather rows written are recorded as an input
+        of the stage.
+    """
+    tables = {
+        'weather': get_weather_columns(),
+        'hourly_weather': get_hourly_weather_columns()
+    }
+    counts = {'rows': 0}
+    raw = pipeline.count_rows(
+        read_weather_data_from_csv(file_name, as_iterator=True), counts)
+    if not pipelined:
+        rows = writer.write_table_frames(path_to_database, tables,
+                                         transform_weather_tables(raw),
+                                         record=record)
+        metrics = None
+    else:
+        rows, metrics = pipeline.run_pipeline(
+            raw, transform_weather_tables,
+            lambda frames: writer.write_table_frames(
+                path_to_database, tables, frames, record=record))
+    record_input(file_name, counts['rows'], rows['weather'],
+                 os.path.getsize(file_name))
+    return rows['weather'], metrics
 
 
-def load_weather_data(path_to_database):
+def load_weather_data(path_to_database, incremental=False, pipelined=False):
     logger = logging.getLogger(__name__)
     # Reverse sort to load most recent years first
     files = sorted(glob.glob("data/raw/weather/*.csv"))
+    records = manifest.select_files(path_to_database, 'weather', files,
+                                    incremental)
 
-    for f in files:
-        logger.info(f'Loading {f} into database')
-        load_csv_into_database(f, path_to_database)
+    rows, metrics = 0, None
+    for record in records:
+        logger.info(f'Loading {record.path} into database')
+        file_rows, file_metrics = load_csv_into_database(
+            record.path, path_to_database, record, pipelined)
+        rows += file_rows
+        metrics = pipeline.add_metrics(metrics, file_metrics)
+        if file_metrics is not None:
+            logger.info(pipeline.format_metrics(file_metrics))
         logger.info('Complete...loading next file')
+    return manifest.get_load_stats(records, rows, metrics)
 
 
 def main():
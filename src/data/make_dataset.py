@@ -1,27 +1,78 @@
 # -*- coding: utf-8 -*-
+import datetime as datetime
 import os
 from dotenv import find_dotenv, load_dotenv
 import load_airport_data as airports
 import load_flight_data as flights
 import load_weather_data as weather
+import build_delay_summary as summary
+import manage_indexes as indexes
+import match_weather_stations as stations
+from data_helpers import run_stage, write_run_report
 import logging
 
 
-def main():
-    """ Runs data processing scripts to turn raw data from (../raw) into
-        cleaned data ready to be analyzed (saved in ../processed).
+def make_dataset(path_to_db, ingest_workers=1, incremental=True,
+                 columnar_store=False, pipelined=False):
+    """ Load raw data into the database and build the derived tables
+
+        Raw files are read from data/raw under the working directory.
+        Pipelined loads parse, transform and write each file concurrently.
     """
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
 
-    path_to_db = 'sqlite:///data/processed/airlines.db'
+    # wall and cpu time, inputs and peak memory of each stage
+    stages = []
+    started_at = datetime.datetime.now()
 
     logger.info('loading airport data')
-    airports.load_airport_data(path_to_db)
+    run_stage(stages, 'airports', airports.load_airport_data, path_to_db,
+              incremental=incremental, pipelined=pipelined)
     logger.info('handling weather data')
-    weather.load_weather_data(path_to_db)
+    run_stage(stages, 'weather', weather.load_weather_data, path_to_db,
+              incremental=incremental, pipelined=pipelined)
     logger.info('loading flight data')
-    flights.load_flight_data(path_to_db)
+    run_stage(stages, 'flights', flights.load_flight_data, path_to_db,
+              workers=ingest_workers, incremental=incremental,
+              pipelined=pipelined)
+    logger.info('updating flight delay summary')
+    run_stage(stages, 'delay_summary', summary.update_delay_summary,
+              path_to_db)
+    logger.info('matching airports to weather stations')
+    run_stage(stages, 'station_mapping', stations.build_station_mapping,
+              path_to_db)
+    logger.info('creating indexes')
+    run_stage(stages, 'indexes', indexes.create_indexes, path_to_db)
+    indexes.report_table_sizes(path_to_db)
+    indexes.report_index_sizes(path_to_db)
+
+    # optionally mirror the database into the parquet store for features
+    if columnar_store:
+        import export_columnar as columnar
+
+        logger.info('exporting columnar store')
+        run_stage(stages, 'columnar_store', columnar.export_columnar_store,
+                  path_to_db)
+
+    report = write_run_report('make_dataset', stages, started_at)
+    logger.info(f'run report written to {report}')
+
+
+def main():
+    """ Runs data processing scripts to turn raw data from (../raw) into
+        cleaned data ready to be analyzed (saved in ../processed).
+    """
+    path_to_db = 'sqlite:///data/processed/airlines.db'
+    # number of processes used to parse flight files, 1 loads sequentially
+    ingest_workers = int(os.environ.get('INGEST_WORKERS', 1))
+    # 'incremental' only loads raw files that are new or changed since the
+    # last ingest, 'full' reloads every file; both replace a file's old rows
+    incremental = os.environ.get('INGEST_MODE', 'incremental') != 'full'
+    # overlap parsing, transforming and writing each file in threads
+    pipelined = bool(os.environ.get('INGEST_PIPELINE'))
+    make_dataset(path_to_db, ingest_workers, incremental,
+                 bool(os.environ.get('COLUMNAR_STORE')), pipelined)
 
 
 if __name__ == '__main__':
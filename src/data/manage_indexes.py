@@ -0,0 +1,162 @@
+"""
+Creates the indexes used by the feature and query modules
+"""
+from collections import namedtuple
+import logging
+import sqlite3
+import sys
+import database_writer as writer
+from data_helpers import (count_bytes_read, get_bytes_read,
+                          get_database_file, record_input)
+
+
+def get_indexes():
+    """ Return the indexes matched to the queries run against the database
+
+        Column order follows each query: equality filters first, then the
+        range filter on the date column.
+    """
+    Index = namedtuple('Index', ['name', 'table', 'columns'])
+    return [
+        # build_flight_features: origin = ? AND flight_date BETWEEN ? AND ?
+        Index('ix_flights_origin_flight_date', 'flights',
+              ['origin', 'flight_date']),
+        # query_flights: flight_date BETWEEN ? AND ? for every origin
+        Index('ix_flights_flight_date', 'flights', ['flight_date']),
+        # query_flights: join on the airport sequence id
+        Index('ix_airports_airport_seq_id', 'airports', ['airport_seq_id']),
+        # build_weather_features: airport = ?, then station and hour range
+        Index('ix_airport_weather_stations_airport',
+              'airport_weather_stations', ['airport', 'station']),
+        Index('ix_hourly_weather_station_measurement_hour', 'hourly_weather',
+              ['station', 'measurement_hour']),
+        # notebooks: raw observations of a station over a date range
+        Index('ix_weather_station_date', 'weather', ['station', 'date']),
+        # query_flights: delay summaries over a date range
+        Index('ix_flight_delay_summary_flight_date', 'flight_delay_summary',
+              ['flight_date']),
+        # ingest_manifest: replacing the rows of a changed file
+        Index('ix_airports_source_file_id', 'airports', ['source_file_id']),
+        Index('ix_weather_source_file_id', 'weather', ['source_file_id']),
+        Index('ix_hourly_weather_source_file_id', 'hourly_weather',
+              ['source_file_id']),
+        Index('ix_flights_source_file_id', 'flights', ['source_file_id']),
+        Index('ix_flight_delay_summary_source_file_id',
+              'flight_delay_summary', ['source_file_id'])
+    ]
+
+
+def get_existing_tables(connection):
+    """Return the names of tables present in the database"""
+    rows = connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    return {name for name, in rows}
+
+
+def index_exists(connection, name):
+    """Return whether an index of that name exists"""
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+        (name,)).fetchone() is not None
+
+
+def create_index(connection, index):
+    """ Create an index, recording the table it read as an input of the
+        stage
+    """
+    started = get_bytes_read()
+    columns = ', '.join(f'"{c}"' for c in index.columns)
+    connection.execute(f'CREATE INDEX "{index.name}" '
+                       f'ON "{index.table}" ({columns})')
+    rows, = connection.execute(
+        f'SELECT COUNT(*) FROM "{index.table}" '
+        f'INDEXED BY "{index.name}"').fetchone()
+    record_input(index.table, rows, rows, count_bytes_read(started))
+
+
+def create_indexes(path_to_database):
+    """ Create all missing indexes, then refresh planner statistics
+
+        Each table read to build an index is recorded as an input, and the
+        bytes read by ANALYZE as one more.
+    """
+    logger = logging.getLogger(__name__)
+    with writer.ingest_connection(path_to_database) as connection:
+        tables = get_existing_tables(connection)
+        for index in get_indexes():
+            if index.table not in tables:
+                logger.info(f'Skipping {index.name}, no {index.table} table')
+                continue
+            if index_exists(connection, index.name):
+                continue
+            logger.info(f'Creating index {index.name}')
+            create_index(connection, index)
+        started = get_bytes_read()
+        connection.execute('ANALYZE')
+        record_input('ANALYZE', None, None, count_bytes_read(started))
+
+
+def get_index_sizes(path_to_database):
+    """ Return a dictionary of index name to size on disk in bytes
+
+        Sizes require sqlite to be compiled with the dbstat table, if it is
+        not available every size is reported as None.
+    """
+    names = [index.name for index in get_indexes()]
+    connection = sqlite3.connect(get_database_file(path_to_database))
+    try:
+        rows = connection.execute(
+            'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name').fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        connection.close()
+    sizes = dict(rows)
+    return {name: sizes.get(name) for name in names}
+
+
+def get_table_sizes(path_to_database):
+    """ Return a dictionary of table name to size on disk in bytes,
+        excluding indexes, empty if dbstat is not available
+    """
+    connection = sqlite3.connect(get_database_file(path_to_database))
+    try:
+        tables = get_existing_tables(connection)
+        rows = connection.execute(
+            'SELECT name, SUM(pgsize) FROM dbstat GROUP BY name').fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        connection.close()
+    return {name: size for name, size in rows if name in tables}
+
+
+def report_index_sizes(path_to_database):
+    """Log the size of each managed index"""
+    logger = logging.getLogger(__name__)
+    for name, size in get_index_sizes(path_to_database).items():
+        if size is None:
+            logger.info(f'{name}: size unavailable')
+        else:
+            logger.info(f'{name}: {size / 1024 ** 2:.1f} MB')
+
+
+def report_table_sizes(path_to_database):
+    """Log the size of each table"""
+    logger = logging.getLogger(__name__)
+    for name, size in sorted(get_table_sizes(path_to_database).items()):
+        logger.info(f'{name}: {size / 1024 ** 2:.1f} MB')
+
+
+def main():
+    """ Create indexes on the processed database, print their sizes """
+    path_to_db = 'sqlite:///data/processed/airlines.db'
+    create_indexes(path_to_db)
+    for name, size in get_table_sizes(path_to_db).items():
+        print(name, size)
+    for name, size in get_index_sizes(path_to_db).items():
+        print(name, size)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
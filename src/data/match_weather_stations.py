@@ -0,0 +1,130 @@
+"""
+Matches airports to their nearest weather stations
+"""
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from data_helpers import get_engine, get_frame_bytes, record_input
+import airport_registry as registry
+import database_writer as writer
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def get_station_mapping_columns():
+    """Return the columns of the airport_weather_stations table"""
+    return [
+        ('airport', 'TEXT'),
+        ('station', 'TEXT'),
+        ('station_rank', 'INTEGER'),
+        ('distance_km', 'REAL')
+    ]
+
+
+def read_station_locations(path_to_database):
+    """ Return one location per weather station """
+    engine = get_engine(path_to_database)
+    with engine.connect() as conn:
+        return pd.read_sql(
+            """
+            SELECT
+                w.station,
+                AVG(w.latitude) AS latitude,
+                AVG(w.longitude) AS longitude
+            FROM
+                weather AS w
+            GROUP BY
+                w.station
+            """,
+            conn)
+
+
+def read_airport_locations(path_to_database):
+    """ Return the location of the latest record of every airport """
+    airports = registry.to_frame(
+        registry.get_airport_registry(path_to_database))
+    return airports[['code', 'latitude', 'longitude']].rename(
+        columns={'code': 'airport'})
+
+
+def match_nearest_stations(airports, stations, k=1, radius_km=25.0):
+    """ Return the k nearest stations within a radius of each airport
+
+        Stations are indexed in a ball tree on haversine distance, so each
+        airport is matched in logarithmic time regardless of station count.
+    """
+    from sklearn.neighbors import BallTree
+
+    columns = [name for name, _ in get_station_mapping_columns()]
+    if airports.empty or stations.empty:
+        return pd.DataFrame(columns=columns)
+
+    tree = BallTree(np.radians(stations[['latitude', 'longitude']].values),
+                    metric='haversine')
+    k = min(k, len(stations))
+    distances, indices = tree.query(
+        np.radians(airports[['latitude', 'longitude']].values), k=k)
+
+    mapping = pd.DataFrame({
+        'airport': np.repeat(airports['airport'].values, k),
+        'station': stations['station'].values[indices.ravel()],
+        'station_rank': np.tile(np.arange(1, k + 1), len(airports)),
+        'distance_km': distances.ravel() * EARTH_RADIUS_KM
+    })
+    return mapping[mapping['distance_km'] <= radius_km][columns]
+
+
+def build_station_mapping(path_to_database, k=None, radius_km=None):
+    """ Rebuild the airport_weather_stations table from loaded data
+
+        k and radius_km default to WEATHER_STATION_K (1) and
+        WEATHER_STATION_RADIUS_KM (25). The airports and stations read are
+        recorded as inputs of the stage, with those that were matched.
+    """
+    logger = logging.getLogger(__name__)
+    if k is None:
+        k = int(os.environ.get('WEATHER_STATION_K', 1))
+    if radius_km is None:
+        radius_km = float(os.environ.get('WEATHER_STATION_RADIUS_KM', 25))
+
+    airports = read_airport_locations(path_to_database)
+    stations = read_station_locations(path_to_database)
+
+    started = time.perf_counter()
+    mapping = match_nearest_stations(airports, stations, k, radius_km)
+    elapsed = time.perf_counter() - started
+    logger.info(f'Matched {len(airports)} airports to {len(stations)} '
+                f'stations in {elapsed:.3f}s, '
+                f'{mapping["airport"].nunique()} airports within '
+                f'{radius_km} km')
+    record_input('airports', len(airports), mapping['airport'].nunique(),
+                 get_frame_bytes(airports))
+    record_input('weather stations', len(stations),
+                 mapping['station'].nunique(), get_frame_bytes(stations))
+
+    columns = get_station_mapping_columns()
+    with writer.ingest_connection(path_to_database) as connection:
+        with writer.transaction(connection):
+            connection.execute('DROP TABLE IF EXISTS airport_weather_stations')
+            column_sql = ', '.join(f'"{name}" {sql_type}'
+                                   for name, sql_type in columns)
+            connection.execute(
+                f'CREATE TABLE airport_weather_stations ({column_sql})')
+            connection.executemany(
+                'INSERT INTO airport_weather_stations VALUES (?, ?, ?, ?)',
+                mapping.itertuples(index=False, name=None))
+    return mapping
+
+
+def main():
+    """ Rebuild the mapping on the processed database, print to console """
+    mapping = build_station_mapping('sqlite:///data/processed/airlines.db')
+    print(mapping.head())
+    print(mapping.info())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
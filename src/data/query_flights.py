@@ -4,20 +4,23 @@ Wrappers for database queries
 
 from datetime import date
 import pandas as pd
-from sqlalchemy import create_engine
+from data_helpers import get_engine, to_epoch_minutes
+import airport_registry as registry
 
 
 def flight_and_delay_summary_by_airport(start_date=date.min, end_date=date.max,
                                         delay_threshold=15, path_to_db=""):
-    """ Return a dataframe flight counts by day of week and year """
-    engine = create_engine(path_to_db)
+    """ Return a dataframe flight counts by day of week and year
+
+        Airport names are those of the latest airport records.
+    """
+    engine = get_engine(path_to_db)
     print("Connecting to Database:", path_to_db)
     with engine.connect() as conn:
         monthly_flights = pd.read_sql(
             """
             SELECT
-                a.display_airport_name as airport_name,
-                f.origin as airport_code,
+                c.code as airport_code,
                 COUNT(f.flights) AS departure_count,
                 SUM(
                     CASE WHEN
@@ -31,20 +34,121 @@ def flight_and_delay_summary_by_airport(start_date=date.min, end_date=date.max,
             FROM
                 flights AS f
             JOIN
-                airports as a
+                airport_codes as c
             ON
-                a.airport_seq_id = f.origin_airport_sequence_id
+                c.code_id = f.origin
             WHERE
-                f.flight_date
-            BETWEEN :start_date
-                AND :end_date
+                f.flight_date >= :start_date
+            AND
+                f.flight_date < :end_date
             GROUP BY
                 f.origin
             """,
             conn,
             params={
-                'start_date': start_date,
-                'end_date': end_date,
+                'start_date': to_epoch_minutes(start_date),
+                'end_date': to_epoch_minutes(end_date),
                 'delay_threshold': delay_threshold
             })
+    airports = registry.get_airport_registry(path_to_db)
+    monthly_flights.insert(0, 'airport_name', [
+        airports.name[airports.by_code[code]]
+        if code in airports.by_code else None
+        for code in monthly_flights['airport_code']])
     return monthly_flights
+
+
+# expressions grouping the delay summary, by name
+SUMMARY_GROUPS = {
+    'airport': 'o.code',
+    'carrier': 'c.code',
+    'date': "date(s.flight_date * 60, 'unixepoch')",
+    'year': "CAST(strftime('%Y', s.flight_date * 60, 'unixepoch') "
+            "AS INTEGER)",
+    'month': "CAST(strftime('%m', s.flight_date * 60, 'unixepoch') "
+             "AS INTEGER)",
+    # numbered as in the flights data, Monday is 1 and Sunday 7
+    'day_of_week': "(CAST(strftime('%w', s.flight_date * 60, 'unixepoch') "
+                   "AS INTEGER) + 6) % 7 + 1",
+    'hour': 's.departure_hour'
+}
+
+
+def delay_summary(group_by, start_date=date.min, end_date=date.max,
+                  path_to_db="", airport_code='all'):
+    """ Return departure and delay counts from the delay summary table
+
+        group_by is a list of SUMMARY_GROUPS names, e.g. ['airport',
+        'month']. Delays are departures delayed 15 minutes or more, flights
+        on dates from start_date up to but excluding end_date are counted,
+        departing from airport_code unless it is 'all'.
+    """
+    airport_filter = '' if airport_code == 'all' else \
+        'AND o.code = :airport_code'
+    groups = ', '.join(f'{SUMMARY_GROUPS[name]} AS {name}'
+                       for name in group_by)
+    engine = get_engine(path_to_db)
+    with engine.connect() as conn:
+        summary = pd.read_sql(
+            f"""
+            SELECT
+                {groups},
+                SUM(s.departure_count) AS departure_count,
+                SUM(s.delayed_count) AS delayed_count,
+                SUM(s.cancelled_count) AS cancelled_count,
+                SUM(s.departure_delay_sum) AS departure_delay_sum
+            FROM
+                flight_delay_summary AS s
+            JOIN
+                airport_codes AS o
+            ON
+                o.code_id = s.origin
+            JOIN
+                carrier_codes AS c
+            ON
+                c.code_id = s.carrier
+            WHERE
+                s.flight_date >= :start_date
+            AND
+                s.flight_date < :end_date
+            {airport_filter}
+            GROUP BY
+                {', '.join(group_by)}
+            ORDER BY
+                {', '.join(group_by)}
+            """,
+            conn,
+            params={
+                'start_date': to_epoch_minutes(start_date),
+                'end_date': to_epoch_minutes(end_date),
+                'airport_code': airport_code
+            })
+    summary['delayed_share'] = \
+        summary['delayed_count'] / summary['departure_count']
+    summary['departure_delay_mean'] = \
+        summary['departure_delay_sum'] / summary['departure_count']
+    return summary
+
+
+def delay_summary_by_airport(start_date=date.min, end_date=date.max,
+                             path_to_db=""):
+    """ Return departure and delay counts by origin airport """
+    return delay_summary(['airport'], start_date, end_date, path_to_db)
+
+
+def delay_summary_by_month(start_date=date.min, end_date=date.max,
+                           path_to_db=""):
+    """ Return departure and delay counts by year and month """
+    return delay_summary(['year', 'month'], start_date, end_date, path_to_db)
+
+
+def delay_summary_by_day_of_week(start_date=date.min, end_date=date.max,
+                                 path_to_db=""):
+    """ Return departure and delay counts by day of week """
+    return delay_summary(['day_of_week'], start_date, end_date, path_to_db)
+
+
+def delay_summary_by_hour(start_date=date.min, end_date=date.max,
+                          path_to_db=""):
+    """ Return departure and delay counts by scheduled departure hour """
+    return delay_summary(['hour'], start_date, end_date, path_to_db)
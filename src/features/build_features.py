@@ -2,46 +2,195 @@
 """
 
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
 import pandas as pd
 from datetime import date
+from datetime import datetime
+from datetime import time
 from datetime import timedelta
 import build_flight_features as flight_builder
 import build_weather_features as weather_builder
+import feature_cache
 from feature_helpers import get_database_connection_string
+from feature_helpers import get_airport_codes
+from feature_helpers import collect_inputs, get_frame_bytes, record_input
 
 
-def merge_departure_weather_data(weather, flights, hour_shift=3):
-    """ Combine weather and flights features for a departing airport """
+# oldest shifted weather observation an as-of merge will match
+DEFAULT_TOLERANCE = timedelta(hours=1)
+
+
+def merge_departure_weather_asof(weather, flights, tolerance):
+    """ Match each departure to the latest shifted weather observation
+
+        Both sides are sorted once and matched per airport, departures with
+        no observation within the tolerance are dropped.
+    """
+    merged = pd.merge_asof(
+        left=flights.sort_values('departure_time', kind='mergesort'),
+        right=weather.sort_values('m_hour_shifted', kind='mergesort'),
+        left_on='departure_time', right_on='m_hour_shifted',
+        left_by='origin', right_by='airport',
+        direction='backward', tolerance=tolerance)
+    return merged.dropna(subset=['m_hour_shifted']).reset_index(drop=True)
+
+
+def merge_departure_weather_data(weather, flights, hour_shift=3,
+                                 merge='exact', tolerance=DEFAULT_TOLERANCE):
+    """ Combine weather and flights features for departing airports
+
+        An 'exact' merge keeps departures scheduled on a shifted measurement
+        hour, an 'asof' merge matches every departure to the most recent
+        shifted observation no older than the tolerance.
+    """
     weather['m_hour_shifted'] = \
-        weather['measurement_hour'].apply(
-            lambda x: x + timedelta(hours=hour_shift)
-        )
+        weather['measurement_hour'] + timedelta(hours=hour_shift)
+
+    if merge == 'asof':
+        return merge_departure_weather_asof(weather, flights, tolerance)
+    if merge != 'exact':
+        raise ValueError(f'Unknown merge: {merge}')
 
     return pd.merge(left=flights, right=weather,
                     left_on=['origin', 'departure_time'],
                     right_on=['airport', 'm_hour_shifted'])
 
 
-def get_features_for_delay_classification(start_date=None, end_date=None,
-                                          airport_code=None, path_to_db=None):
-    if path_to_db is None:
-        path_to_db = get_database_connection_string()
-
+def compare_merge_retention(weather, flights, hour_shift=3,
+                            tolerance=DEFAULT_TOLERANCE):
+    """ Return departures kept by the exact and as-of merges, per airport """
+    flights = flights.assign(flight_row=np.arange(len(flights)))
+    retention = flights.groupby('origin').size().to_frame('departures')
+    for merge in ['exact', 'asof']:
+        merged = merge_departure_weather_data(weather.copy(), flights,
+                                              hour_shift, merge, tolerance)
+        retention[f'{merge}_rows'] = merged.groupby('origin').size()
+        retention[f'{merge}_departures'] = \
+            merged.groupby('origin')['flight_row'].nunique()
+        retention[f'{merge}_retention'] = \
+            retention[f'{merge}_departures'] / retention['departures']
+    return retention.fillna(0)
+
+
+def get_weather_start(start_date, hour_shift):
+    """ Return the first measurement hour departures from start_date match
+
+        Weather is shifted forward by hour_shift hours, so departures
+        shortly after midnight match hours of the day before.
+    """
+    if start_date is None:
+        start_date = date(2017, 1, 1)
+    return datetime.combine(start_date, time()) - timedelta(hours=hour_shift)
+
+
+def get_features_for_airports(start_date, end_date, airport_code, path_to_db,
+                              backend=None, hour_shift=3, merge='exact',
+                              tolerance=DEFAULT_TOLERANCE):
+    """ Build features for one or more airports from one pass of queries
+
+        The flights and weather read are recorded as inputs of the stage,
+        with the departures and weather hours kept by the merge.
+    """
     weather = weather_builder.get_weather_features(
-        start_date=start_date,
+        start_date=get_weather_start(start_date, hour_shift),
         end_date=end_date,
         airport_code=airport_code,
-        path_to_db=path_to_db
+        path_to_db=path_to_db,
+        backend=backend
     )
 
     flights = flight_builder.build_features_for_departing_flights(
         start_date=start_date,
         end_date=end_date,
         airport_code=airport_code,
-        path_to_db=path_to_db
+        path_to_db=path_to_db,
+        backend=backend
     )
 
-    return merge_departure_weather_data(weather, flights, 3)
+    flight_bytes, weather_bytes = \
+        get_frame_bytes(flights), get_frame_bytes(weather)
+    features = merge_departure_weather_data(weather, flights, hour_shift,
+                                            merge, tolerance)
+    record_input('flights', len(flights), len(features), flight_bytes)
+    record_input('weather', len(weather),
+                 len(features.drop_duplicates(['airport',
+                                               'measurement_hour'])),
+                 weather_bytes)
+    return features
+
+
+def build_airport_group(*args, **kwargs):
+    """ Build features in a worker, returning them with the inputs read """
+    with collect_inputs() as inputs:
+        features = get_features_for_airports(*args, **kwargs)
+    return features, inputs
+
+
+def build_features_for_airports(start_date, end_date, airport_code,
+                                path_to_db, backend=None, hour_shift=3,
+                                workers=1, merge='exact',
+                                tolerance=DEFAULT_TOLERANCE):
+    """ Build features in one pass, or split across a process pool """
+    if workers <= 1:
+        return get_features_for_airports(start_date, end_date, airport_code,
+                                         path_to_db, backend, hour_shift,
+                                         merge, tolerance)
+
+    airport_codes = get_airport_codes(airport_code)
+    if airport_codes is None:
+        airport_codes = flight_builder.get_departing_airports(
+            start_date, end_date, path_to_db, backend)
+    groups = [list(g) for g in np.array_split(airport_codes, workers)
+              if len(g)]
+
+    build = partial(build_airport_group, start_date, end_date,
+                    path_to_db=path_to_db, backend=backend,
+                    hour_shift=hour_shift, merge=merge, tolerance=tolerance)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(build, groups))
+    # inputs read by the workers count towards the stage of this process
+    for _, inputs in results:
+        for stats in inputs:
+            record_input(*stats)
+    return pd.concat([features for features, _ in results],
+                     ignore_index=True)
+
+
+def get_features_for_delay_classification(start_date=None, end_date=None,
+                                          airport_code=None, path_to_db=None,
+                                          backend=None, workers=1,
+                                          hour_shift=3, use_cache=True,
+                                          merge='exact',
+                                          tolerance=DEFAULT_TOLERANCE):
+    """ Return merged flight and weather features for departing flights
+
+        airport_code may be a single code, a list of codes or 'all'. All
+        selected airports are queried and merged in one pass, or with
+        several workers, split into groups built in a process pool. See
+        merge_departure_weather_data for the merge options. Results are
+        kept in the on-disk feature cache unless disabled.
+    """
+    if path_to_db is None:
+        path_to_db = get_database_connection_string()
+
+    if not use_cache or not feature_cache.is_cache_enabled():
+        return build_features_for_airports(start_date, end_date,
+                                           airport_code, path_to_db,
+                                           backend, hour_shift, workers,
+                                           merge, tolerance)
+
+    key = feature_cache.get_cache_key(start_date, end_date, airport_code,
+                                      hour_shift, merge, tolerance, backend)
+    features = feature_cache.load_features(path_to_db, key)
+    if features is None:
+        features = build_features_for_airports(start_date, end_date,
+                                               airport_code, path_to_db,
+                                               backend, hour_shift, workers,
+                                               merge, tolerance)
+        feature_cache.store_features(features, path_to_db, key)
+    return features
 
 
 def main():
@@ -4,50 +4,145 @@
 import sys
 import pandas as pd
 from datetime import date
-from sqlalchemy import create_engine
 import feature_helpers as helpers
+import columnar_store as columnar
 
+DEPARTING_FLIGHT_COLUMNS = [
+    'departure_was_delayed_15',
+    'origin',
+    'dest',
+    'carrier',
+    'departure_time_scheduled',
+    'distance',
+    'elapsed_time_scheduled'
+]
 
-def build_features_for_departing_flights(start_date=None, end_date=None,
-                                         airport_code=None, path_to_db=None):
-    """ Retreive features for flights departing from a selected airport """
+# narrow types of the stored integer columns
+DEPARTING_FLIGHT_DTYPES = {
+    'departure_was_delayed_15': 'int8',
+    'distance': 'int16',
+    'elapsed_time_scheduled': 'int16'
+}
+
+# airports and carriers are stored as ids into lookup tables of codes
+DEPARTING_FLIGHTS_QUERY = """
+    SELECT
+        f.departure_was_delayed_15,
+        o.code AS origin,
+        d.code AS dest,
+        c.code AS carrier,
+        f.departure_time_scheduled,
+        f.distance,
+        f.elapsed_time_scheduled
+    FROM
+        flights AS f
+    JOIN
+        airport_codes AS o
+    ON o.code_id = f.origin
+    JOIN
+        airport_codes AS d
+    ON d.code_id = f.dest
+    JOIN
+        carrier_codes AS c
+    ON c.code_id = f.carrier
+    WHERE
+        {airport_filter}
+    AND
+        f.flight_date >= :start_date
+    AND
+        f.flight_date < :end_date
+"""
+
+
+def get_departing_flights_query(start_date, end_date, airport_codes):
+    """ Return the departing flights query and params for airport codes """
+    airport_filter, params = helpers.get_airport_filter('o.code',
+                                                        airport_codes)
+    params.update(helpers.get_date_range_params(start_date, end_date))
+    return DEPARTING_FLIGHTS_QUERY.format(airport_filter=airport_filter), \
+        params
+
+
+def get_departing_flights(start_date, end_date, airport_code, path_to_db,
+                          backend=None):
+    """ Query flights departing from airports in the selected backend
+
+        airport_code may be a single code, a list of codes or 'all'. Both
+        backends return the same narrow types.
+    """
+    airport_codes = helpers.get_airport_codes(airport_code)
+    if helpers.get_feature_backend(backend) == 'parquet':
+        flights = columnar.read_departing_flights(start_date, end_date,
+                                                  airport_codes,
+                                                  DEPARTING_FLIGHT_COLUMNS,
+                                                  path_to_db)
+        return flights.astype(DEPARTING_FLIGHT_DTYPES)
+
+    query, params = get_departing_flights_query(start_date, end_date,
+                                                airport_codes)
+    engine = helpers.get_engine(path_to_db)
+    with engine.connect() as conn:
+        flights = pd.read_sql(query, conn, params=params)
+    flights['departure_time_scheduled'] = \
+        helpers.to_datetimes(flights['departure_time_scheduled'])
+    return flights.astype(DEPARTING_FLIGHT_DTYPES)
+
+
+def get_departing_airports(start_date, end_date, path_to_db, backend=None):
+    """ Return the codes of all airports with departures in a date range """
     if start_date is None:
         start_date = date(2017, 1, 1)
     if end_date is None:
         end_date = date(2017, 12, 31)
-    if airport_code is None:
-        airport_code = 'MDT'
 
-    engine = create_engine(path_to_db)
+    if helpers.get_feature_backend(backend) == 'parquet':
+        flights = columnar.read_departing_flights(start_date, end_date, None,
+                                                  ['origin'], path_to_db)
+        return sorted(flights['origin'].unique())
+
+    engine = helpers.get_engine(path_to_db)
     with engine.connect() as conn:
-        flights = pd.read_sql(
+        airports = pd.read_sql(
             """
             SELECT
-                f.departure_was_delayed_15,
-                f.origin,
-                f.dest,
-                f.carrier,
-                f.departure_time_scheduled,
-                f.distance,
-                f.elapsed_time_scheduled
+                c.code AS origin
             FROM
-                flights AS f
+                airport_codes AS c
             WHERE
-                f.Origin = :airport_code
-            AND
-                f.flight_date
-            BETWEEN :start_date
-                AND :end_date
+                EXISTS (
+                    SELECT
+                        1
+                    FROM
+                        flights AS f
+                    WHERE
+                        f.origin = c.code_id
+                    AND
+                        f.flight_date >= :start_date
+                    AND
+                        f.flight_date < :end_date
+                )
             """,
             conn,
-            params={
-                'start_date': start_date,
-                'end_date': end_date,
-                'airport_code': airport_code
-            })
+            params=helpers.get_date_range_params(start_date, end_date))
+    return sorted(airports['origin'])
+
+
+def build_features_for_departing_flights(start_date=None, end_date=None,
+                                         airport_code=None, path_to_db=None,
+                                         backend=None):
+    """ Retreive features for flights departing from a selected airport """
+    if start_date is None:
+        start_date = date(2017, 1, 1)
+    if end_date is None:
+        end_date = date(2017, 12, 31)
+    if airport_code is None:
+        airport_code = 'MDT'
+
+    flights = get_departing_flights(start_date, end_date, airport_code,
+                                    path_to_db, backend)
 
     flights['departure_time'] = \
-        flights['departure_time_scheduled'].apply(helpers.extract_datetime)
+        helpers.to_datetimes(flights['departure_time_scheduled'])
     flights['departure_month'] = flights['departure_time'].dt.month
     flights['departure_date'] = flights['departure_time'].dt.day
     flights['departure_dow'] = flights['departure_time'].dt.dayofweek
@@ -3,13 +3,70 @@
 import sys
 import pandas as pd
 from datetime import date
-from sqlalchemy import create_engine
 import feature_helpers as helpers
+import columnar_store as columnar
+
+WEATHER_COLUMNS = [
+    'hourly_visibility',
+    'hourly_dry_bulb_temp_f',
+    'hourly_precipitation',
+    'hourly_wind_speed',
+    'hourly_wind_gust_speed',
+    'hourly_station_pressure',
+    'measurement_hour'
+]
+
+WEATHER_QUERY = """
+    SELECT
+        s.airport,
+        s.station_rank,
+        w.hourly_visibility,
+        w.hourly_dry_bulb_temp_f,
+        w.hourly_precipitation,
+        w.hourly_wind_speed,
+        w.hourly_wind_gust_speed,
+        w.hourly_station_pressure,
+        w.measurement_hour
+    FROM
+        airport_weather_stations AS s
+    JOIN
+        hourly_weather AS w
+    ON w.station = s.station
+    WHERE
+        {airport_filter}
+    AND
+        w.measurement_hour >= :start_date
+    AND
+        w.measurement_hour < :end_date
+"""
+
+
+def get_weather_query(start_date, end_date, airport_codes):
+    """ Return the weather query and params for airport codes """
+    airport_filter, params = helpers.get_airport_filter('s.airport',
+                                                        airport_codes)
+    params.update(helpers.get_date_range_params(start_date, end_date))
+    return WEATHER_QUERY.format(airport_filter=airport_filter), params
+
+
+def select_nearest_stations(weather):
+    """ Keep the weather of the nearest station with data, per airport and
+        hour
+
+        With WEATHER_STATION_K above 1 an airport is matched to several
+        stations, farther ones only fill hours the nearest did not report.
+    """
+    weather = weather.sort_values('station_rank', kind='stable')
+    weather = weather.drop_duplicates(['airport', 'measurement_hour'])
+    return weather.drop(columns='station_rank').sort_index()
 
 
 def get_weather_data(start_date=None, end_date=None,
-                     airport_code=None, path_to_db=None):
-    """ Query weather features at selected airport """
+                     airport_code=None, path_to_db=None, backend=None):
+    """ Query weather features at selected airports
+
+        airport_code may be a single code, a list of codes or 'all'.
+    """
     if start_date is None:
         start_date = date(2017, 1, 1)
     if end_date is None:
@@ -17,55 +74,37 @@ def get_weather_data(start_date=None, end_date=None,
     if airport_code is None:
         airport_code = 'MDT'
 
-    engine = create_engine(path_to_db)
+    airport_codes = helpers.get_airport_codes(airport_code)
+    if helpers.get_feature_backend(backend) == 'parquet':
+        return select_nearest_stations(columnar.read_weather(
+            start_date, end_date, airport_codes, WEATHER_COLUMNS, path_to_db))
+
+    query, params = get_weather_query(start_date, end_date, airport_codes)
+    engine = helpers.get_engine(path_to_db)
     with engine.connect() as conn:
-        weather = pd.read_sql(
-            """
-            SELECT
-                a.airport,
-                w.date,
-                w.hourly_visibility,
-                w.hourly_dry_bulb_temp_f,
-                w.hourly_precipitation,
-                w.hourly_wind_speed,
-                w.hourly_wind_gust_speed,
-                w.hourly_station_pressure
-            FROM
-                weather AS w
-            JOIN
-                airports as a
-            ON a.int_latitude = w.int_latitude
-            AND a.int_longitude = w.int_longitude
-            WHERE
-                a.airport = :airport_code
-            AND
-                a.airport_is_latest == 1
-            AND
-                w.date
-            BETWEEN :start_date
-                AND :end_date
-            """,
-            conn,
-            params={
-                'start_date': start_date,
-                'end_date': end_date,
-                'airport_code': airport_code
-            })
+        weather = select_nearest_stations(
+            pd.read_sql(query, conn, params=params))
+    weather['measurement_hour'] = \
+        helpers.to_datetimes(weather['measurement_hour'])
     return weather
 
 
 def build_weather_features(weather):
-    """ Conduct transformations to build weather feature-set """
-    weather['date'] = weather['date'].apply(helpers.extract_datetime)
-    weather['measurement_hour'] = weather['date'].apply(helpers.round_to_hour)
-    weather = weather.drop('date', axis=1)
+    """ Conduct transformations to build weather feature-set
+
+        Weather is stored one row per station and hour at ingest, so no
+        rounding is needed here.
+    """
+    weather['measurement_hour'] = \
+        helpers.to_datetimes(weather['measurement_hour'])
     return weather
 
 
 def get_weather_features(start_date=None, end_date=None,
-                         airport_code=None, path_to_db=None):
+                         airport_code=None, path_to_db=None, backend=None):
     """ Retrieve weather data and build weather features """
-    weather = get_weather_data(start_date, end_date, airport_code, path_to_db)
+    weather = get_weather_data(start_date, end_date, airport_code, path_to_db,
+                               backend)
     return build_weather_features(weather)
 
 
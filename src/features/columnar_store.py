@@ -0,0 +1,92 @@
+""" Read features from the partitioned parquet store
+"""
+import os
+import pandas as pd
+import feature_helpers as helpers
+
+
+def import_dataset():
+    """ Import pyarrow.dataset, which is only required for this backend """
+    try:
+        import pyarrow.dataset as dataset
+    except ImportError:
+        raise ImportError('The parquet feature backend requires pyarrow, '
+                          'install it with `pip install pyarrow`')
+    return dataset
+
+
+def month_filter(dataset, start_date, end_date):
+    """ Return a partition filter selecting every month in a date range """
+    months = pd.period_range(start_date, end_date, freq='M')
+    expression = None
+    for m in months:
+        month = ((dataset.field('year') == m.year)
+                 & (dataset.field('month') == m.month))
+        expression = month if expression is None else expression | month
+    return expression
+
+
+def date_range_filter(dataset, column, start_date, end_date):
+    """ Return a row filter for a date range
+
+        The range is half open, matching sqlite's BETWEEN on the stored
+        timestamp text, which excludes anything on the end date itself.
+    """
+    return ((dataset.field(column) >= pd.Timestamp(start_date))
+            & (dataset.field(column) < pd.Timestamp(end_date)))
+
+
+def read_departing_flights(start_date, end_date, airport_codes, columns,
+                           path_to_db):
+    """ Read selected flight columns, pruned to origins and months
+
+        airport_codes of None reads departures from every airport.
+    """
+    dataset = import_dataset()
+    root = os.path.join(helpers.get_columnar_store_path(path_to_db),
+                        'flights')
+    flights = dataset.dataset(root, format='parquet', partitioning='hive')
+    expression = (month_filter(dataset, start_date, end_date)
+                  & date_range_filter(dataset, 'flight_date',
+                                      start_date, end_date))
+    if airport_codes is not None:
+        expression &= dataset.field('origin').isin(airport_codes)
+    return flights.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def read_airport_stations(airport_codes, path_to_db):
+    """ Return the weather stations matched to airports
+
+        airport_codes of None returns stations for every airport.
+    """
+    dataset = import_dataset()
+    path = os.path.join(helpers.get_columnar_store_path(path_to_db),
+                        'airport_weather_stations.parquet')
+    stations = dataset.dataset(path, format='parquet')
+    expression = None
+    if airport_codes is not None:
+        expression = dataset.field('airport').isin(airport_codes)
+    return stations.to_table(columns=['airport', 'station', 'station_rank'],
+                             filter=expression).to_pandas()
+
+
+def read_weather(start_date, end_date, airport_codes, columns, path_to_db):
+    """ Read selected hourly weather columns at airports, pruned to
+        stations and years
+    """
+    dataset = import_dataset()
+    root = os.path.join(helpers.get_columnar_store_path(path_to_db),
+                        'hourly_weather')
+    weather = dataset.dataset(root, format='parquet', partitioning='hive')
+    stations = read_airport_stations(airport_codes, path_to_db)
+
+    years = list(range(start_date.year, end_date.year + 1))
+    expression = (dataset.field('station').isin(stations['station'].unique())
+                  & dataset.field('year').isin(years)
+                  & date_range_filter(dataset, 'measurement_hour', start_date,
+                                      end_date))
+    data = weather.to_table(columns=columns + ['station'],
+                            filter=expression).to_pandas()
+
+    data = pd.merge(stations, data, on='station')
+    return data[['airport', 'station_rank'] + columns]
@@ -0,0 +1,113 @@
+""" Export prepared features as memory-mapped NumPy arrays
+"""
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import feature_helpers as helpers
+
+LABEL_COLUMN = 'departure_was_delayed_15'
+
+# categorical columns, stored as integer codes into a list of categories
+CATEGORICAL_COLUMNS = ['origin', 'dest', 'carrier', 'airport']
+
+
+def get_feature_array_path(path_to_db):
+    """ Return the array directory, under data/processed next to sqlite """
+    return os.path.join(
+        os.path.dirname(helpers.get_database_file(path_to_db)),
+        'feature_arrays')
+
+
+def get_numeric_columns(features):
+    """ Return the columns stored in the numeric matrix, in order """
+    excluded = CATEGORICAL_COLUMNS + [LABEL_COLUMN, 'index']
+    return [c for c in features.columns if c not in excluded]
+
+
+def to_numeric_matrix(features, columns):
+    """ Return columns as one float64 matrix, datetimes as epoch minutes """
+    numeric = np.empty((len(features), len(columns)), dtype=np.float64)
+    for i, column in enumerate(columns):
+        values = features[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            minutes = (values - pd.Timestamp(1970, 1, 1)) \
+                // pd.Timedelta(minutes=1)
+            values = minutes.astype('float64')
+        numeric[:, i] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return numeric
+
+
+def write_feature_arrays(features, path, merge='exact'):
+    """ Write a feature set as .npy arrays with a metadata sidecar
+
+        numeric.npy holds every numeric and datetime column as float64,
+        categorical.npy the codes of the categorical columns as int32, with
+        -1 for missing values, and label.npy the delay label. The metadata
+        records the weather merge the features were built with. The arrays
+        are written next to the target and swapped in once complete, and
+        the features are recorded as an input of the running stage.
+    """
+    numeric_columns = get_numeric_columns(features)
+    categorical_columns = [c for c in CATEGORICAL_COLUMNS if c in features]
+    categories = {}
+    codes = np.empty((len(features), len(categorical_columns)),
+                     dtype=np.int32)
+    for i, column in enumerate(categorical_columns):
+        values = features[column].astype('category')
+        categories[column] = values.cat.categories.tolist()
+        codes[:, i] = values.cat.codes
+    datetime_columns = [
+        c for c in numeric_columns
+        if pd.api.types.is_datetime64_any_dtype(features[c])]
+
+    staging = path + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    np.save(os.path.join(staging, 'numeric.npy'),
+            to_numeric_matrix(features, numeric_columns))
+    np.save(os.path.join(staging, 'categorical.npy'), codes)
+    np.save(os.path.join(staging, 'label.npy'),
+            features[LABEL_COLUMN].to_numpy(dtype=np.int8))
+    with open(os.path.join(staging, 'metadata.json'), 'w') as f:
+        json.dump({
+            'rows': len(features),
+            'label': LABEL_COLUMN,
+            'merge': merge,
+            'numeric_columns': numeric_columns,
+            'datetime_columns': datetime_columns,
+            'categorical_columns': categorical_columns,
+            'categories': categories
+        }, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    helpers.record_input('features', len(features), len(features),
+                         helpers.get_frame_bytes(features))
+
+
+def read_feature_metadata(path):
+    """ Return the metadata sidecar of exported feature arrays """
+    with open(os.path.join(path, 'metadata.json')) as f:
+        return json.load(f)
+
+
+def open_feature_arrays(path):
+    """ Memory-map exported feature arrays without reading them
+
+        Returns the numeric matrix, categorical codes, label vector and
+        metadata.
+    """
+    def load(name):
+        return np.load(os.path.join(path, name), mmap_mode='r')
+
+    return (load('numeric.npy'), load('categorical.npy'), load('label.npy'),
+            read_feature_metadata(path))
+
+
+def select_numeric_columns(numeric, metadata, columns):
+    """ Return selected columns of the numeric matrix, in the given order
+    """
+    positions = [metadata['numeric_columns'].index(c) for c in columns]
+    return numeric[:, positions]
@@ -0,0 +1,183 @@
+""" Persistent on-disk cache of generated feature sets
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import pandas as pd
+import feature_helpers as helpers
+
+# modules whose source determines the content of generated features
+FEATURE_MODULES = [
+    'build_features.py',
+    'build_flight_features.py',
+    'build_weather_features.py',
+    'columnar_store.py',
+    'feature_helpers.py'
+]
+
+# tables whose contents the generated features depend on
+VERSION_QUERIES = {
+    'ingest_manifest': """
+        SELECT table_name, path, content_hash
+        FROM ingest_manifest
+        ORDER BY table_name, path
+        """,
+    'airport_weather_stations': """
+        SELECT airport, station, station_rank, distance_km
+        FROM airport_weather_stations
+        ORDER BY airport, station_rank
+        """
+}
+
+
+def get_cache_path(path_to_db):
+    """ Return the cache directory, under data/interim next to processed """
+    data_dir = os.path.dirname(os.path.dirname(
+        helpers.get_database_file(path_to_db)))
+    return os.path.join(data_dir, 'interim', 'feature_cache')
+
+
+def get_cache_size_limit():
+    """ Return the cache size cap in bytes, from FEATURE_CACHE_MB """
+    return int(os.environ.get('FEATURE_CACHE_MB', 1024)) * 1024 ** 2
+
+
+def get_code_version():
+    """ Return a hash of the source of the feature building modules """
+    digest = hashlib.sha1()
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in FEATURE_MODULES:
+        with open(os.path.join(module_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def get_data_version(path_to_db):
+    """ Return a hash of the ingest manifest and the station mapping, which
+        change with the data
+
+        The mapping of airports to weather stations is rebuilt at ingest,
+        possibly with other settings, without a change to the manifest.
+        Databases loaded before the manifest existed fall back to the
+        modification time of the database file.
+    """
+    engine = helpers.get_engine(path_to_db)
+    contents = []
+    with engine.connect() as conn:
+        has_manifest = engine.dialect.has_table(conn, 'ingest_manifest')
+        for table, query in VERSION_QUERIES.items():
+            if engine.dialect.has_table(conn, table):
+                contents.append(pd.read_sql(query, conn).to_csv(index=False))
+    if not has_manifest:
+        contents.append(
+            str(os.path.getmtime(helpers.get_database_file(path_to_db))))
+    return hashlib.sha1('\n'.join(contents).encode()).hexdigest()
+
+
+def get_cache_key(start_date, end_date, airport_code, hour_shift,
+                  merge='exact', tolerance=None, backend=None):
+    """ Return a hash identifying a feature request, the storage it is
+        read from and the code version
+    """
+    airport_codes = helpers.get_airport_codes(airport_code)
+    request = {
+        'airports': 'all' if airport_codes is None else sorted(airport_codes),
+        'start_date': str(start_date),
+        'end_date': str(end_date),
+        'hour_shift': hour_shift,
+        'merge': merge,
+        'tolerance': str(tolerance) if merge == 'asof' else None,
+        'backend': helpers.get_feature_backend(backend),
+        'code_version': get_code_version()
+    }
+    return hashlib.sha1(json.dumps(request).encode()).hexdigest()
+
+
+def get_entry_path(cache_path, data_version, key):
+    """ Entries are prefixed by data version so stale ones can be found """
+    return os.path.join(cache_path, f'{data_version[:16]}-{key}.parquet')
+
+
+def load_features(path_to_db, key):
+    """ Return cached features for a key, or None on a miss
+
+        A hit is recorded as an input of the running stage.
+    """
+    cache_path = get_cache_path(path_to_db)
+    entry = get_entry_path(cache_path, get_data_version(path_to_db), key)
+    if not os.path.exists(entry):
+        return None
+    # mark the entry as recently used for LRU eviction
+    os.utime(entry)
+    features = pd.read_parquet(entry)
+    helpers.record_input(entry, len(features), len(features),
+                         os.path.getsize(entry))
+    return features
+
+
+def store_features(features, path_to_db, key):
+    """ Store features under a key, then evict stale and old entries """
+    logger = logging.getLogger(__name__)
+    cache_path = get_cache_path(path_to_db)
+    data_version = get_data_version(path_to_db)
+    os.makedirs(cache_path, exist_ok=True)
+
+    remove_stale_entries(cache_path, data_version)
+    write_entry(features, get_entry_path(cache_path, data_version, key))
+    evicted = evict_entries(cache_path, get_cache_size_limit())
+    if evicted:
+        logger.info(f'Evicted {evicted} feature cache entries')
+
+
+def write_entry(features, entry):
+    """ Write an entry in full, then move it into place
+
+        Readers and other writers never see a partly written entry, and an
+        interrupted write leaves only a temporary file that is not loaded.
+    """
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(entry), prefix='.', suffix='.tmp')
+    os.close(descriptor)
+    try:
+        features.to_parquet(temporary)
+        os.replace(temporary, entry)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def remove_stale_entries(cache_path, data_version):
+    """ Delete entries generated from a previous version of the data """
+    for entry in glob.glob(os.path.join(cache_path, '*.parquet')):
+        if not os.path.basename(entry).startswith(data_version[:16]):
+            os.remove(entry)
+
+
+def evict_entries(cache_path, size_limit):
+    """ Delete least recently used entries until the cache fits the limit """
+    entries = sorted(glob.glob(os.path.join(cache_path, '*.parquet')),
+                     key=os.path.getmtime)
+    total = sum(os.path.getsize(e) for e in entries)
+    evicted = 0
+    # always keep the most recent entry, even if it exceeds the limit
+    for entry in entries[:-1]:
+        if total <= size_limit:
+            break
+        total -= os.path.getsize(entry)
+        os.remove(entry)
+        evicted += 1
+    return evicted
+
+
+def is_cache_enabled():
+    """ The cache is on unless FEATURE_CACHE=0, and requires pyarrow """
+    if os.environ.get('FEATURE_CACHE', '1') == '0':
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
@@ -1,21 +1,79 @@
 """ Shared Helpers methods for features namespace
 """
 import os
+import sys
 import numpy as np
 import pandas as pd
 from datetime import timedelta
 
+# engines, memory sampling and run reports are shared with the data scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'shared'))
+from pipeline_helpers import (  # noqa: E402,F401
+    find, get_database_connection_string, get_engine, get_database_file,
+    get_columnar_store_path, to_epoch_minutes, get_rss, run_with_peak_rss,
+    run_stage, get_run_report_dir, write_run_report, get_frame_bytes,
+    get_bytes_read, count_bytes_read, record_input, collect_inputs)
 
-def find(name, path):
-    """ Walks selected path to find a given file"""
-    for root, dirs, files in os.walk(path):
-        if name in files:
-            return os.path.join(root, name)
 
+def get_feature_backend(backend=None):
+    """ Returns the storage backend feature builders read from
 
-def get_database_connection_string():
-    """Returns the sqlite connection string"""
-    return "sqlite:///" + find('airlines.db', '.')
+        Defaults to the FEATURE_BACKEND environment variable, else sqlite.
+    """
+    if backend is None:
+        backend = os.environ.get('FEATURE_BACKEND', 'sqlite')
+    if backend not in ['sqlite', 'parquet']:
+        raise ValueError(f'Unknown feature backend: {backend}')
+    return backend
+
+
+def get_airport_codes(airport_code):
+    """ Return a list of airport codes, or None when 'all' are selected
+
+        No airport_code selects MDT, as in the flight and weather builders.
+    """
+    if airport_code is None:
+        return ['MDT']
+    if isinstance(airport_code, str):
+        if airport_code.lower() == 'all':
+            return None
+        return [airport_code]
+    return list(airport_code)
+
+
+def get_airport_filter(column, airport_codes):
+    """ Return a SQL condition and its params selecting airport codes """
+    if airport_codes is None:
+        return '1 = 1', {}
+    params = {f'airport_{i}': code for i, code in enumerate(airport_codes)}
+    placeholders = ', '.join(':' + name for name in params)
+    return f'{column} IN ({placeholders})', params
+
+
+def get_query_plan(query, params, path_to_db):
+    """Return the detail lines of sqlite's EXPLAIN QUERY PLAN for a query"""
+    engine = get_engine(path_to_db)
+    with engine.connect() as conn:
+        plan = pd.read_sql('EXPLAIN QUERY PLAN ' + query, conn,
+                           params=params)
+    return list(plan['detail'])
+
+
+def get_date_range_params(start_date, end_date):
+    """ Return params for a stored timestamp column between two dates
+
+        Queries compare column >= :start_date AND column < :end_date.
+    """
+    return {'start_date': to_epoch_minutes(start_date),
+            'end_date': to_epoch_minutes(end_date)}
+
+
+def to_datetimes(column):
+    """Convert a whole column of stored timestamps to datetimes"""
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    return pd.to_datetime(column, unit='m')
 
 
 def extract_datetime(dt_string):
@@ -1,41 +1,88 @@
 """ Get a number of prepared records for analysis, store in local db
 """
 import build_features as build_features
-from feature_helpers import get_database_connection_string
-from datetime import date
+import feature_arrays
+from feature_helpers import get_database_connection_string, get_engine
+from feature_helpers import run_stage, write_run_report
+from feature_helpers import (count_bytes_read, get_bytes_read,
+                             get_frame_bytes, record_input)
+from datetime import date, datetime
 from pandas.io import sql
-from sqlalchemy import create_engine
 import logging
-import sys
+import os
+
 
 def drop_feature_table(path_to_db, table):
-    engine = create_engine(path_to_db)
-    sql.execute('DROP TABLE IF EXISTS %s'%table, engine)
+    """ Drop a feature table and reclaim its space, recording the rows
+        dropped as an input of the stage
+    """
+    engine = get_engine(path_to_db, read_only=False)
+    started, rows = get_bytes_read(), 0
+    if sql.has_table(table, engine):
+        rows = int(sql.read_sql(f'SELECT COUNT(*) AS count FROM "{table}"',
+                                engine)['count'][0])
+    sql.execute('DROP TABLE IF EXISTS %s' % table, engine)
     sql.execute('VACUUM', engine)
+    record_input(table, rows, 0, count_bytes_read(started))
 
-def main():
-    """ Build featureset for departing flights, print to console"""
+
+def store_features(features, path_to_db, table, chunksize=10000):
+    """ Write features to the database in a single transaction """
+    with get_engine(path_to_db, read_only=False).begin() as connection:
+        features.to_sql(table, connection, if_exists='append',
+                        chunksize=chunksize)
+    record_input('features', len(features), len(features),
+                 get_frame_bytes(features))
+
+
+def make_prepared_features(path_to_db, airport_code, start_date, end_date,
+                           workers=1, merge='exact'):
+    """ Build and store the feature set, and export it as arrays """
     logger = logging.getLogger(__name__)
 
+    # wall and cpu time, inputs and peak memory of each stage
+    stages = []
+    started_at = datetime.now()
+    run_stage(stages, 'drop_features', drop_feature_table, path_to_db,
+              'features')
+
+    logger.info(f'Generating Feature Set For {airport_code}')
+    features = run_stage(
+        stages, 'build_features',
+        build_features.get_features_for_delay_classification,
+        start_date=start_date,
+        end_date=end_date,
+        airport_code=airport_code,
+        path_to_db=path_to_db,
+        workers=workers,
+        merge=merge
+    )
+    logger.info(f'Storing {len(features)} Generated Features')
+    run_stage(stages, 'store_features', store_features, features, path_to_db,
+              'features')
+    array_path = feature_arrays.get_feature_array_path(path_to_db)
+    logger.info(f'Exporting Feature Arrays to {array_path}')
+    run_stage(stages, 'feature_arrays', feature_arrays.write_feature_arrays,
+              features, array_path, merge)
+    logger.info('Feature Generation Complete')
+
+    report = write_run_report('make_prepared_features', stages, started_at)
+    logger.info(f'run report written to {report}')
+
+
+def main():
+    """ Build featureset for departing flights, print to console"""
     start_date = date(2017, 1, 1)
     end_date = date(2017, 12, 31)
-    path_to_db = get_database_connection_string()
-    drop_feature_table(path_to_db, 'features')
-
-    for airport_code in ['MDT', 'ATL', 'LAX']:
-        logger.info(f'Generating Feature Set For {airport_code}')
-        features = build_features.get_features_for_delay_classification(
-            start_date=start_date, 
-            end_date=end_date,
-            airport_code=airport_code, 
-            path_to_db=path_to_db
-        )
-        logger.info(f'Storing Generated Features For {airport_code}')
-        with create_engine(path_to_db).connect() as connection:
-            features.to_sql('features', connection,if_exists='append')
-        logger.info(f'Storage Complete For {airport_code}')
+    # comma separated airport codes, or 'all' for every departing airport
+    airports = os.environ.get('FEATURE_AIRPORTS', 'MDT,ATL,LAX')
+    airport_code = airports if airports == 'all' else airports.split(',')
+    workers = int(os.environ.get('FEATURE_WORKERS', 1))
+    # 'exact' or 'asof' matching of departures to weather observations
+    merge = os.environ.get('FEATURE_MERGE', 'exact')
+    make_prepared_features(get_database_connection_string(), airport_code,
+                           start_date, end_date, workers, merge)
 
-    logger.info('Feature Generation Complete')
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -0,0 +1,261 @@
+""" Score scheduled departures with a trained delay classifier
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+from functools import lru_cache
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# the feature modules import their siblings by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'features'))
+import build_features  # noqa: E402
+import build_flight_features as flight_builder  # noqa: E402
+import build_weather_features as weather_builder  # noqa: E402
+from feature_helpers import get_database_connection_string  # noqa: E402
+from feature_helpers import to_epoch_minutes  # noqa: E402
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, os.pardir)
+
+DEFAULT_MODEL_PATH = os.path.join(PROJECT_DIR, 'models',
+                                  'delay_classifier.joblib')
+
+# feature columns the classifier is fitted on, in order, matching the
+# modeling notebook without carrier, airport and distance
+MODEL_COLUMNS = [
+    'departure_month',
+    'departure_date',
+    'departure_hod',
+    'elapsed_time_scheduled',
+    'hourly_visibility',
+    'hourly_dry_bulb_temp_f',
+    'hourly_precipitation',
+    'hourly_wind_speed',
+    'hourly_wind_gust_speed',
+    'hourly_station_pressure'
+]
+
+WEATHER_COLUMNS = MODEL_COLUMNS[4:]
+
+WeatherLookup = namedtuple('WeatherLookup', ['rows', 'values', 'hour_shift'])
+
+
+def save_model(model, path=DEFAULT_MODEL_PATH, columns=None, hour_shift=3,
+               merge='exact'):
+    """ Serialize a fitted model with the columns, weather shift and
+        weather merge it was trained on
+    """
+    import joblib
+
+    if columns is None:
+        columns = MODEL_COLUMNS
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump({'model': model, 'columns': list(columns),
+                 'hour_shift': hour_shift, 'merge': merge}, path)
+
+
+@lru_cache(maxsize=None)
+def load_model(path=DEFAULT_MODEL_PATH):
+    """ Load a serialized model once per process """
+    import joblib
+
+    bundle = joblib.load(path)
+    if not hasattr(bundle['model'], 'predict'):
+        raise ValueError(f'{path} does not contain a fitted model')
+    return bundle
+
+
+def prepare_model_inputs(features, columns):
+    """ Return the model columns of a feature set as one float array """
+    return np.ascontiguousarray(features[columns].to_numpy(dtype=np.float64))
+
+
+def score_inputs(model, inputs):
+    """ Return predicted classes and, if available, delay probabilities
+
+        Classes are taken from the probabilities, so the model is only
+        evaluated once.
+    """
+    if not hasattr(model, 'predict_proba'):
+        return model.predict(inputs), None
+    probability = model.predict_proba(inputs)
+    return model.classes_[probability.argmax(axis=1)], probability[:, 1]
+
+
+def get_departure_features(day, path_to_db=None, hour_shift=3,
+                           airport_code='all', merge='exact'):
+    """ Return every departure of a day and the features of those matched
+        to weather
+
+        Weather starts hour_shift hours before the day, so departures
+        shortly after midnight are matched as well, with the same merge as
+        the training features. The feature cache is
+        skipped, a day is quick to build and must reflect the latest data.
+        flight_row relates each feature row to its departure.
+    """
+    end_date = day + timedelta(days=1)
+    flights = flight_builder.build_features_for_departing_flights(
+        day, end_date, airport_code, path_to_db).reset_index(drop=True)
+    flights['flight_row'] = np.arange(len(flights))
+    weather = weather_builder.get_weather_features(
+        build_features.get_weather_start(day, hour_shift), end_date,
+        airport_code, path_to_db)
+    features = build_features.merge_departure_weather_data(
+        weather, flights, hour_shift, merge)
+    return flights, features
+
+
+def predict_departures(day, path_to_db=None, bundle=None,
+                       airport_code='all'):
+    """ Score every scheduled departure of a day in one batch
+
+        Departures are matched to the shifted weather with the merge the
+        model was trained on, bundles without one were trained on the
+        exact merge. Departures without weather are kept with no prediction
+        and counted in the log.
+    """
+    logger = logging.getLogger(__name__)
+    if bundle is None:
+        bundle = load_model()
+    flights, features = get_departure_features(
+        day, path_to_db, bundle['hour_shift'], airport_code,
+        bundle.get('merge', 'exact'))
+
+    scores = flights[['origin', 'dest', 'carrier', 'departure_time']].copy()
+    scores['predicted_delay'] = np.nan
+    if not features.empty:
+        predicted, probability = score_inputs(
+            bundle['model'],
+            prepare_model_inputs(features, bundle['columns']))
+        rows = features['flight_row'].to_numpy()
+        scores.loc[rows, 'predicted_delay'] = predicted
+        if probability is not None:
+            scores['delay_probability'] = np.nan
+            scores.loc[rows, 'delay_probability'] = probability
+
+    unscored = len(scores) - len(features)
+    if unscored:
+        logger.warning(f'{unscored} of {len(scores)} departures on {day} '
+                       f'have no weather and were not scored')
+    return scores
+
+
+def build_weather_lookup(start_date, end_date, path_to_db=None,
+                         hour_shift=3, airport_code='all'):
+    """ Load weather for a date range into an in-memory lookup
+
+        Rows are keyed by airport and epoch minute of the measurement hour.
+        Hours from the day before start_date up to end_date are loaded, so
+        departures from start_date until hour_shift hours into end_date
+        can be scored. Airports matched to several stations keep their
+        nearest one.
+    """
+    weather = weather_builder.get_weather_features(
+        start_date - timedelta(days=1), end_date, airport_code, path_to_db)
+    weather = weather.drop_duplicates(['airport', 'measurement_hour'])
+    hours = (weather['measurement_hour'] - pd.Timestamp(1970, 1, 1)) \
+        // pd.Timedelta(minutes=1)
+    rows = {key: i for i, key in
+            enumerate(zip(weather['airport'].tolist(), hours.tolist()))}
+    values = np.ascontiguousarray(
+        weather[WEATHER_COLUMNS].to_numpy(dtype=np.float64))
+    return WeatherLookup(rows, values, hour_shift)
+
+
+def get_flight_inputs(bundle, lookup, origin, departure_time,
+                      elapsed_time_scheduled):
+    """ Return the model input row of a single departure
+
+        Raises KeyError if no weather is known at the origin for the
+        shifted departure hour, or if the model was trained on the exact
+        merge and the departure is not on the hour.
+    """
+    if lookup.hour_shift != bundle['hour_shift']:
+        raise ValueError('Weather lookup and model use different shifts')
+    if bundle.get('merge', 'exact') == 'exact' and \
+            (departure_time.minute or departure_time.second):
+        raise KeyError((origin, departure_time))
+    hour = departure_time.replace(minute=0, second=0, microsecond=0) \
+        - timedelta(hours=lookup.hour_shift)
+    weather = lookup.values[lookup.rows[(origin, to_epoch_minutes(hour))]]
+    flight = {
+        'departure_month': departure_time.month,
+        'departure_date': departure_time.day,
+        'departure_hod': departure_time.hour,
+        'elapsed_time_scheduled': elapsed_time_scheduled
+    }
+    flight.update(zip(WEATHER_COLUMNS, weather))
+    return np.array([[flight[c] for c in bundle['columns']]],
+                    dtype=np.float64)
+
+
+def predict_flight(bundle, lookup, origin, departure_time,
+                   elapsed_time_scheduled):
+    """ Score a single departure without touching the database
+
+        Returns the predicted class and delay probability, or None for the
+        probability if the model does not provide one.
+    """
+    predicted, probability = score_inputs(
+        bundle['model'],
+        get_flight_inputs(bundle, lookup, origin, departure_time,
+                          elapsed_time_scheduled))
+    if probability is None:
+        return predicted[0], None
+    return predicted[0], probability[0]
+
+
+def benchmark_predictions(day, path_to_db=None, bundle=None, repeat=1000):
+    """ Return single flight latency percentiles and batch throughput """
+    if bundle is None:
+        bundle = load_model()
+
+    started = time.perf_counter()
+    scores = predict_departures(day, path_to_db, bundle)
+    batch_seconds = time.perf_counter() - started
+
+    lookup = build_weather_lookup(day, day + timedelta(days=1), path_to_db,
+                                  bundle['hour_shift'])
+    flights = scores.dropna(subset=['predicted_delay']).sample(
+        repeat, replace=True, random_state=0)
+    latencies = []
+    for origin, departure_time in zip(flights['origin'],
+                                      flights['departure_time']):
+        started = time.perf_counter()
+        predict_flight(bundle, lookup, origin,
+                       departure_time.to_pydatetime(), 120)
+        latencies.append(time.perf_counter() - started)
+
+    return {
+        'batch_rows': len(scores),
+        'batch_seconds': batch_seconds,
+        'batch_rows_per_second': len(scores) / batch_seconds,
+        'single_p50_ms': np.percentile(latencies, 50) * 1000,
+        'single_p99_ms': np.percentile(latencies, 99) * 1000
+    }
+
+
+def main():
+    """ Score a day of departures and report prediction latency """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    logger = logging.getLogger(__name__)
+
+    day = date(2017, 1, 2)
+    path_to_db = get_database_connection_string()
+    results = benchmark_predictions(day, path_to_db)
+    for name, value in results.items():
+        logger.info(f'{name}: {value:.3f}')
+
+    scores = predict_departures(day, path_to_db)
+    print(scores.head())
+    print(scores['predicted_delay'].value_counts())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,406 @@
+""" Search classifier hyperparameters on the prepared feature set
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# the feature modules import their siblings by bare name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'features'))
+import feature_arrays  # noqa: E402
+from feature_helpers import (get_database_connection_string,  # noqa: E402
+                             get_database_file, get_engine)
+import predict_model  # noqa: E402
+
+LABEL_COLUMN = feature_arrays.LABEL_COLUMN
+
+RANDOM_STATE = 12
+
+# estimators are fitted single threaded, parallelism comes from the pool
+SEARCH_SPACES = {
+    'dummy': {
+        'select__k': ['all'],
+        'classify__strategy': ['stratified'],
+        'classify__random_state': [RANDOM_STATE]
+    },
+    'knn': {
+        'select__k': [2, 4, 'all'],
+        'classify__weights': ['uniform', 'distance'],
+        'classify__n_neighbors': [3, 4, 5]
+    },
+    'svc': {
+        'select__k': [4, 'all'],
+        'classify__class_weight': ['balanced'],
+        'classify__kernel': ['linear', 'rbf'],
+        'classify__gamma': ['auto'],
+        'classify__C': [0.1, 1.0]
+    },
+    'random_forest': {
+        'select__k': [4, 'all'],
+        'classify__class_weight': ['balanced', None],
+        'classify__n_estimators': [50],
+        'classify__max_features': ['sqrt'],
+        'classify__max_depth': [10],
+        'classify__random_state': [RANDOM_STATE]
+    },
+    'kernel_approximation': {
+        'approximate__gamma': [0.1, 1, 10],
+        'approximate__n_components': [100],
+        'approximate__random_state': [RANDOM_STATE],
+        'classify__max_iter': [5],
+        'classify__class_weight': ['balanced'],
+        'classify__random_state': [RANDOM_STATE]
+    }
+}
+
+
+def get_pipeline(model):
+    """ Return the modeling pipeline for a named search space """
+    from sklearn.dummy import DummyClassifier
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.feature_selection import SelectKBest
+    from sklearn.kernel_approximation import RBFSampler
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    approximate, classify = {
+        'dummy': (None, DummyClassifier()),
+        'knn': (None, KNeighborsClassifier()),
+        'svc': (None, SVC()),
+        'random_forest': (None, RandomForestClassifier()),
+        'kernel_approximation': (RBFSampler(), SGDClassifier())
+    }[model]
+    return Pipeline([
+        ('scale', StandardScaler()),
+        ('select', SelectKBest()),
+        ('approximate', approximate),
+        ('classify', classify)
+    ])
+
+
+def get_search_path(path_to_db):
+    """ Return the directory of training arrays and search results, under
+        data/interim next to processed
+    """
+    data_dir = os.path.dirname(os.path.dirname(get_database_file(path_to_db)))
+    return os.path.join(data_dir, 'interim', 'model_search')
+
+
+def read_table_inputs(path_to_db, table='features'):
+    """ Return model inputs and labels of feature table rows without
+        missing inputs
+    """
+    engine = get_engine(path_to_db)
+    columns = ', '.join(f'"{c}"'
+                        for c in predict_model.MODEL_COLUMNS + [LABEL_COLUMN])
+    with engine.connect() as conn:
+        features = pd.read_sql(f'SELECT {columns} FROM "{table}"', conn)
+    features = features.dropna()
+    X = predict_model.prepare_model_inputs(features,
+                                           predict_model.MODEL_COLUMNS)
+    return X, features[LABEL_COLUMN].to_numpy(dtype=np.int8)
+
+
+def find_complete_rows(X, columns):
+    """ Return the indices of rows with every selected column present
+
+        Columns are checked one at a time, so a memory-mapped matrix is
+        never copied whole.
+    """
+    complete = np.ones(len(X), dtype=bool)
+    for column in columns:
+        complete &= ~np.isnan(X[:, column])
+    return np.flatnonzero(complete)
+
+
+def read_training_merge(path_to_db):
+    """ Return the weather merge the feature arrays were built with
+
+        Features read from the table, or arrays exported before the merge
+        was recorded, were built with the default exact merge.
+    """
+    array_path = feature_arrays.get_feature_array_path(path_to_db)
+    if not os.path.exists(os.path.join(array_path, 'metadata.json')):
+        return 'exact'
+    return feature_arrays.read_feature_metadata(array_path).get(
+        'merge', 'exact')
+
+
+def export_training_data(path_to_db, search_path, table='features'):
+    """ Write the training rows and the location of their inputs for the
+        search workers
+
+        Feature arrays written by make_prepared_features are used in
+        place, only the indices of rows without missing inputs are saved.
+        Without them the feature table is read and its complete rows are
+        saved as .npy arrays. Everything goes to a directory named by the
+        hash of the inputs, which also holds the results of searches run
+        on them. Returns that directory.
+    """
+    logger = logging.getLogger(__name__)
+    array_path = feature_arrays.get_feature_array_path(path_to_db)
+    if os.path.exists(os.path.join(array_path, 'metadata.json')):
+        X, _, y, metadata = feature_arrays.open_feature_arrays(array_path)
+        columns = [metadata['numeric_columns'].index(c)
+                   for c in predict_model.MODEL_COLUMNS]
+        rows = find_complete_rows(X, columns)
+        arrays = None
+    else:
+        X, y = read_table_inputs(path_to_db, table)
+        columns = list(range(X.shape[1]))
+        rows = np.arange(len(y))
+        arrays = X, y
+    digest = hashlib.sha1(json.dumps(columns).encode())
+    for values in [rows, X, y]:
+        digest.update(memoryview(np.ascontiguousarray(values)).cast('B'))
+
+    data_path = os.path.join(search_path, digest.hexdigest()[:16])
+    if os.path.exists(os.path.join(data_path, 'rows.npy')):
+        return data_path
+    logger.info(f'Exporting {len(rows)} training rows to {data_path}')
+    os.makedirs(data_path, exist_ok=True)
+    if arrays is None:
+        inputs = [os.path.join(array_path, 'numeric.npy'),
+                  os.path.join(array_path, 'label.npy')]
+    else:
+        inputs = [os.path.join(data_path, 'X.npy'),
+                  os.path.join(data_path, 'y.npy')]
+        for path, values in zip(inputs, arrays):
+            np.save(path, values)
+    with open(os.path.join(data_path, 'inputs.json'), 'w') as f:
+        json.dump({'X': os.path.relpath(inputs[0], data_path),
+                   'y': os.path.relpath(inputs[1], data_path),
+                   'columns': columns}, f, indent=2)
+    # written last, marks the export as complete
+    np.save(os.path.join(data_path, 'rows.npy'), rows)
+    return data_path
+
+
+@lru_cache(maxsize=None)
+def open_training_data(data_path, test_size=0.33):
+    """ Memory-map the training inputs and split off the holdout rows
+
+        Cached, so each worker opens the arrays once. Returns the inputs,
+        labels, the positions of the model columns and the indices of the
+        training and holdout rows.
+    """
+    from sklearn.model_selection import train_test_split
+
+    with open(os.path.join(data_path, 'inputs.json')) as f:
+        inputs = json.load(f)
+    X = np.load(os.path.join(data_path, inputs['X']), mmap_mode='r')
+    y = np.load(os.path.join(data_path, inputs['y']), mmap_mode='r')
+    rows = np.load(os.path.join(data_path, 'rows.npy'))
+    train, test = train_test_split(rows, test_size=test_size,
+                                   random_state=RANDOM_STATE)
+    return X, y, inputs['columns'], train, test
+
+
+def take_rows(X, columns, rows):
+    """ Return the model columns of the selected rows as one array """
+    return X[np.ix_(rows, columns)]
+
+
+@lru_cache(maxsize=None)
+def get_folds(data_path, folds):
+    """ Return the stratified cross validation splits of the training rows
+    """
+    from sklearn.model_selection import StratifiedKFold
+
+    _, y, _, train, _ = open_training_data(data_path)
+    splits = StratifiedKFold(n_splits=folds).split(train, y[train])
+    return [(train[fit], train[validate]) for fit, validate in splits]
+
+
+def get_candidates(models):
+    """ Return every (model, params) pair of the selected search spaces """
+    from sklearn.model_selection import ParameterGrid
+
+    return [(model, params) for model in models
+            for params in ParameterGrid(SEARCH_SPACES[model])]
+
+
+def get_task_key(model, params, fold):
+    """Return the checkpoint key of one fold of a candidate"""
+    return json.dumps([model, params, fold], sort_keys=True)
+
+
+def evaluate_fold(data_path, model, params, fold, folds, scoring):
+    """ Fit one candidate on one fold, return its score and timings """
+    from sklearn.metrics import get_scorer
+
+    X, y, columns, _, _ = open_training_data(data_path)
+    fit_rows, validate_rows = get_folds(data_path, folds)[fold]
+    pipeline = get_pipeline(model).set_params(**params)
+
+    started = time.perf_counter()
+    pipeline.fit(take_rows(X, columns, fit_rows), y[fit_rows])
+    fit_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    score = get_scorer(scoring)(pipeline, take_rows(X, columns, validate_rows),
+                                y[validate_rows])
+    score_seconds = time.perf_counter() - started
+    return {
+        'model': model,
+        'params': params,
+        'fold': fold,
+        'scoring': scoring,
+        'score': score,
+        'fit_seconds': fit_seconds,
+        'score_seconds': score_seconds,
+        'fit_rows': len(fit_rows),
+        'pid': os.getpid()
+    }
+
+
+def read_checkpoint(results_path):
+    """ Return finished results keyed by task, ignoring a partial last line
+    """
+    results = {}
+    if not os.path.exists(results_path):
+        return results
+    with open(results_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            key = get_task_key(record['model'], record['params'],
+                               record['fold'])
+            results[key] = record
+    return results
+
+
+def checkpointed_cleanly(results_path):
+    """Return whether the results file ends with a complete line"""
+    with open(results_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def run_search(data_path, results_path, models, folds=5,
+               scoring='precision', workers=1):
+    """ Evaluate every candidate and fold not already checkpointed
+
+        Each result is appended to the results file as soon as it finishes,
+        so an interrupted search resumes where it stopped. Returns all
+        results, finished now or before.
+    """
+    logger = logging.getLogger(__name__)
+    checkpointed = read_checkpoint(results_path)
+    results, tasks = {}, []
+    for model, params in get_candidates(models):
+        for fold in range(folds):
+            key = get_task_key(model, params, fold)
+            if key in checkpointed:
+                results[key] = checkpointed[key]
+            else:
+                tasks.append((model, params, fold))
+    logger.info(f'{len(results)} results checkpointed, '
+                f'{len(tasks)} folds to evaluate')
+
+    with open(results_path, 'a') as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        # end a line left partial by an interrupted write
+        if checkpoint.tell() and not checkpointed_cleanly(results_path):
+            checkpoint.write('\n')
+        futures = [pool.submit(evaluate_fold, data_path, model, params,
+                               fold, folds, scoring)
+                   for model, params, fold in tasks]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                checkpoint.write(json.dumps(record, sort_keys=True) + '\n')
+                checkpoint.flush()
+                results[get_task_key(record['model'], record['params'],
+                                     record['fold'])] = record
+                logger.info(f'{done}/{len(tasks)} {record["model"]} '
+                            f'fold {record["fold"]}: '
+                            f'{record["score"]:.3f} '
+                            f'in {record["fit_seconds"]:.1f}s')
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    return list(results.values())
+
+
+def summarize_results(results):
+    """ Return the mean score and total time of each candidate, best first
+    """
+    records = pd.DataFrame(results)
+    records['params'] = records['params'].map(
+        lambda p: json.dumps(p, sort_keys=True))
+    summary = records.groupby(['model', 'params']).agg(
+        mean_score=('score', 'mean'),
+        std_score=('score', 'std'),
+        folds=('fold', 'count'),
+        fit_seconds=('fit_seconds', 'sum'),
+        score_seconds=('score_seconds', 'sum'))
+    return summary.sort_values('mean_score', ascending=False).reset_index()
+
+
+def fit_best_model(data_path, summary, scoring='precision'):
+    """ Refit the best candidate on all training rows, score the holdout """
+    from sklearn.metrics import get_scorer
+
+    X, y, columns, train, test = open_training_data(data_path)
+    best = summary.iloc[0]
+    pipeline = get_pipeline(best['model']).set_params(
+        **json.loads(best['params']))
+    pipeline.fit(take_rows(X, columns, train), y[train])
+    return pipeline, get_scorer(scoring)(
+        pipeline, take_rows(X, columns, test), y[test])
+
+
+def train_model(path_to_db, models=None, folds=5, scoring='precision',
+                workers=1, model_path=predict_model.DEFAULT_MODEL_PATH):
+    """ Search the selected models, then save the best one for prediction
+    """
+    logger = logging.getLogger(__name__)
+    if models is None:
+        models = list(SEARCH_SPACES)
+    data_path = export_training_data(path_to_db, get_search_path(path_to_db))
+    results_path = os.path.join(data_path, f'{scoring}-{folds}.jsonl')
+
+    results = run_search(data_path, results_path, models, folds, scoring,
+                         workers)
+    summary = summarize_results(results)
+    summary.to_csv(results_path.replace('.jsonl', '-summary.csv'),
+                   index=False)
+    model, holdout_score = fit_best_model(data_path, summary, scoring)
+    logger.info(f'Best {summary["model"].iloc[0]} '
+                f'{summary["params"].iloc[0]}: '
+                f'{scoring} {summary["mean_score"].iloc[0]:.3f} '
+                f'cross validated, {holdout_score:.3f} on holdout')
+    predict_model.save_model(model, model_path,
+                             merge=read_training_merge(path_to_db))
+    return summary
+
+
+def main():
+    """ Run the search on the features table, print the best candidates """
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # comma separated search spaces, defaults to all of them
+    models = os.environ.get('TRAIN_MODELS')
+    if models is not None:
+        models = models.split(',')
+    workers = int(os.environ.get('TRAIN_WORKERS', 1))
+    summary = train_model(get_database_connection_string(), models,
+                          workers=workers)
+    print(summary.head(10))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,334 @@
+""" Helpers shared by the data and features scripts
+
+    Both import these through their own helpers module, so each process
+    keeps a single engine cache and every run report records its stages
+    the same way.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+import cProfile
+import datetime as datetime
+from functools import lru_cache
+import json
+import logging
+import os
+import resource
+import threading
+import time
+import pandas as pd
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+# settings of every pooled connection, readers are also set query_only
+ENGINE_PRAGMAS = {
+    'mmap_size': 268435456,
+    'cache_size': -65536
+}
+
+# engines of this process, keyed by connection string and read_only
+_engines = {}
+
+# environment variable prefixes recorded in run reports
+REPORTED_SETTINGS = ['INGEST', 'FEATURE', 'COLUMNAR', 'WEATHER', 'PIPELINE']
+
+# one input of a stage: the rows read from it, the rows of it the stage
+# kept and the bytes read, see run_stage
+InputStats = namedtuple('InputStats',
+                        ['input', 'rows_in', 'rows_out', 'bytes_read'])
+
+# inputs recorded by the stages running in this process, innermost last
+_stage_inputs = []
+
+
+def find(name, path):
+    """ Walks selected path to find a given file, skipping raw data"""
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in ['raw', '.git']]
+        if name in files:
+            return os.path.join(root, name)
+
+
+@lru_cache(maxsize=None)
+def get_database_connection_string():
+    """ Returns the sqlite connection string, resolved once per process
+
+        The standard location is tried, relative to the working directory
+        and then to the project, before searching the working directory.
+    """
+    standard = os.path.join('data', 'processed', 'airlines.db')
+    project = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, os.pardir, standard)
+    if os.path.exists(standard):
+        return "sqlite:///" + standard
+    if os.path.exists(project):
+        return "sqlite:///" + os.path.normpath(project)
+    return "sqlite:///" + find('airlines.db', '.')
+
+
+def set_connection_pragmas(read_only):
+    """Return a connect listener applying ENGINE_PRAGMAS"""
+    def on_connect(dbapi_connection, connection_record):
+        for pragma, value in ENGINE_PRAGMAS.items():
+            dbapi_connection.execute(f'PRAGMA {pragma} = {value}')
+        if read_only:
+            dbapi_connection.execute('PRAGMA query_only = ON')
+    return on_connect
+
+
+def get_engine(path_to_db, read_only=True):
+    """ Return this process's engine for a sqlite connection string
+
+        Engines are created once and keep a pool of connections. A forked
+        child creates its own engines rather than use its parent's
+        connections.
+    """
+    key = (path_to_db, read_only)
+    if key not in _engines:
+        engine = create_engine(path_to_db, poolclass=QueuePool,
+                               connect_args={'check_same_thread': False})
+        event.listen(engine, 'connect', set_connection_pragmas(read_only))
+        _engines[key] = engine
+    return _engines[key]
+
+
+def reset_engines_after_fork():
+    """ Forget engines inherited by a forked child without closing the
+        parent's connections
+    """
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _engines.clear()
+
+
+os.register_at_fork(after_in_child=reset_engines_after_fork)
+
+
+def get_database_file(path_to_db):
+    """Returns the file path of a sqlite connection string"""
+    return make_url(path_to_db).database
+
+
+def get_columnar_store_path(path_to_db):
+    """Returns the columnar store directory kept next to the database"""
+    database = get_database_file(path_to_db)
+    return os.path.join(os.path.dirname(database), 'columnar')
+
+
+def to_epoch_minutes(value):
+    """Returns a date or datetime as stored, in minutes since 1970-01-01"""
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    return (value - datetime.datetime(1970, 1, 1)) // \
+        datetime.timedelta(minutes=1)
+
+
+def get_rss():
+    """ Returns the resident memory of this process in bytes, or None where
+        /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return None
+
+
+def run_with_peak_rss(func, interval=0.005):
+    """ Returns the result of func and the peak resident memory in bytes
+        sampled while it ran
+
+        Sampling in a thread keeps func at full speed, but can miss peaks
+        shorter than the interval. Falls back to the peak of the whole
+        process where /proc is not available.
+    """
+    samples = [get_rss()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            samples.append(get_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = func()
+    finally:
+        done.set()
+        sampler.join()
+    samples.append(get_rss())
+    if samples[0] is None:
+        return result, resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result, max(samples)
+
+
+def get_cpu_seconds():
+    """ Returns CPU time used by this process and its finished children """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime \
+        + children.ru_stime
+
+
+def get_profiled_stages():
+    """ Returns the stages to profile from PIPELINE_PROFILE, a comma
+        separated list of stage names or 'all'
+    """
+    return set(filter(None, os.environ.get('PIPELINE_PROFILE', '')
+                      .split(',')))
+
+
+def get_frame_bytes(frame):
+    """ Returns the in-memory size of a dataframe in bytes """
+    return int(frame.memory_usage(deep=True).sum())
+
+
+def get_bytes_read():
+    """ Returns the bytes this process has read through system calls, or
+        None where /proc is not available
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def count_bytes_read(since):
+    """ Returns the bytes read since an earlier get_bytes_read, or None """
+    now = get_bytes_read()
+    if since is None or now is None:
+        return None
+    return now - since
+
+
+def record_input(name, rows_in, rows_out, bytes_read):
+    """ Records one input of the running stage, ignored outside a stage """
+    if _stage_inputs:
+        _stage_inputs[-1].append(
+            InputStats(name, rows_in, rows_out, bytes_read))
+
+
+@contextmanager
+def collect_inputs():
+    """ Collects the inputs recorded until the block ends into the yielded
+        list, instead of the running stage
+    """
+    inputs = []
+    _stage_inputs.append(inputs)
+    try:
+        yield inputs
+    finally:
+        _stage_inputs.pop()
+
+
+def add_known(values):
+    """ Returns the sum of values that are not None, None if all are """
+    values = [v for v in values if v is not None]
+    return sum(values) if values else None
+
+
+def summarize_inputs(inputs, result):
+    """ Returns the rows read and kept and the bytes read by a stage
+
+        Stages that record no inputs are counted from the LoadStats or
+        dataframe they returned, which only gives the rows kept.
+    """
+    if not inputs:
+        rows = len(result) if isinstance(result, pd.DataFrame) \
+            else getattr(result, 'rows', None)
+        return None, rows, None
+    return (add_known(i.rows_in for i in inputs),
+            add_known(i.rows_out for i in inputs),
+            add_known(i.bytes_read for i in inputs))
+
+
+def run_stage(stages, name, func, *args, **kwargs):
+    """ Runs one pipeline stage and appends its measurements to stages
+
+        Wall and CPU time, peak resident memory and the inputs recorded by
+        the stage are kept, each with the rows read and kept and the bytes
+        read, with their totals. Bytes read are the size of raw and cache
+        files, the in-memory size of rows fetched from the database or
+        handed over from an earlier stage, and, for stages working inside
+        sqlite, what sqlite read from the database file. CPU time includes
+        worker processes that finished during the stage, peak memory only
+        covers this process. Stages named in
+        PIPELINE_PROFILE are run under cProfile, with stats written next to
+        the run report.
+    """
+    logger = logging.getLogger(__name__)
+    profiled = get_profiled_stages()
+    profile = None
+    if name in profiled or 'all' in profiled:
+        profile = cProfile.Profile()
+
+    def call():
+        if profile is None:
+            return func(*args, **kwargs)
+        return profile.runcall(func, *args, **kwargs)
+
+    started, cpu_started = time.perf_counter(), get_cpu_seconds()
+    with collect_inputs() as inputs:
+        result, peak_rss = run_with_peak_rss(call)
+    rows_in, rows_out, bytes_read = summarize_inputs(inputs, result)
+    stage = {
+        'stage': name,
+        'wall_seconds': time.perf_counter() - started,
+        'cpu_seconds': get_cpu_seconds() - cpu_started,
+        'rows_in': rows_in,
+        'rows_out': rows_out,
+        'bytes_read': bytes_read,
+        'inputs': [i._asdict() for i in inputs],
+        'peak_rss_mb': peak_rss / 1024 ** 2,
+        'pipeline': getattr(result, 'pipeline', None),
+        'profile': None
+    }
+    if profile is not None:
+        os.makedirs(get_run_report_dir(), exist_ok=True)
+        stage['profile'] = os.path.join(
+            get_run_report_dir(),
+            f'{datetime.datetime.now():%Y%m%dT%H%M%S}-{name}.prof')
+        profile.dump_stats(stage['profile'])
+    logger.info(f'{name}: {stage["wall_seconds"]:.2f}s wall, '
+                f'{stage["cpu_seconds"]:.2f}s cpu, '
+                f'{rows_in} rows in, {rows_out} rows out, '
+                f'peak {stage["peak_rss_mb"]:.0f} MB')
+    stages.append(stage)
+    return result
+
+
+def get_run_report_dir():
+    """ Returns the directory of run reports and profiles, reports/runs """
+    return os.path.join('reports', 'runs')
+
+
+def write_run_report(name, stages, started_at, path=None):
+    """ Writes the stages of a run as JSON, returning the report path
+
+        The path defaults to PIPELINE_REPORT, then to a timestamped file in
+        reports/runs. Pipeline settings from the environment are included.
+    """
+    settings = {k: v for k, v in os.environ.items()
+                if k.split('_')[0] in REPORTED_SETTINGS}
+    report = {
+        'name': name,
+        'started_at': started_at.isoformat(),
+        'wall_seconds': sum(s['wall_seconds'] for s in stages),
+        'cpu_seconds': sum(s['cpu_seconds'] for s in stages),
+        'peak_rss_mb': max((s['peak_rss_mb'] for s in stages), default=None),
+        'settings': settings,
+        'stages': stages
+    }
+    if path is None:
+        path = os.environ.get('PIPELINE_REPORT') or os.path.join(
+            get_run_report_dir(),
+            f'{name}-{started_at:%Y%m%dT%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+import os
+import shutil
+import pandas as pd
+import build_features
+import build_flight_features
+import export_columnar
+from feature_helpers import run_stage
+
+
+def get_frames():
+    weather = pd.DataFrame({
+        'airport': ['MDT', 'MDT', 'ATL'],
+        'measurement_hour': pd.to_datetime(
+            ['2017-01-02 10:00', '2017-01-02 13:00', '2017-01-02 05:00']),
+        'hourly_visibility': [10.0, 2.0, 7.0]
+    })
+    flights = pd.DataFrame({
+        'origin': ['MDT', 'MDT', 'MDT', 'MDT', 'ATL'],
+        'departure_time': pd.to_datetime(
+            ['2017-01-02 13:00', '2017-01-02 13:40', '2017-01-02 14:30',
+             '2017-01-02 16:00', '2017-01-02 13:30'])
+    })
+    return weather, flights
+
+
+def merge(merge, tolerance=build_features.DEFAULT_TOLERANCE):
+    weather, flights = get_frames()
+    merged = build_features.merge_departure_weather_data(
+        weather, flights, hour_shift=3, merge=merge, tolerance=tolerance)
+    return dict(zip(merged['departure_time'].dt.strftime('%H:%M'),
+                    merged['hourly_visibility']))
+
+
+def test_exact_merge_keeps_departures_on_shifted_hours():
+    assert merge('exact') == {'13:00': 10.0, '16:00': 2.0}
+
+
+def test_asof_merge_keeps_departures_between_hours():
+    # 13:40 has no exact hour, 14:30 and the ATL departure have no
+    # observation within the hour before them
+    assert merge('asof') == {'13:00': 10.0, '13:40': 10.0, '16:00': 2.0}
+
+
+def test_asof_merge_respects_the_tolerance():
+    assert merge('asof', timedelta(hours=2)) == \
+        {'13:00': 10.0, '13:40': 10.0, '14:30': 10.0, '16:00': 2.0}
+    assert merge('asof', timedelta(minutes=30)) == \
+        {'13:00': 10.0, '16:00': 2.0}
+
+
+def test_compare_merge_retention_counts_departures_kept():
+    weather, flights = get_frames()
+
+    retention = build_features.compare_merge_retention(weather, flights)
+
+    assert retention.loc['MDT', 'departures'] == 4
+    assert retention.loc['MDT', 'exact_departures'] == 2
+    assert retention.loc['MDT', 'asof_departures'] == 3
+    assert retention.loc['ATL', 'asof_retention'] == 0
+
+
+def test_feature_stage_records_its_inputs(ingested_database, tmp_path,
+                                          monkeypatch):
+    monkeypatch.setenv('FEATURE_CACHE', '1')
+    # the cache is kept next to the copied database, under tmp_path
+    database = tmp_path / 'data' / 'processed' / 'airlines.db'
+    os.makedirs(database.parent)
+    shutil.copy(ingested_database[len('sqlite:///'):], database)
+    stages = []
+    for _ in range(2):
+        features = run_stage(
+            stages, 'build_features',
+            build_features.get_features_for_delay_classification,
+            date(2017, 1, 1), date(2017, 2, 1), 'all',
+            'sqlite:///' + str(database), merge='asof')
+
+    built, cached = [stage['inputs'] for stage in stages]
+    assert [i['input'] for i in built] == ['flights', 'weather']
+    assert built[0]['rows_out'] == len(features) <= built[0]['rows_in']
+    assert built[1]['rows_out'] <= built[1]['rows_in']
+    assert all(i['bytes_read'] > 0 for i in built)
+    # a cache hit reads the cached entry instead
+    assert len(cached) == 1
+    assert cached[0]['input'].endswith('.parquet')
+    assert cached[0]['rows_in'] == cached[0]['rows_out'] == len(features)
+    assert cached[0]['bytes_read'] == os.path.getsize(cached[0]['input'])
+
+
+def test_flight_backends_return_the_same_types(ingested_database, tmp_path):
+    database = str(tmp_path / 'airlines.db')
+    shutil.copy(ingested_database[len('sqlite:///'):], database)
+    path_to_db = 'sqlite:///' + database
+    export_columnar.export_columnar_store(path_to_db)
+
+    flights = {
+        backend: build_flight_features.get_departing_flights(
+            date(2017, 1, 1), date(2017, 2, 1), 'all', path_to_db, backend)
+        .sort_values(['origin', 'departure_time_scheduled', 'carrier',
+                      'dest', 'distance'], kind='mergesort')
+        .reset_index(drop=True)
+        for backend in ['sqlite', 'parquet']}
+
+    for column, dtype in build_flight_features.DEPARTING_FLIGHT_DTYPES.items():
+        assert flights['parquet'][column].dtype == dtype
+    pd.testing.assert_frame_equal(flights['parquet'], flights['sqlite'],
+                                  check_categorical=False)
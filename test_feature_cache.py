@@ -0,0 +1,55 @@
+from datetime import date
+import os
+import shutil
+import pandas as pd
+import pytest
+import feature_cache
+import match_weather_stations as stations
+
+
+def get_key(**kwargs):
+    return feature_cache.get_cache_key(date(2017, 1, 1), date(2017, 2, 1),
+                                       'MDT', 3, **kwargs)
+
+
+def test_cache_key_depends_on_backend(monkeypatch):
+    monkeypatch.delenv('FEATURE_BACKEND', raising=False)
+    key = get_key()
+
+    assert get_key(backend='sqlite') == key
+    assert get_key(backend='parquet') != key
+
+
+def test_data_version_follows_the_stored_station_mapping(ingested_database,
+                                                         tmp_path):
+    database = str(tmp_path / 'stations.db')
+    shutil.copy(ingested_database[len('sqlite:///'):], database)
+    path_to_db = 'sqlite:///' + database
+    version = feature_cache.get_data_version(path_to_db)
+
+    # the mapping is rebuilt with the settings of the ingest, not of the
+    # process building features
+    stations.build_station_mapping(path_to_db, k=2, radius_km=5000)
+    rebuilt = feature_cache.get_data_version(path_to_db)
+    stations.build_station_mapping(path_to_db, k=1, radius_km=25)
+
+    assert rebuilt != version
+    assert feature_cache.get_data_version(path_to_db) == version
+
+
+def test_write_entry_leaves_no_partial_entry(tmp_path, monkeypatch):
+    entry = str(tmp_path / 'entry.parquet')
+    features = pd.DataFrame({'origin': ['MDT'], 'distance': [100]})
+    feature_cache.write_entry(features, entry)
+
+    def fail(self, path, *args, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', fail)
+    with pytest.raises(OSError):
+        feature_cache.write_entry(features.assign(distance=200), entry)
+
+    assert os.listdir(tmp_path) == ['entry.parquet']
+    assert pd.read_parquet(entry)['distance'].tolist() == [100]
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import generate_data
+import load_flight_data as flights
+from data_helpers import run_stage
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+
+# prints the rows read and the peak resident memory growth in bytes
+MEASURE_READ = """
+import sys
+sys.path[:0] = [{data!r}]
+import load_flight_data as flights
+from data_helpers import get_rss, run_with_peak_rss
+
+def stream(file_name):
+    return sum(len(chunk) for chunk in
+               flights.generate_flight_chunks(file_name, chunksize=2000))
+
+def read(file_name):
+    return len(flights.handle_flight_features(
+        flights.read_flight_data_from_csv(file_name)))
+
+# parse once first, so lazily allocated state is not counted
+stream({warm_up!r})
+rss = get_rss()
+rows, peak_rss = run_with_peak_rss(lambda: {func}({file_name!r}))
+print(rows, peak_rss - rss)
+"""
+
+
+def get_infer_time(value):
+    """ Return infer_time of a value, or None where it raises """
+    try:
+        return flights.infer_time(value)
+    except ValueError:
+        return None
+
+
+def test_infer_times_matches_infer_time():
+    values = pd.Series(list(range(10000)) + [np.nan, -1])
+    expected = values.apply(get_infer_time)
+    valid = expected.notna()
+
+    result = flights.infer_times(values[valid])
+
+    assert result.index.equals(values[valid].index)
+    assert result.tolist() == expected[valid].tolist()
+    for value in values[~valid]:
+        with pytest.raises(ValueError):
+            flights.infer_times(pd.Series([value]))
+
+
+def measure_read(func, file_name, warm_up):
+    code = MEASURE_READ.format(data=os.path.join(SRC_DIR, 'data'),
+                               func=func, file_name=file_name,
+                               warm_up=warm_up)
+    result = subprocess.run([sys.executable, '-c', code], check=True,
+                            capture_output=True, text=True)
+    rows, growth = result.stdout.split()
+    return int(rows), int(growth)
+
+
+def test_chunked_flight_read_memory_stays_bounded(tmp_path):
+    small = str(tmp_path / 'small.csv')
+    large = str(tmp_path / 'large.csv')
+    generate_data.generate_flights(small, 10000)
+    generate_data.generate_flights(large, 80000)
+
+    small_rows, small_growth = measure_read('stream', small, small)
+    large_rows, large_growth = measure_read('stream', large, small)
+    _, full_growth = measure_read('read', large, small)
+
+    assert (small_rows, large_rows) == (10000, 80000)
+    # a file eight times as large streams within the same memory budget
+    assert large_growth < small_growth + 16 * 1024 ** 2
+    assert large_growth < full_growth / 4
+
+
+def load_flights(root, name, **kwargs):
+    """ Load the flight files under root as a stage, return rows per file,
+        the manifest and the inputs recorded by the stage
+    """
+    path_to_db = 'sqlite:///' + str(root / name)
+    working_dir = os.getcwd()
+    stages = []
+    # the loader finds raw files relative to the working directory
+    os.chdir(root)
+    try:
+        stats = run_stage(stages, 'flights', flights.load_flight_data,
+                          path_to_db, **kwargs)
+    finally:
+        os.chdir(working_dir)
+    with sqlite3.connect(str(root / name)) as connection:
+        rows = connection.execute(
+            """
+            SELECT m.path, COUNT(f.source_file_id)
+            FROM ingest_manifest AS m
+            LEFT JOIN flights AS f ON f.source_file_id = m.file_id
+            GROUP BY m.path
+            ORDER BY m.path
+            """).fetchall()
+        manifest = connection.execute(
+            """
+            SELECT path, size, content_hash FROM ingest_manifest
+            ORDER BY path
+            """).fetchall()
+    inputs = sorted((i['input'], i['rows_in'], i['rows_out'],
+                     i['bytes_read']) for i in stages[0]['inputs'])
+    return stats.rows, rows, manifest, inputs
+
+
+def test_parallel_flight_ingest_matches_sequential(tmp_path):
+    for month in [1, 2, 3]:
+        generate_data.generate_flights(
+            generate_data.get_flight_file(str(tmp_path), 2017, month),
+            25000, month=month, seed=month)
+
+    sequential = load_flights(tmp_path, 'sequential.db')
+    # files of three chunks fit the chunks a worker parses ahead, so a
+    # worker may finish its file before it gets the writer
+    parallel = load_flights(tmp_path, 'parallel.db', workers=2)
+
+    assert sequential[0] == 75000
+    assert parallel == sequential
+    # every file is recorded with the rows read and kept and its size
+    _, rows, manifest, inputs = parallel
+    assert inputs == [(path, count, count, size) for (path, count),
+                      (_, size, _) in zip(rows, manifest)]
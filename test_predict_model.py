@@ -0,0 +1,66 @@
+from datetime import date
+import numpy as np
+import pandas as pd
+from sklearn.dummy import DummyClassifier
+import build_flight_features as flight_builder
+import predict_model
+
+
+def get_bundle(hour_shift=3, merge='asof'):
+    columns = predict_model.MODEL_COLUMNS
+    model = DummyClassifier(strategy='prior').fit(
+        np.zeros((2, len(columns))), [0, 1])
+    return {'model': model, 'columns': columns, 'hour_shift': hour_shift,
+            'merge': merge}
+
+
+def get_departures(origins, times):
+    departure_time = pd.to_datetime(times)
+    return pd.DataFrame({
+        'origin': origins,
+        'dest': 'ATL',
+        'carrier': 'DL',
+        'departure_time': departure_time,
+        'departure_month': departure_time.month,
+        'departure_date': departure_time.day,
+        'departure_hod': departure_time.hour,
+        'elapsed_time_scheduled': 120
+    })
+
+
+def test_predict_departures_scores_departures_after_midnight(
+        ingested_database, monkeypatch, caplog):
+    departures = get_departures(
+        ['MDT', 'MDT', 'LAX', 'MDT', 'XXX'],
+        ['2017-01-02 00:00', '2017-01-02 00:45', '2017-01-02 02:59',
+         '2017-01-02 12:00', '2017-01-02 12:00'])
+    monkeypatch.setattr(flight_builder,
+                        'build_features_for_departing_flights',
+                        lambda *args, **kwargs: departures.copy())
+
+    scores = predict_model.predict_departures(
+        date(2017, 1, 2), ingested_database, get_bundle())
+
+    assert scores['departure_time'].tolist() == \
+        departures['departure_time'].tolist()
+    # departures before 03:00 match the weather of the day before
+    assert scores['predicted_delay'][:4].notna().all()
+    # an airport without weather is kept and reported, not dropped
+    assert scores['predicted_delay'][4:].isna().all()
+    assert '1 of 5 departures on 2017-01-02' in caplog.text
+
+
+def test_predict_departures_uses_the_merge_of_the_model(
+        ingested_database, monkeypatch):
+    departures = get_departures(
+        ['MDT', 'MDT', 'MDT'],
+        ['2017-01-02 00:00', '2017-01-02 00:45', '2017-01-02 12:00'])
+    monkeypatch.setattr(flight_builder,
+                        'build_features_for_departing_flights',
+                        lambda *args, **kwargs: departures.copy())
+
+    scores = predict_model.predict_departures(
+        date(2017, 1, 2), ingested_database, get_bundle(merge='exact'))
+
+    # an exact merge, like in training, skips departures off the hour
+    assert scores['predicted_delay'].notna().tolist() == [True, False, True]
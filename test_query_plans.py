@@ -0,0 +1,30 @@
+from datetime import date
+import pytest
+import build_flight_features as flight_builder
+import build_weather_features as weather_builder
+from feature_helpers import get_query_plan
+
+# the large table of each feature query and the index it must search
+HOT_QUERIES = {
+    'departing_flights': (flight_builder.get_departing_flights_query,
+                          'f', 'ix_flights_origin_flight_date'),
+    'weather': (weather_builder.get_weather_query,
+                'w', 'ix_hourly_weather_station_measurement_hour')
+}
+
+
+@pytest.mark.parametrize('airport_codes', [['MDT'], ['MDT', 'ATL'], None])
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_feature_queries_search_their_index(ingested_database, name,
+                                            airport_codes):
+    get_query, alias, index = HOT_QUERIES[name]
+    query, params = get_query(date(2017, 1, 1), date(2017, 1, 8),
+                              airport_codes)
+
+    plan = get_query_plan(query, params, ingested_database)
+
+    # lookup tables of codes and stations may be scanned, they are small
+    steps = [step for step in plan if step.split()[:2] in
+             (['SCAN', alias], ['SEARCH', alias])]
+    assert len(steps) == 1
+    assert steps[0].startswith(f'SEARCH {alias} USING INDEX {index} ')
@@ -0,0 +1,43 @@
+from datetime import date
+import shutil
+import numpy as np
+import pandas as pd
+import build_features
+import build_weather_features as weather_builder
+import match_weather_stations as stations
+
+
+def test_select_nearest_stations_fills_missing_hours():
+    hours = pd.to_datetime(['2017-01-01 00:00', '2017-01-01 01:00'])
+    weather = pd.DataFrame({
+        'airport': ['MDT', 'MDT', 'MDT'],
+        'station_rank': [2, 1, 2],
+        'hourly_visibility': [5.0, 10.0, 7.0],
+        'measurement_hour': [hours[0], hours[0], hours[1]]
+    })
+
+    nearest = weather_builder.select_nearest_stations(weather)
+
+    assert 'station_rank' not in nearest
+    assert nearest['measurement_hour'].tolist() == hours.tolist()
+    assert nearest['hourly_visibility'].tolist() == [10.0, 7.0]
+
+
+def test_two_stations_per_airport_keep_one_row_per_departure(
+        ingested_database, tmp_path):
+    database = str(tmp_path / 'two_stations.db')
+    shutil.copy(ingested_database[len('sqlite:///'):], database)
+    path_to_db = 'sqlite:///' + database
+    # every generated airport has a second station within this radius
+    stations.build_station_mapping(path_to_db, k=2, radius_km=5000)
+
+    start_date, end_date = date(2017, 1, 1), date(2017, 2, 1)
+    one_station = build_features.get_features_for_delay_classification(
+        start_date, end_date, 'all', ingested_database, use_cache=False)
+    two_stations = build_features.get_features_for_delay_classification(
+        start_date, end_date, 'all', path_to_db, use_cache=False)
+
+    # the nearest station reports every hour, so it is always the one kept
+    assert len(two_stations) == len(one_station)
+    assert np.allclose(two_stations['hourly_visibility'].fillna(-1),
+                       one_station['hourly_visibility'].fillna(-1))